@@ -1,22 +1,24 @@
+import functools
 import logging
 import os
 import sys
 import signal
 import types
-import time
 import ssl
-from datetime import datetime
 
 import irc.strings
 from irc.bot import SingleServerIRCBot
 from irc.client import ip_numstr_to_quad
 
+from stockbot.concurrency import BoundedExecutor, FanOut, TaskPool
 from stockbot.configuration import configuration
 from stockbot.db import create_tables
-from stockbot.persistence import DatabaseCollection, ScheduledCommand
+from stockbot.persistence import CommandSchedule, DatabaseCollection, ScheduledCommand
 from stockbot.command import root_command
+from stockbot.output import MessagePacker, OutputQueue
 from stockbot.provider import QuoteServiceFactory
-from stockbot.util import colorify
+from stockbot.render import IrcRenderer
+from stockbot.schedule import CommandTimer, command_schedules
 
 
 # Set up logging
@@ -26,29 +28,7 @@ logging.basicConfig(level=getattr(logging, LOGLEVEL),
 LOGGER = logging.getLogger(__name__)
 
 
-class ScheduleHandler(object):
-
-    days = [1, 2, 3, 4, 5]
-    hours = [9, 10, 11, 12, 13, 14, 15, 16, 17]
-
-    def timer_should_execute(self, dt):
-        """
-
-        :param dt:
-        :type dt: datetime
-        :return:
-        """
-        return (dt.isoweekday() in self.days) and (dt.hour in self.hours)
-
-
-class ScheduleHandlerAlways(object):
-
-    @staticmethod
-    def timer_should_execute(*args):
-        return True
-
-
-class IRCBot(SingleServerIRCBot, ScheduleHandlerAlways):
+class IRCBot(SingleServerIRCBot):
 
     def __init__(self, **kwargs):
         super(IRCBot, self).__init__([(configuration.server_name, int(configuration.server_port), configuration.server_password)], configuration.nick,
@@ -57,12 +37,30 @@ class IRCBot(SingleServerIRCBot, ScheduleHandlerAlways):
         self.failed_health_checks = 0
         self.max_failed_health_checks = 10
         self.scheduler = configuration.scheduler
-        self.reactor.scheduler.execute_every(60, self.stock_check_scheduler)
         self.reactor.scheduler.execute_every(60, self.health_check)
+        # replies are queued and sent from the reactor loop so that the flood limiting never blocks the bot
+        self.output_queue = OutputQueue(send=self.send_message)
+        self.message_packer = MessagePacker()
+        self.reactor.scheduler.execute_every(0.25, self.output_queue.drain)
+        # commands run on a pool of workers, the reactor thread only reads the socket and sends the queued replies
+        self.command_executor = BoundedExecutor(name="command", max_workers=int(configuration.command_workers),
+                                                max_pending=int(configuration.command_queue_size))
         self.quote_service_factory = QuoteServiceFactory()
+        if self.quote_service_factory.history is not None:
+            self.reactor.scheduler.execute_every(60, self.quote_service_factory.history.flush)
         self.commands = DatabaseCollection(type=ScheduledCommand, attribute="command")
+        self.schedules = DatabaseCollection(type=CommandSchedule)
+        # commands without a schedule of their own run this often
         self.scheduler_interval = 3600
-        self.last_check = None
+        # next run of every scheduled command, the reactor is woken up when the first one is due instead of polling
+        self.command_timer = CommandTimer()
+        # the commands that are due at the same time run side by side, one of them per command at most
+        self.schedule_pool = TaskPool(name="schedule", max_workers=int(configuration.schedule_workers),
+                                      max_pending=int(configuration.schedule_queue_size))
+        self.schedule_summary = None
+        self.timer_armed = None
+        self.timer_generation = 0
+        self.reschedule()
 
     def health_check(self):
         if self.connection.is_connected():
@@ -74,34 +72,62 @@ class IRCBot(SingleServerIRCBot, ScheduleHandlerAlways):
                              .format(60 * self.failed_health_checks))
                 self.die("BAI")
 
-    def stock_check_scheduler(self):
-
-        if not self.scheduler:
-            LOGGER.debug("Scheduler is disabled")
-            return
-
-        if not self.connection.is_connected():
-            LOGGER.debug("Not connected yet, hold off")
-            return
-
-        now = datetime.now()
+    def reschedule(self):
+        """
+        sync the timer with the scheduled commands, needs to be called whenever the commands, their schedules or the
+        default interval change
+        """
+        self.command_timer.sync(command_schedules(self.commands, self.schedules, self.scheduler_interval))
+        self.arm_timer()
 
-        if self.last_check is not None:
-            if int(now.timestamp()) - self.last_check < self.scheduler_interval:
+    def arm_timer(self):
+        next_run = self.command_timer.next_run()
+        with self.reactor.mutex:
+            if next_run is None or (self.timer_armed is not None and self.timer_armed <= next_run):
                 return
-
-        # TODO: not so configurable, fix
-        if not self.timer_should_execute(now):
-            return
-
-        for command in self.commands:
-            try:
-                root_command.execute(*command.split(" "), command_args={"service_factory": self.quote_service_factory,
-                                     "instance": self}, callback=self.command_callback, callback_args={})
-            except Exception as e:
-                LOGGER.exception("failed to execute scheduled command '{}'".format(command))
-
-        self.last_check = int(now.timestamp())
+            # a wake up that was armed earlier for a later time is superseded by this one and ignored when it fires
+            self.timer_generation += 1
+            self.timer_armed = next_run
+            delay = max(0.0, (next_run - self.command_timer.clock()).total_seconds())
+            self.reactor.scheduler.execute_after(delay, functools.partial(self.run_due_commands,
+                                                                          self.timer_generation))
+
+    def run_due_commands(self, generation):
+        with self.reactor.mutex:
+            if generation != self.timer_generation:
+                return
+            self.timer_armed = None
+
+        due = self.command_timer.pop_due()
+        if len(due) > 0:
+            if not self.scheduler:
+                LOGGER.debug("Scheduler is disabled, skipping {}".format(due))
+            elif not self.connection.is_connected():
+                LOGGER.debug("Not connected yet, skipping {}".format(due))
+            else:
+                self.execute_scheduled_commands(due)
+        self.arm_timer()
+
+    def execute_scheduled_commands(self, commands):
+        """
+        start the commands on the schedule pool and return right away, nobody waits for them. The summary is kept
+        when the last one is done or at the deadline, which the reactor fires.
+        """
+        jobs = [(command, self.execute_scheduled_command, (command,)) for command in commands]
+        run = FanOut(pool=self.schedule_pool, jobs=jobs, callback=self.scheduled_commands_done).start()
+        self.reactor.scheduler.execute_after(float(configuration.schedule_deadline), run.expire)
+
+    def scheduled_commands_done(self, summary):
+        self.schedule_summary = summary
+        LOGGER.info("Scheduled run: {}".format(summary))
+
+    def execute_scheduled_command(self, command):
+        try:
+            root_command.execute(*command.split(" "), command_args={"service_factory": self.quote_service_factory,
+                                 "instance": self}, callback=self.command_callback, callback_args={})
+        except Exception as e:
+            LOGGER.exception("failed to execute scheduled command '{}'".format(command))
+            raise
 
     def on_nicknameinuse(self, c, e):
         c.nick(c.get_nickname() + "_")
@@ -118,9 +144,7 @@ class IRCBot(SingleServerIRCBot, ScheduleHandlerAlways):
         sender = e.source.nick
         message = e.arguments[0]
         commands = [irc.strings.lower(x) for x in message.split(" ")]
-        root_command.execute(*commands, command_args={"service_factory": self.quote_service_factory,
-                                                      "instance": self, "sender": sender},
-                             callback=self.command_callback_priv, callback_args={"sender": sender})
+        self.dispatch(commands, sender, self.command_callback_priv)
 
     def on_pubmsg(self, c, e):
         sender = e.source.nick
@@ -131,46 +155,55 @@ class IRCBot(SingleServerIRCBot, ScheduleHandlerAlways):
 
         if to_me:
             commands = [irc.strings.lower(x) for x in split[1:]]
+            self.dispatch(commands, sender, self.command_callback)
+
+    def dispatch(self, commands, sender, callback):
+        """
+        execute the command on one of the command workers, the callback only enqueues the result on the output
+        queue which is drained by the reactor
+        """
+        def execute():
             try:
                 root_command.execute(*commands, command_args={"service_factory": self.quote_service_factory,
                                                               "instance": self, "sender": sender},
-                                     callback=self.command_callback, callback_args={"sender": sender})
+                                     callback=callback, callback_args={"sender": sender})
             except Exception as e:
-                LOGGER.exception("something failed", e)
-                self.command_callback("something failed", sender=sender)
+                LOGGER.exception("something failed")
+                callback("something failed", sender=sender)
+
+        if self.command_executor.submit(execute) is None:
+            callback("Too busy right now, try again in a bit", sender=sender)
 
     def command_callback_priv(self, result, **kwargs):
         target = kwargs.get('sender', None)
         if isinstance(result, list) or isinstance(result, types.GeneratorType):
-            for row in result:
-                self.colorify_send(target, str(row))
-                time.sleep(1)  # avoid getting kicked out from server
+            self.send_results(target, result)
         elif result is not None:
-            self.colorify_send(target, str(result))
+            self.send_result(target, result)
 
     def command_callback(self, result, **kwargs):
         if isinstance(result, list) or isinstance(result, types.GeneratorType):
-            for row in result:
-                self.colorify_send(self.channel, str(row))
-                time.sleep(1)  # avoid getting kicked out from server
+            self.send_results(self.channel, result)
         elif result is not None:
-            self.colorify_send(self.channel, str(result))
-
-    def colorify_send(self, target, msg):
-        # irc.client.MessageTooLong: Messages limited to 512 bytes including CR/LF
-        colored_message = colorify(msg)
-        if len(colored_message) > 512:
-            self.connection.privmsg(target, msg[:512])
-        else:
-            self.connection.privmsg(target, colored_message)
-
-    def colorify_notice(self, target, msg):
-        # irc.client.MessageTooLong: Messages limited to 512 bytes including CR/LF
-        colored_message = colorify(msg)
-        if len(colored_message) > 512:
-            self.connection.notice(target, msg[:512])
-        else:
-            self.connection.notice(target, colored_message)
+            self.send_result(self.channel, result)
+
+    def send_result(self, target, result, method="privmsg"):
+        budget = self.message_packer.budget(target, method)
+        for message in self.message_packer.split(IrcRenderer.render_segments(result), IrcRenderer.separator, budget):
+            self.output_queue.put(target, message, method=method)
+
+    def send_results(self, target, results, method="privmsg"):
+        # short rows share a message, long ones are split between fields
+        budget = self.message_packer.budget(target, method)
+        lines = []
+        for result in results:
+            lines.extend(self.message_packer.split(IrcRenderer.render_segments(result), IrcRenderer.separator,
+                                                   budget))
+        for message in self.message_packer.pack(lines, budget):
+            self.output_queue.put(target, message, method=method)
+
+    def send_message(self, method, target, msg):
+        getattr(self.connection, method)(target, msg)
 
     def on_dccmsg(self, c, e):
         # non-chat DCC messages are raw bytes; decode as text
@@ -201,6 +234,8 @@ if __name__ == '__main__':
     bot = IRCBot(**kwargs)
 
     def sigterm_handler(*args):
+        if bot.quote_service_factory.history is not None:
+            bot.quote_service_factory.history.flush(force=True)
         bot.die("kthxbai")
         sys.exit(0)
 
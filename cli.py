@@ -5,15 +5,22 @@ import logging
 
 from stockbot.provider import QuoteServiceFactory
 from stockbot.command import root_command
+from stockbot.render import PlainRenderer, JsonRenderer
+
+args = sys.argv[1:]
+renderer = PlainRenderer
+if len(args) > 0 and args[0] == "--json":
+    renderer = JsonRenderer
+    args = args[1:]
 
 
 def callback(result):
     if isinstance(result, list):
-        print("\n".join(result))
+        print("\n".join([renderer.render(x) for x in result]))
     elif result is not None:
-        print(result)
+        print(renderer.render(result))
     else:
         root_command.execute(*["help"], callback=callback)
 
 
-root_command.execute(*sys.argv[1:], command_args={"service_factory": QuoteServiceFactory()}, callback=callback)
+root_command.execute(*args, command_args={"service_factory": QuoteServiceFactory()}, callback=callback)
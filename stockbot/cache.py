@@ -0,0 +1,152 @@
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from stockbot.configuration import configuration
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TTLCache(object):
+
+    """
+    Thread safe cache bounded both in size (least recently used entry is evicted first) and in time
+    (entries expire after ttl seconds)
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.name = kwargs.get('name', None)
+        self.max_entries = kwargs.get('max_entries', 256)
+        self.ttl = kwargs.get('ttl', 3600)
+        self.clock = kwargs.get('clock', time.monotonic)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                expires, value = entry
+                if expires > self.clock():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            return entry is not None and entry[0] > self.clock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def __str__(self):
+        return "Cache: {name}, Entries: {entries}, Hits: {hits}, Misses: {misses}, Evictions: {evictions}"\
+            .format(**self.stats())
+
+
+class QuoteCache(object):
+
+    """
+    Cache of quotes keyed by (provider, instrument) where the time to live is derived from the quote's own update
+    timestamp. The instrument is what the provider resolves the ticker to, so every spelling of the same instrument
+    shares one entry. A quote that updated within the delay window of the provider is live and only kept until a newer
+    print can show up, a quote that hasn't moved in a long time (closed market) is kept for longer. Quotes that
+    don't expose a timestamp are never cached.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.min_ttl = int(kwargs.get('min_ttl', configuration.quote_cache_min_ttl))
+        self.max_ttl = int(kwargs.get('max_ttl', configuration.quote_cache_max_ttl))
+        # most tickers are lagging 15 minutes so add another minute, same as BaseQuote.is_fresh
+        self.live_window = kwargs.get('live_window', 16 * 60)
+        self.cache = TTLCache(name="quotes", max_entries=kwargs.get('max_entries', 1024), ttl=self.max_ttl)
+
+    def ttl(self, quote, now=None):
+        get_timestamp = getattr(quote, "get_timestamp", None)
+        if not callable(get_timestamp):
+            return None
+        timestamp = get_timestamp()
+        if not isinstance(timestamp, datetime):
+            return None
+        age = ((now or datetime.now()) - timestamp).total_seconds()
+        return min(self.max_ttl, max(self.min_ttl, age - self.live_window))
+
+    def get(self, provider, instrument):
+        return self.cache.get((provider, instrument))
+
+    def put(self, provider, instrument, quote):
+        ttl = self.ttl(quote)
+        if ttl is not None:
+            LOGGER.debug("Caching quote for '{i}' from '{p}' for {s} seconds".format(i=instrument, p=provider, s=ttl))
+            self.cache.set((provider, instrument), quote, ttl=ttl)
+
+    def wrap(self, provider, get_quote, resolve):
+        @functools.wraps(get_quote)
+        def cached_get_quote(ticker):
+            try:
+                instrument = resolve(ticker)
+            except Exception as e:
+                LOGGER.exception("Failed to resolve '{}', not using the cache".format(ticker))
+                return get_quote(ticker)
+            quote = self.get(provider, instrument)
+            if quote is None:
+                quote = get_quote(ticker)
+                self.put(provider, instrument, quote)
+            return quote
+        return cached_get_quote
+
+    def wrap_async(self, provider, aget_quote, aresolve):
+        @functools.wraps(aget_quote)
+        async def cached_aget_quote(ticker):
+            try:
+                instrument = await aresolve(ticker)
+            except Exception as e:
+                LOGGER.exception("Failed to resolve '{}', not using the cache".format(ticker))
+                return await aget_quote(ticker)
+            quote = self.get(provider, instrument)
+            if quote is None:
+                quote = await aget_quote(ticker)
+                self.put(provider, instrument, quote)
+            return quote
+        return cached_aget_quote
+
+    def stats(self):
+        return self.cache.stats()
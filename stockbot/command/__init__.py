@@ -1,8 +1,14 @@
-import threading
 import logging
 
+from stockbot.concurrency import TaskPool, TaskRejected
+from stockbot.configuration import configuration
+
 LOGGER = logging.getLogger(__name__)
 
+# background tasks (scrapes etc) share a small pool so that a burst of requests can't spawn unbounded threads
+task_pool = TaskPool(name="task", max_workers=int(configuration.task_workers),
+                     max_pending=int(configuration.task_queue_size))
+
 
 class Command(object):
 
@@ -14,10 +20,26 @@ class Command(object):
         self.help = kwargs.get('help', None)
         self.parent_command = None
         self.subcommands = []
+        self.index = {}
+        self.help_table = None
 
     def register(self, command):
         command.parent_command = self
         self.subcommands.append(command)
+        # first registered command wins on name clashes, same as scanning the subcommands in order
+        for name in (command.name, command.short_name):
+            if name is not None:
+                self.index.setdefault(name, command)
+        self.invalidate_help()
+
+    def invalidate_help(self):
+        command = self
+        while command is not None:
+            command.help_table = None
+            command = command.parent_command
+
+    def lookup(self, name):
+        return self.index.get(name, None)
 
     def execute(self, *args, **kwargs):
         """
@@ -28,10 +50,10 @@ class Command(object):
         """
         e = args[0]
         LOGGER.debug("Item: {}".format(e))
-        c = [x for x in self.subcommands if x.name == e or x.short_name == e]
-        if len(c) == 0:
+        c = self.lookup(e)
+        if c is None:
             return None
-        return c[0].execute(*args[1:], **kwargs)
+        return c.execute(*args[1:], **kwargs)
 
     def __repr__(self):
         help_output = [self.name]
@@ -52,10 +74,9 @@ class Command(object):
                     if len(path[-1].subcommands) == 0:
                         rooted_paths.append([root] + path)
             return rooted_paths
-        rv = []
-        for c in paths(self)[1:]:
-            rv.append(" ".join([str(x) for x in c[1:]]))
-        return sorted(rv)
+        if self.help_table is None:
+            self.help_table = sorted(" ".join([str(x) for x in c[1:]]) for c in paths(self)[1:])
+        return list(self.help_table)
 
     def printable_self_help(self):
         return "Usage: {}".format(self.help)
@@ -96,51 +117,33 @@ class NonBlockingExecuteCommand(Command):
     def __init__(self, *args, **kwargs):
         super(NonBlockingExecuteCommand, self).__init__(*args, **kwargs)
         self.exclusive = kwargs.get('exclusive', True)
+        self.task_pool = kwargs.get('task_pool', task_pool)
 
     def execute(self, *args, **kwargs):
         cb = kwargs.get('callback', None)
         cb_args = kwargs.get('callback_args', {})
-        thread_name = "thread-{}".format("_".join(args))
-        if self.exclusive and self.is_already_running(thread_name):
-            if callable(cb):
-                return cb("Task is currently running, hold your horses")
-            return "Task is currently running, hold your horses"
-        if callable(self.execute_command):
-            thread = CommandThread(name=thread_name, target=self.execute_command, args=args,
-                                   kwargs=kwargs.get('command_args'), daemon=False)
-            thread.set_callback(cb, cb_args)
-            thread.start()
-        else:
+        if not callable(self.execute_command):
             raise RuntimeError("execute_command not callable")
+        try:
+            self.task_pool.submit_task((self.name,) + args, self.__run, args, kwargs.get('command_args'), cb, cb_args,
+                                       exclusive=self.exclusive)
+        except TaskRejected as e:
+            if callable(cb):
+                return cb(str(e), **cb_args)
+            return str(e)
         if callable(cb):
-            return cb("Task started")
+            return cb("Task started", **cb_args)
         return "Task started"
 
-    @staticmethod
-    def is_already_running(thread_name):
-        return len([t for t in threading.enumerate() if t.name == thread_name]) > 0
-
-
-#
-# Thread wrapper
-#
-class CommandThread(threading.Thread):
-
-    def __init__(self, *args, **kwargs):
-        super(CommandThread, self).__init__(*args, **kwargs)
-        self._callback = None
-        self._callback_args = {}
-
-    def set_callback(self, cb, cb_args):
-        self._callback = cb
-        self._callback_args = cb_args
-
-    def run(self):
-        # block until task has finished
-        result = self._target(*self._args, **self._kwargs)
-
-        if callable(self._callback):
-            self._callback(result, **self._callback_args)
+    def __run(self, args, command_args, cb, cb_args):
+        try:
+            result = self.execute_command(*args, **command_args)
+        except Exception as e:
+            LOGGER.exception("task '{}' failed".format(" ".join((self.name,) + args)))
+            result = "Task failed: {}".format(e)
+        if callable(cb):
+            cb(result, **cb_args)
+        return result
 
 
 root_command = Command(name="root")
@@ -154,3 +157,4 @@ import stockbot.command.insider
 import stockbot.command.ibindex
 import stockbot.command.news
 import stockbot.command.scheduler
+import stockbot.command.stats
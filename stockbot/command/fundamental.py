@@ -1,10 +1,14 @@
 from . import root_command, Command, BlockingExecuteCommand
 from stockbot.provider import StockDomain
 from stockbot.db import Session
+from stockbot.screener import Screen, StockScreener
 import logging
 
 LOGGER = logging.getLogger(__name__)
 
+# in memory copy of the stocks table, reloaded whenever a scrape has updated it
+screener = StockScreener()
+
 
 def get_fundamental(*args, **kwargs):
     duration_mapper = {
@@ -77,11 +81,22 @@ def stock_analytics_top(*args, **kwargs):
         return rv
 
 
+def stock_analytics_screen(*args, **kwargs):
+    try:
+        screen = Screen.parse(args)
+        return screener.screen(screen).as_list()
+    except ValueError as e:
+        return ["Error: {}".format(e)]
+
+
 fundamental_command = Command(name="fundamental", short_name="fa")
 fundamental_command.register(BlockingExecuteCommand(name="get", execute_command=get_fundamental, help="<ticker> <q|y>",
                                                     expected_num_args=2))
 fundamental_command.register(BlockingExecuteCommand(name="fields", execute_command=stock_analytics_fields))
 fundamental_command.register(BlockingExecuteCommand(name="top", execute_command=stock_analytics_top,
                                                     help="<count> <field> (optional 'desc')", expected_num_args=2))
+fundamental_command.register(BlockingExecuteCommand(name="screen", execute_command=stock_analytics_screen,
+                                                    help="<field><op><value> [...] [sort <field> [desc]] [limit <n>]",
+                                                    expected_num_args=1))
 
 root_command.register(fundamental_command)
@@ -1,6 +1,6 @@
 from . import root_command, Command, BlockingExecuteCommand, NonBlockingExecuteCommand
 from ..configuration import configuration
-from requests import get
+from ..transport import get_default_transport
 from requests.auth import HTTPBasicAuth
 from libfi import StatisticsHelper
 from libfi.util import TransactionJSONDecoder
@@ -13,12 +13,13 @@ LOGGER = logging.getLogger(__name__)
 
 class Client(object):
 
-    def __init__(self, base_url, username, password):
+    def __init__(self, base_url, username, password, transport=None):
         self.base_url = base_url
         self.auth = HTTPBasicAuth(username, password)
+        self.transport = transport or get_default_transport()
 
     def get_fi_insider_transactions(self, d):
-        response = get("{}/api/fi/insider/{}/transactions".format(self.base_url, d), auth=self.auth)
+        response = self.transport.get("{}/api/fi/insider/{}/transactions".format(self.base_url, d), auth=self.auth)
         response.raise_for_status()
         transactions = json.loads(response.text, cls=TransactionJSONDecoder)
         return transactions
@@ -28,15 +29,15 @@ class Client(object):
             _url = "{}/api/fi/insider/{}/top-{}/{}".format(self.base_url, d, t, venue)
         else:
             _url = "{}/api/fi/insider/{}/top-{}".format(self.base_url, d, t)
-        response = get(_url, auth=self.auth)
+        response = self.transport.get(_url, auth=self.auth)
         response.raise_for_status()
         top_list = json.loads(response.text)
         return top_list
 
     @classmethod
-    def factory(cls):
+    def factory(cls, transport=None):
         return Client(base_url=configuration.lyheden_base_url, username=configuration.lyheden_username,
-                      password=configuration.lyheden_password)
+                      password=configuration.lyheden_password, transport=transport)
 
 
 def insider_helper(t, response):
@@ -82,7 +83,8 @@ def insider_top(*args, **kwargs):
     transaction_type = translation_table.get(args[0], args[0])
 
     try:
-        client = Client.factory()
+        service_factory = kwargs.get('service_factory', None)
+        client = Client.factory(transport=service_factory.transport if service_factory is not None else None)
         response = client.get_top(check_date, transaction_type, venue)
         result = insider_helper(transaction_type, response)
         return result
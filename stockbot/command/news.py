@@ -1,11 +1,11 @@
 from . import root_command, Command, BlockingExecuteCommand
 from lxml import html
 from stockbot.db import Base, Session
+from stockbot.transport import get_default_transport
 from sqlalchemy import Column, String, DateTime
 import datetime
 import hashlib
 import logging
-import requests
 
 LOGGER = logging.getLogger(__name__)
 
@@ -53,8 +53,9 @@ class NewsArticle(object):
         return "Message: {} - {}, Date: {}, Link: {}".format(self.topic, self.headline, self.date_, self.url)
 
 
-def get_articles(matches=(), sender=None):
-    req = requests.get("https://www.avanza.se/placera/telegram.plc.html")
+def get_articles(matches=(), sender=None, transport=None):
+    transport = transport or get_default_transport()
+    req = transport.get("https://www.avanza.se/placera/telegram.plc.html")
     req.raise_for_status()
     tree = html.fromstring(req.content)
     items = tree.xpath('//ul[@class="feedArticleList XSText"]/li[@class="item"]/a')
@@ -86,12 +87,14 @@ def get_articles(matches=(), sender=None):
 
 def get(*args, **kwargs):
     sender = kwargs.get('sender', None)
+    service_factory = kwargs.get('service_factory', None)
+    transport = service_factory.transport if service_factory is not None else None
     try:
         matches = [x.lower() for x in args[0].split(",")]
     except IndexError:
         matches = []
     try:
-        return get_articles(matches, sender)
+        return get_articles(matches, sender, transport)
     except Exception as e:
         LOGGER.exception("Error", e)
         return "Broken: {}".format(e)
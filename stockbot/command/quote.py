@@ -1,6 +1,8 @@
 from . import root_command, Command, BlockingExecuteCommand, ProxyCommand
 from stockbot.db import Session
-from stockbot.provider import ProviderHints
+from stockbot.history import HistorySummary, instrument_key
+from stockbot.provider import ProviderHints, BaseQuoteService, normalize_ticker
+from stockbot.schedule import format_duration, parse_duration
 from sqlalchemy import and_
 import logging
 
@@ -26,6 +28,23 @@ def ticker_hint(provider, ticker):
             session.close()
 
 
+def ticker_hints(provider, tickers):
+    """ same as ticker_hint but resolves all tickers with a single query """
+    session = None
+    try:
+        session = Session()
+        hints = session.query(ProviderHints).filter(
+            and_(ProviderHints.provider == provider, ProviderHints.src.in_(tickers))).all()
+        hint_map = {hint.src: hint.dst for hint in hints}
+        return [hint_map.get(ticker, ticker) for ticker in tickers]
+    except Exception as e:
+        LOGGER.exception("failed to query hints")
+        return list(tickers)
+    finally:
+        if session:
+            session.close()
+
+
 def get_quote(*args, **kwargs):
     provider = args[0]
     ticker = " ".join(args[1:])
@@ -38,6 +57,36 @@ def get_quote(*args, **kwargs):
         return "No such provider '{}'".format(provider)
 
 
+def get_quote_batch(*args, **kwargs):
+    provider = args[0]
+    tickers = args[1:]
+    try:
+        service = kwargs.get('service_factory').get_service(provider)
+    except ValueError as e:
+        LOGGER.exception("failed to retrieve service for provider '{}'".format(provider))
+        return "No such provider '{}'".format(provider)
+
+    resolved_tickers = ticker_hints(provider, tickers)
+    if isinstance(service, BaseQuoteService):
+        quotes = service.get_quotes(resolved_tickers)
+    else:
+        quotes = []
+        for ticker in resolved_tickers:
+            try:
+                quotes.append(service.get_quote(ticker))
+            except Exception as e:
+                quotes.append(e)
+
+    rv = []
+    for ticker, quote in zip(tickers, quotes):
+        if isinstance(quote, Exception):
+            LOGGER.error("failed to retrieve quote for '{}': {}".format(ticker, quote))
+            rv.append("Ticker: {}, Error: {}".format(ticker, quote))
+        else:
+            rv.append(quote)
+    return rv
+
+
 def get_fresh_quote(*args, **kwargs):
     provider = args[0]
     ticker = " ".join(args[1:])
@@ -144,6 +193,65 @@ def remove_quote_hint(*args, **kwargs):
         session.close()
 
 
+# one sparkline block per bar, more than this doesn't fit on a line
+max_history_bars = 80
+
+
+def history_instruments(service_factory, history, ticker):
+    """
+    recorded instruments that ticker refers to, either by name or by what the providers that recorded ticks
+    resolve it to when quoting
+    """
+    instruments = history.lookup(ticker)
+    recorded = set(history.instruments())
+    for provider in history.providers():
+        try:
+            resolve = getattr(service_factory.get_service(provider), "resolve", None)
+            if resolve is None:
+                continue
+            instrument = instrument_key(provider, resolve(ticker))
+        except Exception as e:
+            LOGGER.exception("failed to resolve '{}' with provider '{}'".format(ticker, provider))
+            continue
+        if instrument in recorded and instrument not in instruments:
+            instruments.append(instrument)
+    return instruments
+
+
+def history_name(instrument, ticker):
+    """
+    the ticker as it was asked for, under the provider of the instrument it was found as
+    """
+    provider = instrument.split(":", 1)[0]
+    asked_provider, _, asked_ticker = ticker.partition(":")
+    if asked_provider.lower() == provider and len(asked_ticker) > 0:
+        ticker = asked_ticker
+    return instrument_key(provider, normalize_ticker(ticker))
+
+
+def get_quote_history(*args, **kwargs):
+    ticker, period, bucket = args[0], args[1], args[2]
+    service_factory = kwargs.get('service_factory', None)
+    history = getattr(service_factory, "history", None)
+    if history is None:
+        return "Quote history is disabled"
+    try:
+        seconds = parse_duration(period)
+        bucket_seconds = parse_duration(bucket)
+    except ValueError as e:
+        return str(e)
+    if bucket_seconds < 1 or seconds // bucket_seconds > max_history_bars:
+        return "{} of {} bars is more than the {} that fit on a line".format(period, bucket, max_history_bars)
+    end = history.clock()
+    for instrument in history_instruments(service_factory, history, ticker):
+        bars = history.ohlc(instrument, start=end - seconds, bucket=bucket_seconds)
+        if len(bars) > 0:
+            period = "{}/{}".format(format_duration(seconds), format_duration(bucket_seconds))
+            return HistorySummary(instrument=instrument, name=history_name(instrument, ticker), bars=bars,
+                                  period=period)
+    return "No history of {} in the last {}".format(ticker, format_duration(seconds))
+
+
 hint_command = Command(name="hint")
 hint_command.register(BlockingExecuteCommand(name="add", execute_command=add_quote_hint,
                                              help="<provider> <dst-ticker> <free-text>", expected_num_args=3))
@@ -156,12 +264,17 @@ hint_command.register(BlockingExecuteCommand(name="list", execute_command=list_q
 quote_command = Command(name="quote", short_name="q")
 quote_command.register(BlockingExecuteCommand(name="get", execute_command=get_quote, help="<provider> <ticker>",
                                               expected_num_args=2))
+quote_command.register(BlockingExecuteCommand(name="batch", execute_command=get_quote_batch,
+                                              help="<provider> <ticker> [<ticker> ...]", expected_num_args=2))
 quote_command.register(BlockingExecuteCommand(name="get_fresh", execute_command=get_fresh_quote,
                                               help="<provider> <ticker>", expected_num_args=2))
 quote_command.register(BlockingExecuteCommand(name="gl", execute_command=get_quote_lucky,
                                               help="<provider> <ticker>", expected_num_args=2))
 quote_command.register(BlockingExecuteCommand(name="search", execute_command=search_quote,
                                               help="<provider> <ticker>", expected_num_args=2))
+quote_command.register(BlockingExecuteCommand(name="history", execute_command=get_quote_history,
+                                              help="[<provider>:]<ticker> <range> <bucket>, e.g. 7d 4h",
+                                              expected_num_args=3))
 quote_command.register(hint_command)
 
 root_command.register(quote_command)
@@ -1,4 +1,6 @@
 from . import root_command, Command, BlockingExecuteCommand
+from stockbot.persistence import CommandSchedule
+from stockbot.schedule import parse_schedule
 import logging
 
 LOGGER = logging.getLogger(__name__)
@@ -17,6 +19,7 @@ def add_scheduler_command(*args, **kwargs):
     if command in bot.commands:
         return "Command already in list"
     bot.commands.append(command)
+    bot.reschedule()
     return "Added command: {}".format(command)
 
 
@@ -26,9 +29,62 @@ def remove_scheduler_command(*args, **kwargs):
     if command not in bot.commands:
         return "Command not in list"
     bot.commands.remove(command)
+    if command in bot.schedules:
+        bot.schedules.remove(command)
+    bot.reschedule()
     return "Removed command: {}".format(command)
 
 
+def reload_scheduler_commands(*args, **kwargs):
+    bot = kwargs.get('instance')
+    bot.commands.reload()
+    bot.schedules.reload()
+    bot.reschedule()
+    return "Reloaded {} commands".format(len(bot.commands))
+
+
+def format_next_run(bot, command):
+    next_run = bot.command_timer.next_run_of(command)
+    return next_run.strftime("%Y-%m-%d %H:%M:%S") if next_run is not None else "-"
+
+
+def get_command_schedules(*args, **kwargs):
+    bot = kwargs.get('instance')
+    if len(bot.commands) == 0:
+        return "No commands added"
+    own = dict([(s.command, s.schedule) for s in bot.schedules])
+    return ["Command: {c}, Schedule: {s}, Next run: {n}".format(
+        c=c, s=own.get(c, "default"), n=format_next_run(bot, c)) for c in bot.commands]
+
+
+def set_command_schedule(*args, **kwargs):
+    bot = kwargs.get('instance')
+    try:
+        schedule, consumed = parse_schedule(args)
+        # make sure that it ever runs before saving it
+        schedule.next_run(bot.command_timer.clock())
+    except ValueError as e:
+        return "Invalid schedule: {}".format(e)
+    command = " ".join(args[consumed:])
+    if command not in bot.commands:
+        return "Command not in list"
+    if command in bot.schedules:
+        bot.schedules.remove(command)
+    bot.schedules.append(CommandSchedule(command=command, schedule=str(schedule)))
+    bot.reschedule()
+    return "Command: {c}, Schedule: {s}, Next run: {n}".format(c=command, s=schedule, n=format_next_run(bot, command))
+
+
+def clear_command_schedule(*args, **kwargs):
+    command = " ".join(args)
+    bot = kwargs.get('instance')
+    if command not in bot.schedules:
+        return "Command has no schedule"
+    bot.schedules.remove(command)
+    bot.reschedule()
+    return "Cleared schedule of: {}".format(command)
+
+
 def get_scheduler_interval(*args, **kwargs):
     bot = kwargs.get('instance')
     return "Interval: {} seconds".format(bot.scheduler_interval)
@@ -39,6 +95,7 @@ def set_scheduler_interval(*args, **kwargs):
     interval = args[0]
     try:
         bot.scheduler_interval = int(interval)
+        bot.reschedule()
         return "New interval: {} seconds".format(interval)
     except ValueError as e:
         LOGGER.exception("Failed to convert int")
@@ -67,6 +124,7 @@ scheduler_command_command.register(BlockingExecuteCommand(name="add", execute_co
                                                           help="<command>", expected_num_args=1))
 scheduler_command_command.register(BlockingExecuteCommand(name="remove", execute_command=remove_scheduler_command,
                                                           help="<command>", expected_num_args=1))
+scheduler_command_command.register(BlockingExecuteCommand(name="reload", execute_command=reload_scheduler_commands))
 scheduler_command.register(scheduler_command_command)
 
 scheduler_interval_command = Command(name="interval")
@@ -75,4 +133,13 @@ scheduler_interval_command.register(BlockingExecuteCommand(name="set", execute_c
                                                            help="<interval-int>", expected_num_args=1))
 scheduler_command.register(scheduler_interval_command)
 
+scheduler_schedule_command = Command(name="schedule")
+scheduler_schedule_command.register(BlockingExecuteCommand(name="get", execute_command=get_command_schedules))
+scheduler_schedule_command.register(BlockingExecuteCommand(
+    name="set", execute_command=set_command_schedule, expected_num_args=3,
+    help="<every <duration>|cron <min> <hour> <day> <month> <weekday>> [hours <range>] [days <range>] <command>"))
+scheduler_schedule_command.register(BlockingExecuteCommand(name="clear", execute_command=clear_command_schedule,
+                                                           help="<command>", expected_num_args=1))
+scheduler_command.register(scheduler_schedule_command)
+
 root_command.register(scheduler_command)
@@ -1,34 +1,39 @@
 from . import root_command, Command, BlockingExecuteCommand, NonBlockingExecuteCommand
+from .fundamental import screener
 import logging
-import time
 from sqlalchemy import func
+from stockbot.configuration import configuration
 from stockbot.db import Session
-from stockbot.provider.nasdaq import NasdaqIndexScraper, NasdaqCompany
-from stockbot.provider import StockDomain
+from stockbot.pipeline import StockScrapePipeline
+from stockbot.provider.nasdaq import NasdaqIndexScraper, NasdaqCompany, NasdaqListingSync
 
 LOGGER = logging.getLogger(__name__)
 
 
 def nasdaq_scraper_task(*args, **kwargs):
+    service_factory = kwargs.get('service_factory', None)
+    nasdaq_scraper = NasdaqIndexScraper(transport=service_factory.transport if service_factory is not None else None)
     session = Session()
-    nasdaq_scraper = NasdaqIndexScraper()
     try:
-        session.query(NasdaqCompany).delete()
+        # the companies are diffed as they come off the wire instead of after every page has been downloaded
+        sync = NasdaqListingSync(session)
+        completed = []
+        for segment, company in nasdaq_scraper.iter_all(max_workers=int(configuration.nasdaq_workers)):
+            if company is None:
+                completed.append(segment)
+                sync.complete(segment)
+            else:
+                sync.add(company)
+        changes = sync.finish([s for s in nasdaq_scraper.indexes.keys() if s not in completed])
+        if changes.total == 0:
+            session.rollback()
+            return "Failed to scrape companies from Nasdaq"
         session.commit()
+        return str(changes)
     except Exception as e:
-        LOGGER.exception("Failed to delete all records")
+        LOGGER.exception("Failed to store nasdaq companies")
         session.rollback()
-    else:
-        try:
-            rv = []
-            for index in nasdaq_scraper.indexes.keys():
-                rv.extend(nasdaq_scraper.scrape(index))
-            session.add_all(rv)
-            session.commit()
-            return "Scraped {} companies from Nasdaq".format(len(rv))
-        except Exception as e:
-            LOGGER.exception("Failed to fetch and store nasdaq companies")
-            session.rollback()
+        return "Failed to store companies from Nasdaq"
     finally:
         session.close()
 
@@ -42,66 +47,41 @@ def scrape_stats(*args, **kwargs):
     ]))
 
 
+# latest stock scrape of every segment, running or finished
+pipelines = {}
+
+
 def stock_scrape_task(*args, **kwargs):
     currency = args[0].upper()
     segment = " ".join(args[1:])
-    service = kwargs.get('service')
-    session = Session()
-    scraped = 0
-
-    # TODO: not so pretty but what to do when there's no universal ticker naming scheme
-    prefix_wrapper = {
-        'SEK': 'STO'
-    }
-    prefix = prefix_wrapper.get(currency, None)
-
+    service = kwargs.get('service', None)
+    if service is None:
+        service = kwargs.get('service_factory').get_service("google")
+
+    pipeline = StockScrapePipeline(service=service, segment=segment, currency=currency)
+    pipelines[(segment, currency)] = pipeline
+    scraped = pipeline.run()
+    if pipeline.state == "failed":
+        return "Failed to scrape stocks"
     try:
-        result = session.query(NasdaqCompany.ticker)\
-            .filter(NasdaqCompany.segment == segment)\
-            .filter(NasdaqCompany.currency == currency)
-
-        for r in result:
-
-            # delete the record first if already existing
-            try:
-                session.query(StockDomain).filter(StockDomain.ticker == r.ticker).delete()
-                session.commit()
-            except Exception as e:
-                LOGGER.exception("failed to delete stock ticker '{}'".format(r.ticker))
-                session.rollback()
-
-            # fetch the updated quote from interweb
-            try:
-                if prefix is not None:
-                    ticker = "{}:{}".format(prefix, r.ticker)
-                else:
-                    ticker = r.ticker
-                quote = service.get_quote(ticker)
-                stock = StockDomain()
-                stock.from_google_finance_quote(quote)
-                session.add(stock)
-                session.commit()
-            except Exception as e:
-                LOGGER.exception("failed to fetch and store stock ticker '{}'".format(r.ticker))
-            else:
-                scraped += 1
+        screener.refresh()
+    except Exception as e:
+        LOGGER.exception("Failed to refresh the screener")
+    return "Done scraping segment '{segment}' currency '{currency}' - scraped {scraped} companies".format(
+        segment=segment, currency=currency, scraped=scraped)
 
-            # arbitrary sleep, avoid getting us blocked, rate-limited etc
-            time.sleep(3)
 
-    except Exception as e:
-        LOGGER.exception("failed to scrape stocks")
-        return "Failed to scrape stocks"
-    else:
-        return "Done scraping segment '{segment}' currency '{currency}' - scraped {scraped} companies".format(
-            segment=segment, currency=currency, scraped=scraped)
-    finally:
-        session.close()
+def scrape_progress(*args, **kwargs):
+    if len(pipelines) == 0:
+        return "No stocks scraped yet"
+    return [str(p) for p in pipelines.values()]
 
 
 scrape_command = Command(name="scrape")
 scrape_command.register(BlockingExecuteCommand(name="nasdaq", execute_command=nasdaq_scraper_task))
 scrape_command.register(BlockingExecuteCommand(name="stats", execute_command=scrape_stats))
+scrape_command.register(BlockingExecuteCommand(name="progress", execute_command=scrape_progress,
+                                               help="progress of the stock scrapes"))
 scrape_command.register(NonBlockingExecuteCommand(name="stocks", execute_command=stock_scrape_task, exclusive=True,
                         help="<currency> <nasdaq-market-name>", expected_num_args=2))
 
@@ -0,0 +1,52 @@
+from . import root_command, task_pool, Command, BlockingExecuteCommand
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+def output_stats(*args, **kwargs):
+    output_queue = getattr(kwargs.get('instance', None), "output_queue", None)
+    if output_queue is None:
+        return "No output queue"
+    return str(output_queue)
+
+
+def command_stats(*args, **kwargs):
+    command_executor = getattr(kwargs.get('instance', None), "command_executor", None)
+    if command_executor is None:
+        return "No command executor"
+    return str(command_executor)
+
+
+def task_stats(*args, **kwargs):
+    return str(task_pool)
+
+
+def schedule_stats(*args, **kwargs):
+    bot = kwargs.get('instance', None)
+    summary = getattr(bot, "schedule_summary", None)
+    if summary is None:
+        return "No scheduled run yet"
+    return "Last run: {summary}, Pool: {pool}".format(summary=summary, pool=bot.schedule_pool)
+
+
+def history_stats(*args, **kwargs):
+    history = getattr(kwargs.get('service_factory', None), "history", None)
+    if history is None:
+        return "Quote history is disabled"
+    return str(history)
+
+
+stats_command = Command(name="stats")
+stats_command.register(BlockingExecuteCommand(name="output", execute_command=output_stats,
+                                              help="queue depth and send lag of outgoing messages"))
+stats_command.register(BlockingExecuteCommand(name="commands", execute_command=command_stats,
+                                              help="load on the command workers"))
+stats_command.register(BlockingExecuteCommand(name="tasks", execute_command=task_stats,
+                                              help="background tasks that are running"))
+stats_command.register(BlockingExecuteCommand(name="schedule", execute_command=schedule_stats,
+                                              help="outcome of the last run of the scheduled commands"))
+stats_command.register(BlockingExecuteCommand(name="history", execute_command=history_stats,
+                                              help="quotes recorded to the tick history"))
+
+root_command.register(stats_command)
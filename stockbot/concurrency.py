@@ -0,0 +1,364 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SingleFlight(object):
+
+    """
+    Coalesces concurrent calls that share the same key, the first caller does the actual work and everybody
+    that shows up while it is in flight waits for and shares its result instead of issuing a duplicate call
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __join(self, key, future_factory):
+        with self.lock:
+            self.calls += 1
+            future = self.in_flight.get(key, None)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = future_factory()
+            self.in_flight[key] = future
+            return future, True
+
+    def __leave(self, key):
+        with self.lock:
+            del self.in_flight[key]
+
+    def do(self, key, func, *args, **kwargs):
+        future, leader = self.__join(key, Future)
+        if not leader:
+            LOGGER.debug("Coalescing call {}".format(key))
+            return future.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self.__leave(key)
+
+    async def ado(self, key, coro_func, *args, **kwargs):
+        # asyncio futures are bound to their event loop so calls are only coalesced within the same loop
+        loop = asyncio.get_event_loop()
+        future, leader = self.__join((loop, key), loop.create_future)
+        if not leader:
+            LOGGER.debug("Coalescing call {}".format(key))
+            return await asyncio.shield(future)
+        try:
+            result = await coro_func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved, it is re-raised to the leader below
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self.__leave((loop, key))
+
+    def wrap(self, provider, method, func):
+        @functools.wraps(func)
+        def single_flight(*args):
+            return self.do((provider, method) + args, func, *args)
+        return single_flight
+
+    def wrap_async(self, provider, method, coro_func):
+        @functools.wraps(coro_func)
+        async def single_flight(*args):
+            return await self.ado((provider, method) + args, coro_func, *args)
+        return single_flight
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self.in_flight)
+            }
+
+    def __str__(self):
+        return "Calls: {calls}, Coalesced: {coalesced}, In flight: {in_flight}".format(**self.stats())
+
+
+class BoundedExecutor(object):
+
+    """
+    Thread pool that refuses new work once all workers are busy and the backlog is full instead of queueing
+    without bounds, submit returns None when the work was rejected
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.name = kwargs.get('name', "worker")
+        self.max_workers = int(kwargs.get('max_workers', 4))
+        self.max_pending = int(kwargs.get('max_pending', 32))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        self.slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def submit(self, func, *args, **kwargs):
+        """
+        :return: future of the submitted work or None if the executor is at capacity
+        :rtype: concurrent.futures.Future
+        """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            LOGGER.warning("Executor '{}' is at capacity, rejecting work".format(self.name))
+            return None
+        try:
+            future = self.executor.submit(self.__run, func, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.submitted += 1
+        return future
+
+    def __run(self, func, *args, **kwargs):
+        # book keeping happens before the future resolves so that whoever waits on it sees up to date stats
+        with self.lock:
+            self.in_flight += 1
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "workers": self.max_workers,
+                "in_flight": self.in_flight,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "failed": self.failed
+            }
+
+    def __str__(self):
+        return "Executor: {name}, Workers: {workers}, In flight: {in_flight}, Submitted: {submitted}, " \
+               "Rejected: {rejected}, Failed: {failed}".format(**self.stats())
+
+
+class TaskRejected(Exception):
+    pass
+
+
+class TaskPool(BoundedExecutor):
+
+    """
+    Pool for long running background tasks, every task is registered under a key while it runs so that a task
+    that must not run more than once at a time can be refused with a dict lookup
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TaskPool, self).__init__(*args, **kwargs)
+        self.registry_lock = threading.Lock()
+        self.running = {}
+        self.futures = set()
+
+    def is_running(self, key):
+        with self.registry_lock:
+            return key in self.running
+
+    def submit_task(self, key, func, *args, exclusive=True, **kwargs):
+        """
+        :raises TaskRejected: if an exclusive task with the same key is running or the pool is at capacity
+        :rtype: concurrent.futures.Future
+        """
+        with self.registry_lock:
+            if exclusive and key in self.running:
+                raise TaskRejected("Task is currently running, hold your horses")
+            self.running[key] = self.running.get(key, 0) + 1
+        future = self.submit(self.__run_task, key, func, *args, **kwargs)
+        if future is None:
+            self.__unregister(key)
+            raise TaskRejected("Too many tasks running, try again later")
+        with self.registry_lock:
+            self.futures.add(future)
+        future.add_done_callback(self.__forget)
+        return future
+
+    def __run_task(self, key, func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.__unregister(key)
+
+    def __unregister(self, key):
+        with self.registry_lock:
+            if self.running[key] > 1:
+                self.running[key] -= 1
+            else:
+                del self.running[key]
+
+    def __forget(self, future):
+        with self.registry_lock:
+            self.futures.discard(future)
+
+    def join(self, timeout=None):
+        """
+        wait for the tasks that are currently queued or running
+        """
+        with self.registry_lock:
+            futures = list(self.futures)
+        wait(futures, timeout=timeout)
+
+    def stats(self):
+        stats = super(TaskPool, self).stats()
+        with self.registry_lock:
+            stats["tasks"] = ", ".join(sorted(" ".join(k) if isinstance(k, tuple) else str(k) for k in self.running))
+        return stats
+
+    def __str__(self):
+        return "{executor}, Running: {tasks}".format(executor=super(TaskPool, self).__str__(),
+                                                     tasks=self.stats()["tasks"] or "-")
+
+
+class FanOutSummary(object):
+
+    """
+    Outcome of one fan_out, the keys of the jobs that finished, failed, didn't finish before the deadline or were
+    never started because the same job was still running or the pool was full
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.finished = []
+        self.failed = []
+        self.timed_out = []
+        self.rejected = []
+        self.elapsed = 0.0
+
+    def stats(self):
+        return {
+            "finished": len(self.finished),
+            "failed": len(self.failed),
+            "timed_out": len(self.timed_out),
+            "rejected": len(self.rejected),
+            "elapsed": self.elapsed
+        }
+
+    def __str__(self):
+        rv = "Finished: {finished}, Failed: {failed}, Timed out: {timed_out}, Rejected: {rejected}, " \
+             "Took: {elapsed:.2f}s".format(**self.stats())
+        details = ["{}: {}".format(name, ", ".join([str(k) for k in keys])) for name, keys in
+                   [("Failed", self.failed), ("Timed out", self.timed_out), ("Rejected", self.rejected)]
+                   if len(keys) > 0]
+        if len(details) > 0:
+            rv += " | " + " | ".join(details)
+        return rv
+
+
+class FanOut(object):
+
+    """
+    Jobs started side by side on a TaskPool without anybody blocking on them. The summary is handed to the
+    callback exactly once, from the worker that finishes the last job or from `expire` at the deadline, whichever
+    comes first. Jobs that miss the deadline are left running, their key stays registered in the pool which keeps
+    the next batch from starting them again before they are done.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.pool = kwargs.get('pool')
+        self.jobs = kwargs.get('jobs')
+        self.callback = kwargs.get('callback', None)
+        self.clock = kwargs.get('clock', time.monotonic)
+        self.lock = threading.Lock()
+        self.summary = FanOutSummary()
+        self.futures = []
+        self.pending = 0
+        self.started = None
+        self.finished = False
+
+    def start(self):
+        """
+        :return: self, the jobs are submitted but not waited for
+        """
+        self.started = self.clock()
+        with self.lock:
+            for key, func, args in self.jobs:
+                try:
+                    self.futures.append((key, self.pool.submit_task(key, func, *args)))
+                except TaskRejected as e:
+                    LOGGER.warning("Not running '{k}': {e}".format(k=key, e=e))
+                    self.summary.rejected.append(key)
+            self.pending = len(self.futures)
+        if self.pending == 0:
+            self.expire()
+        for _, future in self.futures:
+            future.add_done_callback(self.__done)
+        return self
+
+    def __done(self, future):
+        with self.lock:
+            self.pending -= 1
+            last = self.pending == 0
+        if last:
+            self.expire()
+
+    def expire(self):
+        """
+        close the run, jobs that aren't done by now are counted as timed out
+        :rtype: FanOutSummary
+        """
+        with self.lock:
+            if self.finished:
+                return self.summary
+            self.finished = True
+            for key, future in self.futures:
+                if not future.done():
+                    self.summary.timed_out.append(key)
+                elif future.exception() is not None:
+                    self.summary.failed.append(key)
+                else:
+                    self.summary.finished.append(key)
+            self.summary.elapsed = self.clock() - self.started
+        if self.callback is not None:
+            self.callback(self.summary)
+        return self.summary
+
+
+def fan_out(pool, jobs, timeout, clock=time.monotonic):
+    """
+    run the jobs concurrently on the pool and wait for them until the deadline, so that the whole batch takes about
+    as long as the slowest job
+    :param pool: TaskPool
+    :param jobs: list of (key, func, args) tuples
+    :param timeout: seconds to wait for the batch
+    :rtype: FanOutSummary
+    """
+    done = threading.Event()
+    run = FanOut(pool=pool, jobs=jobs, callback=lambda summary: done.set(), clock=clock).start()
+    done.wait(timeout)
+    return run.expire()
@@ -4,7 +4,33 @@ DEFAULT_VALUES = {
     "scheduler": "false",
     "database_url": "sqlite:///:memory:",
     "server_password": "",
-    "server_use_ssl": "false"
+    "server_use_ssl": "false",
+    "http_connect_timeout": "5",
+    "http_read_timeout": "30",
+    "http_pool_connections": "10",
+    "http_pool_maxsize": "10",
+    "quote_cache_min_ttl": "60",
+    "quote_cache_max_ttl": "900",
+    "html_parser": "lxml",
+    "output_rate": "1",
+    "output_burst": "4",
+    "output_line_reserve": "64",
+    "command_workers": "4",
+    "command_queue_size": "32",
+    "task_workers": "2",
+    "task_queue_size": "4",
+    "schedule_workers": "8",
+    "schedule_queue_size": "32",
+    "schedule_deadline": "120",
+    "scrape_workers": "4",
+    "scrape_queue_size": "64",
+    "scrape_batch_size": "500",
+    "scrape_rate": "1",
+    "nasdaq_workers": "3",
+    "nasdaq_parser": "stream",
+    "history_path": "",
+    "history_flush_size": "256",
+    "history_flush_interval": "300"
 }
 
 
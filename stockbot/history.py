@@ -0,0 +1,418 @@
+import bisect
+import functools
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import urllib.parse
+from array import array
+
+import numpy as np
+
+from stockbot.configuration import configuration
+from stockbot.render import Field, PlainRenderer
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TickSeries(object):
+
+    """
+    Ticks of one instrument as three columns of doubles
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.timestamps = kwargs.get('timestamps', array('d'))
+        self.prices = kwargs.get('prices', array('d'))
+        self.changes = kwargs.get('changes', array('d'))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def extend(self, timestamps, prices, changes):
+        self.timestamps.extend(timestamps)
+        self.prices.extend(prices)
+        self.changes.extend(changes)
+
+    def ohlc(self, bucket):
+        """
+        downsample the ticks into bars of `bucket` seconds, aligned to the epoch. Buckets without ticks don't get
+        a bar. The ticks are already sorted by time so every bucket is a contiguous run of them, which lets numpy
+        aggregate all of them in a handful of passes over the columns.
+        :rtype: OhlcBars
+        """
+        if bucket <= 0:
+            raise ValueError("bucket must be a positive number of seconds")
+        # the arrays are viewed as is, nothing gets copied
+        timestamps = np.frombuffer(self.timestamps, dtype=np.float64) if len(self) > 0 else np.empty(0)
+        prices = np.frombuffer(self.prices, dtype=np.float64) if len(self) > 0 else np.empty(0)
+        if len(timestamps) == 0:
+            return OhlcBars(bucket=bucket)
+        buckets = np.floor_divide(timestamps, bucket).astype(np.int64)
+        starts = np.flatnonzero(np.diff(buckets)) + 1
+        starts = np.concatenate(([0], starts))
+        ends = np.concatenate((starts[1:], [len(prices)]))
+        return OhlcBars(bucket=bucket,
+                        times=buckets[starts] * float(bucket),
+                        opens=prices[starts],
+                        highs=np.maximum.reduceat(prices, starts),
+                        lows=np.minimum.reduceat(prices, starts),
+                        closes=prices[ends - 1],
+                        counts=ends - starts)
+
+
+class OhlcBars(object):
+
+    """
+    Open, high, low and close price of every bucket that has ticks, the columns are numpy arrays
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.bucket = kwargs.get('bucket')
+        self.times = kwargs.get('times', np.empty(0))
+        self.opens = kwargs.get('opens', np.empty(0))
+        self.highs = kwargs.get('highs', np.empty(0))
+        self.lows = kwargs.get('lows', np.empty(0))
+        self.closes = kwargs.get('closes', np.empty(0))
+        self.counts = kwargs.get('counts', np.empty(0, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.times)
+
+    def first(self):
+        return float(self.opens[0])
+
+    def last(self):
+        return float(self.closes[-1])
+
+    def low(self):
+        return float(self.lows.min())
+
+    def high(self):
+        return float(self.highs.max())
+
+    def ticks(self):
+        return int(self.counts.sum())
+
+    def change(self):
+        """
+        :return: percent change from the first to the last tick
+        """
+        first = self.first()
+        return (self.last() / first - 1) * 100 if first != 0 else 0.0
+
+
+sparkline_blocks = np.array(list(u"▁▂▃▄▅▆▇█"))
+
+
+def sparkline(values):
+    """
+    :return: one block character per value, scaled between the smallest and the largest of them
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return ""
+    low, high = values.min(), values.max()
+    if high == low:
+        levels = np.full(len(values), (len(sparkline_blocks) - 1) // 2)
+    else:
+        levels = np.rint((values - low) / (high - low) * (len(sparkline_blocks) - 1)).astype(np.int64)
+    return "".join(sparkline_blocks[levels])
+
+
+class HistorySummary(object):
+
+    """
+    Bars of an instrument squeezed into a single line, a sparkline of the closes with the key prices around it
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.instrument = kwargs.get('instrument')
+        # the instrument is only a storage key, for some providers it's a url that nobody wants to read
+        self.name = kwargs.get('name', self.instrument)
+        self.bars = kwargs.get('bars')
+        self.period = kwargs.get('period')
+
+        self.fields = [
+            Field("Name", self.name, Field.TITLE),
+            Field("Period", self.period),
+            Field("History", sparkline(self.bars.closes)),
+            Field("First", round(self.bars.first(), 3), Field.NUMBER),
+            Field("Last", round(self.bars.last(), 3), Field.NUMBER),
+            Field("Min", round(self.bars.low(), 3), Field.NUMBER),
+            Field("Max", round(self.bars.high(), 3), Field.NUMBER),
+            Field("%Change", round(self.bars.change(), 3), Field.CHANGE),
+            # the counts are no prices, keep them from being rendered with decimals
+            Field("Bars", len(self.bars)),
+            Field("Ticks", self.bars.ticks())
+        ]
+
+    def __str__(self):
+        return PlainRenderer.render(self)
+
+    def get_fields(self):
+        return self.fields
+
+
+class TickBuffer(object):
+
+    def __init__(self, created):
+        self.created = created
+        self.series = TickSeries()
+
+
+class TickHistory(object):
+
+    """
+    Append only store of the quotes that pass through the bot. Ticks are buffered per instrument in arrays and
+    written in batches as immutable chunk files, one directory per instrument. A chunk is a 16 byte header followed
+    by the timestamp, price and change columns as packed doubles so a read can memory map it and bisect the
+    timestamps in place without parsing anything.
+    """
+
+    magic = b"TICK"
+    version = 1
+    # magic, version, padding up to 8 bytes so that the columns are aligned, number of ticks
+    header = struct.Struct("<4sH2xQ")
+    suffix = ".chunk"
+
+    def __init__(self, *args, **kwargs):
+        self.path = kwargs.get('path', configuration.history_path)
+        self.flush_size = int(kwargs.get('flush_size', configuration.history_flush_size))
+        self.flush_interval = float(kwargs.get('flush_interval', configuration.history_flush_interval))
+        self.clock = kwargs.get('clock', time.time)
+        self.lock = threading.Lock()
+        self.buffers = {}
+        # instrument to its last (timestamp, price, change)
+        self.last_ticks = {}
+        self.recorded = 0
+        self.skipped = 0
+        self.chunks = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def __directory(self, instrument):
+        return os.path.join(self.path, urllib.parse.quote(instrument, safe=""))
+
+    def record(self, instrument, timestamp, price, change, dedup=False):
+        """
+        buffer a tick, ticks that aren't newer than the last one of the instrument are dropped which takes care of
+        quotes that are fetched again before they have updated
+        :param dedup: also drop the tick if the price and change are the same as the last one, for ticks that are
+        stamped with the time they were fetched rather than the time they were updated
+        """
+        flush = None
+        with self.lock:
+            last = self.last_ticks.get(instrument, None)
+            if last is None:
+                last = self.__last_stored(instrument)
+            if last is not None and (timestamp <= last[0] or (dedup and (price, change) == last[1:])):
+                self.skipped += 1
+                return False
+            self.last_ticks[instrument] = (timestamp, price, change)
+            buffer = self.buffers.get(instrument, None)
+            if buffer is None:
+                buffer = self.buffers[instrument] = TickBuffer(self.clock())
+            buffer.series.extend([timestamp], [price], [change])
+            self.recorded += 1
+            if len(buffer.series) >= self.flush_size:
+                flush = self.buffers.pop(instrument)
+        if flush is not None:
+            self.__write_chunk(instrument, flush.series)
+        return True
+
+    def flush(self, force=False):
+        """
+        write the buffers that are full enough or have been waiting longer than the flush interval
+        :return: number of chunks written
+        """
+        now = self.clock()
+        with self.lock:
+            instruments = [k for k, b in self.buffers.items() if force or now - b.created >= self.flush_interval]
+            flush = [(k, self.buffers.pop(k)) for k in instruments]
+        for instrument, buffer in flush:
+            self.__write_chunk(instrument, buffer.series)
+        return len(flush)
+
+    def __write_chunk(self, instrument, series):
+        directory = self.__directory(instrument)
+        os.makedirs(directory, exist_ok=True)
+        # chunk names sort in time order, the ticks of an instrument only ever move forward
+        name = "{:020d}{}".format(int(series.timestamps[0] * 1e6), self.suffix)
+        tmp = os.path.join(directory, ".{}.tmp".format(name))
+        try:
+            with open(tmp, "wb") as f:
+                f.write(self.header.pack(self.magic, self.version, len(series)))
+                series.timestamps.tofile(f)
+                series.prices.tofile(f)
+                series.changes.tofile(f)
+            os.replace(tmp, os.path.join(directory, name))
+        except Exception as e:
+            LOGGER.exception("Failed to write {} ticks of '{}'".format(len(series), instrument))
+            return
+        with self.lock:
+            self.chunks += 1
+
+    def __chunk_files(self, instrument):
+        directory = self.__directory(instrument)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith(self.suffix)]
+
+    def __map_chunk(self, filename, func):
+        """
+        call func with the timestamp, price and change columns of a chunk as memoryviews of the mapped file
+        """
+        with open(filename, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, count = self.header.unpack_from(mm)
+                if magic != self.magic or version != self.version:
+                    raise ValueError("{} is not a tick chunk".format(filename))
+                with memoryview(mm) as view, view[self.header.size:].cast("d") as columns:
+                    timestamps = columns[0:count]
+                    prices = columns[count:2 * count]
+                    changes = columns[2 * count:3 * count]
+                    try:
+                        return func(timestamps, prices, changes)
+                    finally:
+                        for column in (timestamps, prices, changes):
+                            column.release()
+
+    def __last_stored(self, instrument):
+        files = self.__chunk_files(instrument)
+        if len(files) == 0:
+            return None
+        return self.__map_chunk(files[-1], lambda timestamps, prices, changes: (timestamps[-1], prices[-1],
+                                                                                changes[-1]))
+
+    def read(self, instrument, start=None, end=None):
+        """
+        ticks of the instrument with start <= timestamp < end, including the ones that haven't been flushed yet
+        :rtype: TickSeries
+        """
+        result = TickSeries()
+
+        def select(timestamps, prices, changes):
+            first = 0 if start is None else bisect.bisect_left(timestamps, start)
+            last = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+            if first < last:
+                result.timestamps.frombytes(timestamps[first:last].tobytes())
+                result.prices.frombytes(prices[first:last].tobytes())
+                result.changes.frombytes(changes[first:last].tobytes())
+
+        files = self.__chunk_files(instrument)
+        for index, filename in enumerate(files):
+            # a chunk ends where the next one starts, skip the ones that are entirely out of range
+            if end is not None and self.__chunk_start(filename) >= end:
+                break
+            if start is not None and index + 1 < len(files) and self.__chunk_start(files[index + 1]) <= start:
+                continue
+            self.__map_chunk(filename, select)
+
+        with self.lock:
+            buffer = self.buffers.get(instrument, None)
+            if buffer is not None:
+                select(buffer.series.timestamps, buffer.series.prices, buffer.series.changes)
+        return result
+
+    def __chunk_start(self, filename):
+        return int(os.path.basename(filename)[:-len(self.suffix)]) / 1e6
+
+    def instruments(self):
+        with self.lock:
+            buffered = set(self.buffers.keys())
+        stored = set([urllib.parse.unquote(d) for d in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, d))])
+        return sorted(buffered.union(stored))
+
+    def lookup(self, ticker):
+        """
+        :param ticker: a ticker of any provider or "<provider>:<ticker>" for the one of a specific provider
+        :return: the recorded instruments that match
+        """
+        provider, _, provider_ticker = ticker.partition(":")
+        keys = set([ticker.upper()])
+        if len(provider_ticker) > 0:
+            keys.add(instrument_key(provider.lower(), provider_ticker.upper()))
+        return [i for i in self.instruments() if i in keys or i.split(":", 1)[-1] in keys]
+
+    def providers(self):
+        return sorted(set([i.split(":", 1)[0] for i in self.instruments()]))
+
+    def ohlc(self, instrument, start=None, end=None, bucket=60):
+        """
+        :rtype: OhlcBars
+        """
+        return self.read(instrument, start=start, end=end).ohlc(bucket)
+
+    def wrap(self, provider, get_quote, resolve):
+        """
+        ticks are recorded under the instrument that the provider resolves the ticker to, same as the quote cache
+        """
+        @functools.wraps(get_quote)
+        def recorded_get_quote(ticker):
+            quote = get_quote(ticker)
+            try:
+                instrument = resolve(ticker)
+            except Exception as e:
+                LOGGER.exception("Failed to resolve '{}', not recording its tick".format(ticker))
+            else:
+                self.record_quote(provider, instrument, quote)
+            return quote
+        return recorded_get_quote
+
+    def wrap_async(self, provider, aget_quote, aresolve):
+        @functools.wraps(aget_quote)
+        async def recorded_aget_quote(ticker):
+            quote = await aget_quote(ticker)
+            try:
+                instrument = await aresolve(ticker)
+            except Exception as e:
+                LOGGER.exception("Failed to resolve '{}', not recording its tick".format(ticker))
+            else:
+                self.record_quote(provider, instrument, quote)
+            return quote
+        return recorded_aget_quote
+
+    def record_quote(self, provider, instrument, quote):
+        """
+        record the tick of a quote that has one, the quote's own update time is used when it has one so that
+        fetching an unchanged quote doesn't add a tick. Quotes without one are stamped with the time they were
+        fetched and only recorded when the price or change moved.
+        """
+        get_tick = getattr(quote, "get_tick", None)
+        if not callable(get_tick):
+            return False
+        try:
+            tick = get_tick()
+            if tick is None:
+                return False
+            get_timestamp = getattr(quote, "get_timestamp", None)
+            timestamp = get_timestamp() if callable(get_timestamp) else None
+            if timestamp is None:
+                return self.record(instrument_key(provider, instrument), self.clock(), *tick, dedup=True)
+            return self.record(instrument_key(provider, instrument), timestamp.timestamp(), *tick)
+        except Exception as e:
+            LOGGER.exception("Failed to record tick of {}".format(instrument))
+            return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "instruments": len(self.last_ticks),
+                "recorded": self.recorded,
+                "skipped": self.skipped,
+                "buffered": sum([len(b.series) for b in self.buffers.values()]),
+                "chunks": self.chunks
+            }
+
+    def __str__(self):
+        return "Instruments: {instruments}, Recorded: {recorded}, Skipped: {skipped}, Buffered: {buffered}, " \
+               "Chunks written: {chunks}".format(**self.stats())
+
+
+def instrument_key(provider, instrument):
+    """
+    :param instrument: what the provider resolved a ticker to
+    """
+    return "{}:{}".format(provider, instrument)
@@ -0,0 +1,236 @@
+import logging
+import re
+import threading
+import time
+from collections import deque, OrderedDict
+
+from stockbot.configuration import configuration
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+
+    """
+    Flood limiter, allows bursts of up to `burst` messages and refills at `rate` messages per second
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.rate = float(kwargs.get('rate', 1.0))
+        self.burst = float(kwargs.get('burst', 1.0))
+        self.clock = kwargs.get('clock', time.monotonic)
+        self.tokens = self.burst
+        self.updated = self.clock()
+
+    def __refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self):
+        self.__refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self):
+        """
+        :return: seconds until the next message can be sent
+        """
+        self.__refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def is_full(self):
+        self.__refill()
+        return self.tokens >= self.burst
+
+
+class OutputQueue(object):
+
+    """
+    Outbound IRC messages, one FIFO and one token bucket per target. Producers (command callbacks, worker threads)
+    only enqueue and return immediately, the queue is drained from the reactor thread which sends whatever the
+    flood limiter of each target allows.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.send = kwargs.get('send')
+        self.rate = float(kwargs.get('rate', configuration.output_rate))
+        self.burst = float(kwargs.get('burst', configuration.output_burst))
+        self.clock = kwargs.get('clock', time.monotonic)
+        self.queues = OrderedDict()
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    def put(self, target, message, method="privmsg"):
+        with self.lock:
+            queue = self.queues.get(target, None)
+            if queue is None:
+                queue = self.queues[target] = deque()
+            queue.append((self.clock(), method, message))
+            self.depth += 1
+
+    def drain(self):
+        """
+        send the messages that the flood limiters allow right now, targets take turns so that one long listing
+        doesn't hold up the replies to everybody else
+        :return: number of messages sent
+        """
+        sent = 0
+        while True:
+            batch = self.__next_batch()
+            if len(batch) == 0:
+                break
+            for enqueued, target, method, message in batch:
+                self.__send(enqueued, target, method, message)
+                sent += 1
+        return sent
+
+    def __next_batch(self):
+        batch = []
+        with self.lock:
+            for target in list(self.queues.keys()):
+                queue = self.queues[target]
+                bucket = self.__bucket(target)
+                if bucket.consume():
+                    enqueued, method, message = queue.popleft()
+                    self.depth -= 1
+                    batch.append((enqueued, target, method, message))
+                if len(queue) == 0:
+                    del self.queues[target]
+            # forget the buckets of idle targets that have refilled completely
+            for target in [t for t, b in self.buckets.items() if t not in self.queues and b.is_full()]:
+                del self.buckets[target]
+        return batch
+
+    def __bucket(self, target):
+        bucket = self.buckets.get(target, None)
+        if bucket is None:
+            bucket = self.buckets[target] = TokenBucket(rate=self.rate, burst=self.burst, clock=self.clock)
+        return bucket
+
+    def __send(self, enqueued, target, method, message):
+        lag = self.clock() - enqueued
+        try:
+            self.send(method, target, message)
+        except Exception as e:
+            LOGGER.exception("Failed to send message to {}".format(target))
+            with self.lock:
+                self.failed += 1
+            return
+        with self.lock:
+            self.sent += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+
+    def stats(self):
+        with self.lock:
+            return {
+                "depth": self.depth,
+                "targets": len(self.queues),
+                "sent": self.sent,
+                "failed": self.failed,
+                "last_lag": self.last_lag,
+                "max_lag": self.max_lag,
+                "avg_lag": self.total_lag / self.sent if self.sent > 0 else 0.0
+            }
+
+    def __str__(self):
+        return "Queue depth: {depth}, Targets: {targets}, Sent: {sent}, Failed: {failed}, Send lag (last/avg/max): " \
+               "{last_lag:.2f}s/{avg_lag:.2f}s/{max_lag:.2f}s".format(**self.stats())
+
+
+class MessagePacker(object):
+
+    """
+    Fits rendered output into IRC messages. Sizes are counted in UTF-8 encoded bytes of the complete protocol line,
+    lines are only split between fields so that color codes are never cut in half, and short rows are packed
+    together so that a listing goes out in as few messages as possible.
+    """
+
+    # irc.client.MessageTooLong: Messages limited to 512 bytes including CR/LF
+    line_limit = 512
+    formatting_regex = re.compile("\x03(\\d{1,2}(,\\d{1,2})?)?|[\x02\x0f\x16\x1d\x1f]")
+    newline_regex = re.compile("[\r\n]+")
+
+    def __init__(self, *args, **kwargs):
+        # the server prepends ":nick!user@host " when relaying the message, keep room for it
+        self.reserve = int(kwargs.get('reserve', configuration.output_line_reserve))
+        self.row_separator = kwargs.get('row_separator', " | ")
+
+    @staticmethod
+    def size(text):
+        return len(text.encode("utf-8"))
+
+    def budget(self, target, method="privmsg"):
+        """
+        :return: number of bytes available for the text of a message to target
+        """
+        overhead = self.size("{method} {target} :\r\n".format(method=method.upper(), target=target))
+        return self.line_limit - overhead - self.reserve
+
+    def split(self, segments, separator, budget):
+        """
+        join the segments of a single line, starting a new message at a segment boundary whenever the next one
+        doesn't fit
+        :param segments: rendered fields
+        :param separator: what goes between two segments on the same message
+        :param budget: bytes per message
+        :rtype: list[str]
+        """
+        messages = []
+        current = None
+        for segment in segments:
+            # the protocol doesn't allow line breaks within a message
+            segment = self.newline_regex.sub(" ", segment)
+            if self.size(segment) > budget:
+                if current is not None:
+                    messages.append(current)
+                pieces = self.hard_split(segment, budget)
+                messages.extend(pieces[:-1])
+                current = pieces[-1]
+            elif current is None:
+                current = segment
+            elif self.size(current) + self.size(separator) + self.size(segment) <= budget:
+                current = current + separator + segment
+            else:
+                messages.append(current)
+                current = segment
+        if current is not None:
+            messages.append(current)
+        return messages
+
+    def pack(self, lines, budget):
+        """
+        pack lines that fit within the budget together into as few messages as possible, order is kept
+        :rtype: list[str]
+        """
+        return self.split(lines, self.row_separator, budget)
+
+    def hard_split(self, text, budget):
+        """
+        last resort for a single field that doesn't fit on its own, the formatting is dropped and the text is cut
+        on character boundaries
+        """
+        text = self.formatting_regex.sub("", text)
+        pieces = []
+        current = []
+        current_size = 0
+        for char in text:
+            char_size = self.size(char)
+            if current_size + char_size > budget:
+                pieces.append("".join(current))
+                current = []
+                current_size = 0
+            current.append(char)
+            current_size += char_size
+        pieces.append("".join(current))
+        return pieces
@@ -1,6 +1,7 @@
 from sqlalchemy import Column, String
 from stockbot.db import Session, Base
 import collections
+import threading
 
 
 class ScheduledTicker(Base):
@@ -23,6 +24,17 @@ class ScheduledCommand(Base):
         return "<ScheduledCommand(command={})>".format(self.command)
 
 
+class CommandSchedule(Base):
+
+    __tablename__ = "command_schedule"
+
+    command = Column(String, primary_key=True)
+    schedule = Column(String, nullable=False)
+
+    def __repr__(self):
+        return "<CommandSchedule(command={}, schedule={})>".format(self.command, self.schedule)
+
+
 def db_session(func):
     """
     decorator that will inject an sqlalchemy session and always close it after
@@ -41,27 +53,50 @@ def db_session(func):
 class DatabaseCollection(collections.Iterable, list):
 
     """
-    Funky custom list implementation that will deal with database persistence
+    Funky custom list implementation that will deal with database persistence. The rows are loaded once and kept
+    in memory, appends and removes are written through to the database so reads never need a round trip. Call
+    reload if the table has been changed behind our back.
     """
     def __init__(self, *args, **kwargs):
         super(DatabaseCollection, self).__init__()
         self.type = kwargs.get('type')
         self.attribute = kwargs.get('attribute', None)
+        self.lock = threading.RLock()
+        self.items = None
+
+    def __value(self, item):
+        if self.attribute is not None:
+            return getattr(item, self.attribute)
+        return item
+
+    def __key(self, item):
+        # membership and removal go by primary key, which is the attribute when there is one
+        if self.attribute is not None:
+            return item
+        return getattr(item, self.type.__mapper__.primary_key[0].key)
+
+    def reload(self):
+        with self.lock:
+            self.items = self.__load()
+
+    @db_session
+    def __load(self):
+        return [self.__value(item) for item in self.session.query(self.type).all()]
+
+    def __snapshot(self):
+        with self.lock:
+            if self.items is None:
+                self.items = self.__load()
+            return self.items
 
     def __setitem__(self, index, value):
         raise NotImplemented
 
-    @db_session
     def __getitem__(self, index):
-        all_items = self.session.query(self.type).all()
-        if self.attribute is not None:
-            return getattr(all_items[index], self.attribute)
-        return all_items[index]
+        return self.__snapshot()[index]
 
-    @db_session
     def __len__(self):
-        all_items = self.session.query(getattr(self.type, self.attribute)).count()
-        return all_items
+        return len(self.__snapshot())
 
     def __delitem__(self, index):
         raise NotImplemented
@@ -69,30 +104,42 @@ class DatabaseCollection(collections.Iterable, list):
     def insert(self, index, value):
         raise NotImplemented
 
-    @db_session
     def append(self, value):
         if isinstance(value, self.type):
-            self.session.add(value)
-            self.session.commit()
+            item = value
         else:
             item = self.type()
             setattr(item, self.attribute, value)
-            self.session.add(item)
-            self.session.commit()
+        cached = self.__value(item)
+        with self.lock:
+            items = self.__snapshot()
+            self.__add(item)
+            self.items = items + [cached]
 
-    @db_session
     def remove(self, value):
+        with self.lock:
+            items = self.__snapshot()
+            self.__delete(value)
+            self.items = [item for item in items if self.__key(item) != value]
+
+    @db_session
+    def __add(self, item):
+        self.session.add(item)
+        self.session.commit()
+        if self.attribute is None:
+            # the cached instance outlives the session, load it again before it gets detached
+            self.session.refresh(item)
+
+    @db_session
+    def __delete(self, value):
         ticker = self.session.query(self.type).get(value)
         self.session.delete(ticker)
         self.session.commit()
 
-    @db_session
     def __iter__(self):
-        all_items = self.session.query(self.type).all()
-        for item in all_items:
-            yield getattr(item, self.attribute)
+        # the snapshot is replaced rather than modified so it can be iterated while other threads write
+        for item in self.__snapshot():
+            yield item
 
-    @db_session
     def __contains__(self, item):
-        ticker = self.session.query(self.type).get(item)
-        return ticker is not None
+        return item in [self.__key(i) for i in self.__snapshot()]
@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+import uuid
+from queue import Queue
+
+from sqlalchemy import select
+
+from stockbot.configuration import configuration
+from stockbot.db import Session, engine
+from stockbot.output import TokenBucket
+from stockbot.provider.google import StockDomain, stocks_staging
+from stockbot.provider.nasdaq import NasdaqCompany
+
+LOGGER = logging.getLogger(__name__)
+
+# marks the end of the work on a queue
+DONE = object()
+
+
+class StockScrapePipeline(object):
+
+    """
+    Refreshes the stocks of a Nasdaq segment in stages connected by bounded queues
+
+        ticker producer -> fetch workers -> parser -> batching writer
+
+    The fetch workers share a rate limiter so that adding workers hides the latency of the provider without
+    hammering it. The writer bulk loads the stocks into a staging table and merges them into the stocks table in
+    one transaction at the end, readers see either the old or the new stocks of the segment but never a mix.
+    The counters can be read while the pipeline runs.
+    """
+
+    # nasdaq only knows the currency of a segment, google finance wants the exchange in front of the ticker
+    prefix_wrapper = {
+        'SEK': 'STO'
+    }
+
+    def __init__(self, *args, **kwargs):
+        self.service = kwargs.get('service')
+        self.segment = kwargs.get('segment')
+        self.currency = kwargs.get('currency')
+        self.workers = int(kwargs.get('workers', configuration.scrape_workers))
+        self.queue_size = int(kwargs.get('queue_size', configuration.scrape_queue_size))
+        self.batch_size = int(kwargs.get('batch_size', configuration.scrape_batch_size))
+        self.run_id = uuid.uuid4().hex
+        self.staged_tickers = set()
+        self.bucket = TokenBucket(rate=float(kwargs.get('rate', configuration.scrape_rate)), burst=self.workers)
+        self.prefix = self.prefix_wrapper.get(self.currency, None)
+        self.fetch_queue = Queue(maxsize=self.queue_size)
+        self.parse_queue = Queue(maxsize=self.queue_size)
+        self.write_queue = Queue(maxsize=self.queue_size)
+        self.lock = threading.Lock()
+        self.state = "pending"
+        self.started = None
+        self.finished = None
+        self.queued = 0
+        self.fetched = 0
+        self.parsed = 0
+        self.staged = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    def __count(self, counter, n=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def __set_state(self, state, expected=None):
+        """
+        :param expected: only move to `state` from this one
+        :return: whether the state was changed
+        """
+        with self.lock:
+            if expected is not None and self.state != expected:
+                return False
+            self.state = state
+            return True
+
+    def run(self):
+        """
+        run every stage to completion
+        :return: number of stocks written
+        """
+        self.started = time.monotonic()
+        self.__set_state("running")
+        stages = [threading.Thread(target=self.__produce, name="scrape-producer")]
+        stages.extend([threading.Thread(target=self.__fetch, name="scrape-fetch-{}".format(i))
+                       for i in range(self.workers)])
+        stages.append(threading.Thread(target=self.__parse, name="scrape-parse"))
+        stages.append(threading.Thread(target=self.__write, name="scrape-write"))
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+        self.finished = time.monotonic()
+        self.__set_state("done", expected="merging")
+        return self.written
+
+    def __produce(self):
+        session = Session()
+        try:
+            result = session.query(NasdaqCompany.ticker)\
+                .filter(NasdaqCompany.segment == self.segment)\
+                .filter(NasdaqCompany.currency == self.currency)
+            for r in result:
+                self.fetch_queue.put(r.ticker)
+                self.__count("queued")
+        except Exception as e:
+            LOGGER.exception("failed to read the companies to scrape")
+            self.__set_state("failed")
+        finally:
+            session.close()
+            for _ in range(self.workers):
+                self.fetch_queue.put(DONE)
+
+    def __throttle(self):
+        while True:
+            with self.lock:
+                if self.bucket.consume():
+                    return
+                delay = self.bucket.delay()
+            time.sleep(delay)
+
+    def __fetch(self):
+        while True:
+            ticker = self.fetch_queue.get()
+            if ticker is DONE:
+                self.parse_queue.put(DONE)
+                return
+            self.__throttle()
+            try:
+                quote = self.service.get_quote("{}:{}".format(self.prefix, ticker) if self.prefix is not None
+                                               else ticker)
+            except Exception as e:
+                LOGGER.exception("failed to fetch stock ticker '{}'".format(ticker))
+                self.__count("failed")
+            else:
+                self.__count("fetched")
+                self.parse_queue.put((ticker, quote))
+
+    def __parse(self):
+        remaining = self.workers
+        while remaining > 0:
+            item = self.parse_queue.get()
+            if item is DONE:
+                remaining -= 1
+                continue
+            ticker, quote = item
+            try:
+                stock = StockDomain()
+                stock.from_google_finance_quote(quote)
+            except Exception as e:
+                LOGGER.exception("failed to parse stock ticker '{}'".format(ticker))
+                self.__count("failed")
+            else:
+                self.__count("parsed")
+                self.write_queue.put((ticker, stock))
+        self.write_queue.put(DONE)
+
+    def __write(self):
+        batch = []
+        while True:
+            item = self.write_queue.get()
+            if item is DONE:
+                break
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.__stage(batch)
+                batch = []
+        if len(batch) > 0:
+            self.__stage(batch)
+        try:
+            if self.__set_state("merging", expected="running"):
+                self.__merge()
+        finally:
+            self.__clear()
+
+    def __stage(self, batch):
+        columns = [c.name for c in stocks_staging.columns if c.name not in ("run", "source")]
+        # the same stock can't be in the table twice, the last one fetched wins
+        rows = dict([(stock.ticker, dict([(c, getattr(stock, c)) for c in columns], run=self.run_id, source=ticker))
+                     for ticker, stock in batch])
+        try:
+            with engine.begin() as connection:
+                replaced = self.staged_tickers.intersection(rows.keys())
+                if len(replaced) > 0:
+                    connection.execute(stocks_staging.delete()
+                                       .where(stocks_staging.c.run == self.run_id)
+                                       .where(stocks_staging.c.ticker.in_(replaced)))
+                connection.execute(stocks_staging.insert(), list(rows.values()))
+        except Exception as e:
+            LOGGER.exception("failed to stage {} stocks".format(len(rows)))
+            self.__count("failed", len(batch))
+        else:
+            self.staged_tickers.update(rows.keys())
+            self.__count("staged", len(rows))
+            self.__count("batches")
+
+    def __merge(self):
+        stocks = StockDomain.__table__
+        staged = select(stocks_staging.c.ticker).where(stocks_staging.c.run == self.run_id)
+        sources = select(stocks_staging.c.source).where(stocks_staging.c.run == self.run_id)
+        columns = [c.name for c in stocks.columns if c.name != "id"]
+        try:
+            with engine.begin() as connection:
+                connection.execute(stocks.delete().where(stocks.c.ticker.in_(staged)))
+                connection.execute(stocks.delete().where(stocks.c.ticker.in_(sources)))
+                result = connection.execute(stocks.insert().from_select(
+                    columns, select(*[stocks_staging.c[c] for c in columns]).where(
+                        stocks_staging.c.run == self.run_id)))
+        except Exception as e:
+            LOGGER.exception("failed to merge the staged stocks")
+            self.__set_state("failed")
+        else:
+            self.__count("written", result.rowcount)
+
+    def __clear(self):
+        try:
+            with engine.begin() as connection:
+                connection.execute(stocks_staging.delete().where(stocks_staging.c.run == self.run_id))
+        except Exception as e:
+            LOGGER.exception("failed to clear the staged stocks")
+
+    def stats(self):
+        with self.lock:
+            end = self.finished if self.finished is not None else time.monotonic()
+            return {
+                "segment": self.segment,
+                "currency": self.currency,
+                "state": self.state,
+                "queued": self.queued,
+                "fetched": self.fetched,
+                "parsed": self.parsed,
+                "staged": self.staged,
+                "written": self.written,
+                "batches": self.batches,
+                "failed": self.failed,
+                "elapsed": end - self.started if self.started is not None else 0.0
+            }
+
+    def __str__(self):
+        return "Segment: {segment}, Currency: {currency}, State: {state}, Queued: {queued}, Fetched: {fetched}, " \
+               "Parsed: {parsed}, Staged: {staged}, Written: {written}, Failed: {failed}, Took: {elapsed:.1f}s".format(**self.stats())
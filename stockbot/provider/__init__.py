@@ -6,7 +6,13 @@ from .bloomberg import BloombergQueryService
 from .avanza import AvanzaQueryService
 from .ig import IGQueryService
 from .yahoo import YahooQueryService
+from .base import BaseQuoteService, normalize_ticker
+from stockbot.cache import QuoteCache
+from stockbot.concurrency import SingleFlight
+from stockbot.configuration import configuration
 from stockbot.db import Base
+from stockbot.history import TickHistory
+from stockbot.transport import HttpTransport, AsyncHttpTransport
 from sqlalchemy import Column, String
 
 LOGGER = logging.getLogger(__name__)
@@ -40,10 +46,55 @@ class QuoteServiceFactory(object):
         "yahoo": YahooQueryService
     }
 
+    def __init__(self, *args, **kwargs):
+        # one transport of each kind shared by every provider created by this factory
+        self.transport = kwargs.get('transport', None) or HttpTransport()
+        self.async_transport = kwargs.get('async_transport', None) or AsyncHttpTransport()
+        self.quote_cache = kwargs.get('quote_cache', None) or QuoteCache()
+        self.single_flight = kwargs.get('single_flight', None) or SingleFlight()
+        # recording the quotes is opt-in, there's no history unless it has somewhere to go
+        self.history = kwargs.get('history', None)
+        if self.history is None and len(configuration.history_path) > 0:
+            self.history = TickHistory(path=configuration.history_path)
+
     def get_service(self, name):
         if not hasattr(self, name):
             try:
-                setattr(self, name, self.providers[name]())
+                provider = self.providers[name]
             except KeyError as e:
                 raise ValueError("provider '{}' not implemented".format(name))
+            if issubclass(provider, BaseQuoteService):
+                service = provider(transport=self.transport, async_transport=self.async_transport)
+            else:
+                service = provider()
+            self.__instrument(name, service)
+            setattr(self, name, service)
         return getattr(self, name)
+
+    def __instrument(self, name, service):
+        """
+        shadow the provider methods on the instance so that every caller goes through the quote cache first and
+        identical calls that are already in flight against the provider get coalesced. The tick history sits closest
+        to the provider so that it only sees quotes that were actually fetched.
+        """
+        resolve = getattr(service, "resolve", normalize_ticker)
+        aresolve = getattr(service, "aresolve", self.__anormalize_ticker)
+        if self.history is not None:
+            if hasattr(service, "get_quote"):
+                service.get_quote = self.history.wrap(name, service.get_quote, resolve)
+            if hasattr(service, "aget_quote"):
+                service.aget_quote = self.history.wrap_async(name, service.aget_quote, aresolve)
+        for method in ("get_quote", "search"):
+            if hasattr(service, method):
+                setattr(service, method, self.single_flight.wrap(name, method, getattr(service, method)))
+        for method in ("aget_quote", "asearch"):
+            if hasattr(service, method):
+                setattr(service, method, self.single_flight.wrap_async(name, method, getattr(service, method)))
+        service.get_quote = self.quote_cache.wrap(name, service.get_quote, resolve)
+        if hasattr(service, "aget_quote"):
+            service.aget_quote = self.quote_cache.wrap_async(name, service.aget_quote, aresolve)
+
+    @staticmethod
+    async def __anormalize_ticker(ticker):
+        # for providers that don't resolve tickers themselves
+        return normalize_ticker(ticker)
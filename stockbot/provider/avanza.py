@@ -1,11 +1,14 @@
 import logging
-import requests
 import re
 
-from datetime import datetime, time
-from lxml.html.soupparser import fromstring
+from datetime import datetime, time, timedelta
+from lxml import etree
 
-from stockbot.provider.base import BaseQuoteService, BaseQuote
+from stockbot.cache import TTLCache
+from stockbot.provider.base import BaseQuoteService, BaseQuote, normalize_ticker
+from stockbot.provider.parser import fromstring
+from stockbot.render import Field
+from stockbot.transport import HttpRequest
 
 LOGGER = logging.getLogger(__name__)
 
@@ -41,115 +44,159 @@ class AvanzaFundQuote(BaseQuote):
         for k, v in self.data.items():
             setattr(self, k, v)
         self.fields = [
-            ["Name", self.name],
-            ["%1D", self.developmentOneDay],
-            ["%1M", self.developmentOneMonth],
-            ["%1Y", self.developmentOneYear],
-            ["%YTD", self.developmentThisYear],
-            ["Fee", "{}%".format(self.productFee)]
+            Field("Name", self.name, Field.TITLE),
+            Field("%1D", self.developmentOneDay, Field.CHANGE),
+            Field("%1M", self.developmentOneMonth, Field.CHANGE),
+            Field("%1Y", self.developmentOneYear, Field.CHANGE),
+            Field("%YTD", self.developmentThisYear, Field.CHANGE),
+            Field("Fee", "{}%".format(self.productFee))
         ]
         if self.rating:
-            self.fields.append(["Rating", "{}/5".format(self.rating)])
+            self.fields.append(Field("Rating", "{}/5".format(self.rating)))
         try:
             self.fields.append(
-              ["Top 3 Holdings", "|".join([
+              Field("Top 3 Holdings", "|".join([
                 "{c}:{l}:{w}%".format(
                     c=self.holdingChartData[i].get("name"),
                     l=self.holdingChartData[i].get("countryCode"),
                     w=self.holdingChartData[i].get("y")
                 ) for i in range(3)])
-               ]
+               )
             )
         except Exception as e:
             LOGGER.exception("Failed to parse holdings data")
 
 
+class AvanzaQuoteExtractor(object):
+
+    """
+    Collects every field of an Avanza quote page in one pass. The expressions are compiled once and apart from
+    locating the quoteBar, history and recommendations subtrees they only ever search within those subtrees.
+    """
+
+    quote_bar = etree.XPath("//div[contains(@class,'quote')]//ul[contains(@class,'quoteBar')]")
+    history = etree.XPath("//div[contains(@class,'history')]/div[contains(@class,'content')]")
+    recommendations = etree.XPath(
+        "//div[contains(@class,'recommendations')]/div[contains(@class,'recommendationsContent')]")
+    display_name = etree.XPath("//div[contains(@class,'controlPanel')]/div[contains(@class,'displayName')]")
+
+    prices = etree.XPath(".//span[contains(@class,'Price')]")
+    change_percent = etree.XPath(".//span[contains(@class,'changePercent')]")
+    updated = etree.XPath(".//span[contains(@class,'updated')]")
+    history_rows = etree.XPath("./table/tbody/tr")
+    recommendation_texts = etree.XPath(".//span[contains(@class,'descriptionText')]")
+
+    recommendation_attributes = {
+        u"Köp": "buyRecommendation",
+        u"Behåll": "holdRecommendation",
+        u"Sälj": "sellRecommendation"
+    }
+
+    @classmethod
+    def extract(cls, tree):
+        """
+        :param tree: root of the parsed quote page
+        :return: quote attributes by name
+        :rtype: dict
+        """
+        quote_root = cls.quote_bar(tree)[0]
+        fields = dict(currency=quote_root.attrib['data-currency'].strip())
+        fields.update(cls.__name(tree, quote_root))
+        fields.update(cls.__change(quote_root))
+        fields.update(cls.__prices(quote_root))
+        fields.update(cls.__updated(quote_root))
+        for history_root in cls.history(tree):
+            fields.update(cls.__history(history_root))
+        recommendations = {}
+        for recommendations_root in cls.recommendations(tree):
+            recommendations.update(cls.__recommendations(recommendations_root))
+        fields.update(recommendations)
+        if len(recommendations) == len(cls.recommendation_attributes):
+            fields["recommendationString"] = "{b}/{h}/{s}".format(
+                b=recommendations["buyRecommendation"], h=recommendations["holdRecommendation"],
+                s=recommendations["sellRecommendation"])
+        else:
+            fields["recommendationString"] = ""
+        return fields
+
+    @classmethod
+    def __name(cls, tree, quote_root):
+        name = quote_root.attrib.get('data-intrument_name', None)
+        if name is None:
+            name = cls.display_name(tree)[0].text.strip()
+        return dict(name=name, ticker=quote_root.attrib.get('data-short_name', name))
+
+    @classmethod
+    def __change(cls, quote_root):
+        try:
+            return dict(percentChange=float(quote_root.attrib['data-change_percent']))
+        except (KeyError, ValueError):
+            span = cls.change_percent(quote_root)
+            return dict(percentChange=percent_str_to_float(span[0].text)) if len(span) > 0 else {}
+
+    @classmethod
+    def __prices(cls, quote_root):
+        fields = {}
+        for price_element in cls.prices(quote_root):
+            # some prices have additional markup so have to use text_content() to merge all children if there are any
+            # https://lxml.de/lxmlhtml.html#html-element-methods
+            attr_names = [x for x in price_element.attrib['class'].split(" ") if x.endswith("Price")]
+            if len(attr_names) > 0:
+                fields[attr_names[0]] = percent_str_to_float(price_element.text_content())
+        return fields
+
+    @classmethod
+    def __updated(cls, quote_root):
+        date_elements = cls.updated(quote_root)
+        if len(date_elements) == 0:
+            LOGGER.warning("Failed to retrieve time")
+            return {}
+        return dict(lastUpdateTime=date_elements[0].text)
+
+    @classmethod
+    def __history(cls, history_root):
+        for history_row in cls.history_rows(history_root):
+            columns = history_row.findall("td")
+            if len(columns) > 2 and columns[0].text == u'i år':
+                return dict(totalReturnYtd=percent_str_to_float(columns[2].text))
+        return {}
+
+    @classmethod
+    def __recommendations(cls, recommendations_root):
+        fields = {}
+        for recommendation_element in cls.recommendation_texts(recommendations_root):
+            recommendation_text = recommendation_element.text or ""
+            recommendation_type = recommendation_text.split(" ")[0].rstrip()  # must strip because Hold recommendation has tabs
+            if recommendation_type in cls.recommendation_attributes and recommendation_text.endswith(")"):
+                recommendation_count = re.sub('[^0-9]*', '', recommendation_text, flags=re.MULTILINE)
+                if len(recommendation_count) > 0:
+                    fields[cls.recommendation_attributes[recommendation_type]] = int(recommendation_count)
+        return fields
+
+
 class AvanzaQuote(BaseQuote):
 
     def __init__(self, *args, **kwargs):
         tree = kwargs.get('tree', None)
+        self.clock = kwargs.get('clock', datetime.now)
 
         if tree is not None:
-            quote_root = tree.xpath("//div[contains(@class,'quote')]//ul[contains(@class,'quoteBar')]")[0]
-            self.currency = quote_root.attrib['data-currency'].rstrip().lstrip()
-            try:
-                self.name = quote_root.attrib['data-intrument_name']
-            except:
-                div = tree.xpath("//div[contains(@class,'controlPanel')]/div[contains(@class,'displayName')]")
-                self.name = div[0].text.lstrip().rstrip()
-            try:
-                self.percentChange = float(quote_root.attrib['data-change_percent'])
-            except:
-                span = tree.xpath("//span[contains(@class,'changePercent')]")
-                raw_percentage = span[0].text
-                self.percentChange = percent_str_to_float(raw_percentage)
-
-            try:
-                self.ticker = quote_root.attrib['data-short_name']
-            except:
-                self.ticker = self.name
-
-            for price_element in quote_root.xpath("//span[contains(@class,'Price')]"):
-                # some prices have additional markup so have to use text_content() to merge all children if there are any
-                # https://lxml.de/lxmlhtml.html#html-element-methods
-                if price_element.text_content() is not None:
-                    attr_name = [x for x in price_element.attrib['class'].split(" ") if x.endswith("Price")][0]
-                    setattr(self, attr_name, percent_str_to_float(price_element.text_content()))
-
-            # get date
-            try:
-                date_element = quote_root.xpath("//span[contains(@class,'updated')]")[0]
-                self.lastUpdateTime = date_element.text
-            except:
-                LOGGER.exception("Failed to retrieve time")
-
-            # get history
-            try:
-                history_rows = tree.xpath("//div[contains(@class,'history')]/div[contains(@class,'content')]/table/tbody/tr")
-                for history_row in history_rows:
-                    columns = history_row.xpath("./td")
-                    if columns[0].text == u'i år':
-                        self.totalReturnYtd = percent_str_to_float(columns[2].text)
-            except:
-                LOGGER.exception("Failed to retrieve history")
-
-            # get recommendations
-            try:
-                attr_map = {
-                    u"Köp": "buyRecommendation",
-                    u"Behåll": "holdRecommendation",
-                    u"Sälj": "sellRecommendation"
-                }
-                recommendation_elements = quote_root.xpath("//div[contains(@class,'recommendations')]/div[contains(@class,'recommendationsContent')]//span[contains(@class,'descriptionText')]")
-                for recommendation_element in recommendation_elements:
-                    recommendation_text = recommendation_element.text
-                    recommendation_type = recommendation_text.split(" ")[0].rstrip()  # must strip because Hold recommendation has tabs
-                    if recommendation_type in attr_map.keys() and recommendation_text.endswith(")"):
-                        recommendation_count = int(re.sub('[^0-9]*', '', recommendation_text, flags=re.MULTILINE))
-                        setattr(self, attr_map[recommendation_type], recommendation_count)
-            except:
-                LOGGER.exception("Failed to parse recommendations")
-                self.recommendationString = ""
-            else:
-                if "N/A" not in (self.buyRecommendation, self.holdRecommendation, self.sellRecommendation):
-                    self.recommendationString = "{b}/{h}/{s}".format(
-                        b=self.buyRecommendation, h=self.holdRecommendation, s=self.sellRecommendation)
-                else:
-                    self.recommendationString = ""
+            for k, v in AvanzaQuoteExtractor.extract(tree).items():
+                setattr(self, k, v)
 
         self.fields = [
-            ["Name", self.name],
-            ["Price", self.lastPrice],
-            ["Low Price", self.lowestPrice],
-            ["High Price", self.highestPrice],
-            ["%1D", self.percentChange],
-            ["%YTD", self.totalReturnYtd]
+            Field("Name", self.name, Field.TITLE),
+            Field("Price", self.lastPrice, Field.NUMBER),
+            Field("Low Price", self.lowestPrice, Field.NUMBER),
+            Field("High Price", self.highestPrice, Field.NUMBER),
+            Field("%1D", self.percentChange, Field.CHANGE),
+            Field("%YTD", self.totalReturnYtd, Field.CHANGE)
         ]
 
         if len(self.recommendationString) > 0:
-            self.fields.append(["Recommendations (B/H/S)", self.recommendationString])
+            self.fields.append(Field("Recommendations (B/H/S)", self.recommendationString, Field.RECOMMENDATION))
 
-        self.fields.append(["Update Time", self.lastUpdateTime])
+        self.fields.append(Field("Update Time", self.lastUpdateTime))
 
     def is_fresh(self):
         if self.lastUpdateEpoch != "N/A":
@@ -158,6 +205,21 @@ class AvanzaQuote(BaseQuote):
         else:
             return False
 
+    def get_timestamp(self):
+        # avanza only shows the time of day, before the open that's still the time of the last close
+        try:
+            update_time = datetime.strptime(self.lastUpdateTime, "%H:%M:%S").time()
+        except (TypeError, ValueError):
+            return None
+        now = self.clock()
+        timestamp = datetime.combine(now.date(), update_time)
+        if timestamp > now:
+            timestamp -= timedelta(days=1)
+        return timestamp
+
+    def get_tick(self):
+        return self.to_tick(self.lastPrice, self.percentChange)
+
 
 class AvanzaSearchResult(object):
 
@@ -166,7 +228,7 @@ class AvanzaSearchResult(object):
         html_response = kwargs.get('message', None)
 
         if html_response is not None:
-            tree = fromstring(html_response)
+            tree = fromstring(html_response, anchor="//ul[contains(@class,'globalSrchRes')]")
             responses = tree.xpath("//ul[contains(@class,'globalSrchRes')]//a[contains(@class,'srchResLink')]")
             for response in responses:
                 self.result.append(dict(
@@ -200,28 +262,45 @@ class AvanzaSearchResult(object):
 
 class AvanzaQueryService(BaseQuoteService):
     # search results probably don't change that much so cache them
-    search_cache = {}
+    search_cache = TTLCache(name="avanza-search", max_entries=512, ttl=24 * 3600)
 
     def __init__(self, *args, **kwargs):
-        pass
+        super(AvanzaQueryService, self).__init__(*args, **kwargs)
 
-    def get_quote(self, ticker):
-        search_result = self.search(ticker)
+    def quote_flow(self, ticker):
+        link = yield from self.__link_flow(ticker)
+        if link is None:
+            return AvanzaFallbackQuote(quote_type="didn't find any quote for {}".format(ticker))
+        try:
+            return (yield from self.__quote_factory(link))
+        except Exception as e:
+            LOGGER.exception("Failed to retrieve quote for {}".format(ticker))
+            return AvanzaFallbackQuote(quote_type="error")
+
+    def resolve_flow(self, ticker):
+        # the quote page of the first hit is what get_quote shows, whatever the search was
+        link = yield from self.__link_flow(ticker)
+        return link if link is not None else normalize_ticker(ticker)
+
+    def __link_flow(self, ticker):
+        search_result = yield from self.search_flow(ticker)
         for search_result_entry in search_result.result:
             if 'link' in search_result_entry:
-                try:
-                    return self.__quote_factory(search_result_entry.get('link'))
-                except Exception as e:
-                    LOGGER.exception("Failed to retrieve quote for {}".format(ticker))
-                    return AvanzaFallbackQuote(quote_type="error")
-        return AvanzaFallbackQuote(quote_type="didn't find any quote for {}".format(ticker))
+                return search_result_entry.get('link')
+        return None
 
     def __quote_factory(self, link):
         if "/fonder/om-fonden.html/" in link:
-            return self.__get_fund_quote(link)
-        response = requests.get(link)
+            response = yield HttpRequest.get(self.__fund_url(link))
+            response.raise_for_status()
+            return AvanzaFundQuote(data=response.json())
+        response = yield HttpRequest.get(link)
         response.raise_for_status()
-        tree = fromstring(response.text)
+        return self.__parse_quote(response.text)
+
+    @staticmethod
+    def __parse_quote(html_response):
+        tree = fromstring(html_response, anchor="//div[@id='surface']")
         quote_type_element = tree.xpath("//div[@id='surface']")
         if len(quote_type_element) > 0:
             quote_type = quote_type_element[0].attrib['data-page_type']
@@ -234,23 +313,23 @@ class AvanzaQueryService(BaseQuoteService):
             LOGGER.warning("Cannot determine quote type")
             return AvanzaFallbackQuote(quote_type="no such element")
 
-    def __get_fund_quote(self, link):
-        id_ = link.split("/")[5]
-        response = requests.get("https://www.avanza.se/_api/fund-guide/guide/{id_}".format(id_=id_))
-        response.raise_for_status()
-        data = response.json()
-        return AvanzaFundQuote(data=data)
-
-    def search(self, query):
-        if query not in self.search_cache:
+    def search_flow(self, query):
+        search_result = self.search_cache.get(query)
+        if search_result is None:
             LOGGER.info("Response from query {q} not in cache, will query avanzas search".format(q=query))
             try:
-                response = requests.get(self.__search_url(query))
-                self.search_cache[query] = AvanzaSearchResult(message=response.text)
+                response = yield HttpRequest.get(self.__search_url(query))
+                search_result = AvanzaSearchResult(message=response.text)
             except Exception as e:
                 LOGGER.exception("Failed to create proper search result")
                 return AvanzaSearchResult()
-        return self.search_cache[query]
+            self.search_cache.set(query, search_result)
+        return search_result
+
+    @staticmethod
+    def __fund_url(link):
+        id_ = link.split("/")[5]
+        return "https://www.avanza.se/_api/fund-guide/guide/{id_}".format(id_=id_)
 
     @staticmethod
     def __search_url(query):
@@ -1,15 +1,95 @@
+import asyncio
 import logging
 
+from stockbot.transport import get_default_transport, get_default_async_transport
+
 LOGGER = logging.getLogger(__name__)
 
 
+def normalize_ticker(ticker):
+    return " ".join(ticker.split()).upper()
+
+
 class BaseQuoteService(object):
 
+    # upper bound of requests in flight against the provider when fetching quotes in bulk
+    max_concurrency = 4
+
+    def __init__(self, *args, **kwargs):
+        self.transport = kwargs.get('transport', None) or get_default_transport()
+        self.async_transport = kwargs.get('async_transport', None) or get_default_async_transport()
+
+    def quote_flow(self, ticker):
+        """
+        generator that yields the HttpRequests it takes to get the quote of ticker and returns the quote, see
+        HttpRequest. get_quote and aget_quote both drive it so a provider only implements a lookup once.
+        """
+        return None
+
+    def search_flow(self, query):
+        return None
+
+    def resolve_flow(self, ticker):
+        """
+        flow that returns the key of the instrument that ticker refers to, providers that look tickers up with a
+        search implement it so that every spelling that finds the same instrument gets the same key
+        """
+        return None
+
+    def resolve(self, ticker):
+        flow = self.resolve_flow(ticker)
+        if flow is None:
+            return normalize_ticker(ticker)
+        return self.transport.drive(flow)
+
+    async def aresolve(self, ticker):
+        flow = self.resolve_flow(ticker)
+        if flow is None:
+            return normalize_ticker(ticker)
+        return await self.async_transport.drive(flow)
+
     def get_quote(self, ticker):
-        raise NotImplemented
+        flow = self.quote_flow(ticker)
+        if flow is None:
+            # blocking shim for providers that only implement the async api
+            return self.async_transport.run(self.aget_quote(ticker))
+        return self.transport.drive(flow)
 
     def search(self, query):
-        raise NotImplemented
+        flow = self.search_flow(query)
+        if flow is None:
+            return self.async_transport.run(self.asearch(query))
+        return self.transport.drive(flow)
+
+    async def aget_quote(self, ticker):
+        flow = self.quote_flow(ticker)
+        if flow is None:
+            raise NotImplementedError
+        return await self.async_transport.drive(flow)
+
+    async def asearch(self, query):
+        flow = self.search_flow(query)
+        if flow is None:
+            raise NotImplementedError
+        return await self.async_transport.drive(flow)
+
+    def get_quotes(self, tickers):
+        return self.async_transport.run(self.aget_quotes(tickers))
+
+    async def aget_quotes(self, tickers):
+        """
+        fetch quotes for several tickers concurrently, results are returned in the same order as the tickers
+        and a failed lookup is returned as the exception it raised
+        :param tickers:
+        :return:
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch(ticker):
+            async with semaphore:
+                return await self.aget_quote(ticker)
+
+        return await asyncio.gather(*[fetch(ticker) for ticker in tickers], return_exceptions=True)
 
 
 class BaseQuote(object):
@@ -34,8 +114,27 @@ class BaseQuote(object):
     def is_fresh(self):
         return False
 
+    def get_timestamp(self):
+        return None
+
+    def get_tick(self):
+        """
+        :return: (price, percent change 1 day) as floats or None if the quote doesn't have a price
+        """
+        return None
+
+    def get_fields(self):
+        return self.fields
+
+    @staticmethod
+    def to_tick(price, change):
+        try:
+            return float(price), float(change)
+        except (TypeError, ValueError):
+            return None
+
     @staticmethod
     def fields_to_str(fields):
         return ", ".join([
-            "{k}: {v}".format(k=x[0], v=x[1]) for x in fields
+            "{k}: {v}".format(k=x.name, v=x.value) for x in fields
         ])
@@ -1,12 +1,14 @@
 import logging
-import requests
 import json
 
 from urllib.parse import urlencode
 from urllib.request import pathname2url
 from datetime import datetime
 
-from stockbot.provider.base import BaseQuoteService
+from stockbot.cache import TTLCache
+from stockbot.provider.base import BaseQuoteService, BaseQuote
+from stockbot.render import Field
+from stockbot.transport import HttpRequest
 
 LOGGER = logging.getLogger(__name__)
 
@@ -15,9 +17,7 @@ class BloombergQuote(object):
 
     def __init__(self, *args, **kwargs):
         data = kwargs.get('message', {})
-        if "basicQuote" not in data:
-            return
-        for k, v in data["basicQuote"].items():
+        for k, v in data.get("basicQuote", {}).items():
             if k == "lastUpdateEpoch":
                 try:
                     setattr(self, "lastUpdateDatetime", datetime.fromtimestamp(int(v)).strftime("%Y-%m-%d %H:%M:%S"))
@@ -25,10 +25,22 @@ class BloombergQuote(object):
                     LOGGER.exception("Failed to create attribute from lastUpdateEpoch")
             setattr(self, k, v)
 
+        self.fields = [
+            Field("Name", self.name, Field.TITLE),
+            Field("Price", self.price, Field.NUMBER),
+            Field("Open Price", self.openPrice, Field.NUMBER),
+            Field("Low Price", self.lowPrice, Field.NUMBER),
+            Field("High Price", self.highPrice, Field.NUMBER),
+            Field("Percent Change 1 Day", self.percentChange1Day, Field.IMPORTANT_CHANGE),
+            Field("Total Return YTD", self.totalReturnYtd, Field.CHANGE),
+            Field("Update Time", self.lastUpdateDatetime)
+        ]
+
     def __str__(self):
-        return "Name: {n}, Price: {p}, Open Price: {op}, Low Price: {lp}, High Price: {hp}, Percent Change 1 Day: {p1d}, Total Return YTD: {ytd}, Update Time: {ut}"\
-            .format(n=self.name, p=self.price, op=self.openPrice, lp=self.lowPrice, hp=self.highPrice,
-                    p1d=self.percentChange1Day, ytd=self.totalReturnYtd, ut=self.lastUpdateDatetime)
+        return BaseQuote.fields_to_str(self.fields)
+
+    def get_fields(self):
+        return self.fields
 
     def __getattribute__(self, item):
         try:
@@ -51,6 +63,14 @@ class BloombergQuote(object):
         else:
             return False
 
+    def get_timestamp(self):
+        if self.lastUpdateEpoch != "N/A":
+            return datetime.fromtimestamp(int(self.lastUpdateEpoch))
+        return None
+
+    def get_tick(self):
+        return BaseQuote.to_tick(self.price, self.percentChange1Day)
+
 
 class BloombergSearchResult(object):
 
@@ -85,15 +105,14 @@ class BloombergSearchResult(object):
 class BloombergQueryService(BaseQuoteService):
 
     # search results probably don't change that much so cache them
-    search_cache = {}
+    search_cache = TTLCache(name="bloomberg-search", max_entries=512, ttl=24 * 3600)
 
     def __init__(self, *args, **kwargs):
-        pass
+        super(BloombergQueryService, self).__init__(*args, **kwargs)
 
-    def get_quote(self, ticker):
+    def quote_flow(self, ticker):
         try:
-            url = self.__quote_url(ticker)
-            req = requests.get(url)
+            req = yield HttpRequest.get(self.__quote_url(ticker))
             if req.ok:
                 j = json.loads(req.text)
                 return BloombergQuote(message=j)
@@ -101,28 +120,27 @@ class BloombergQueryService(BaseQuoteService):
             LOGGER.exception("Failed to retrieve stock quote")
             return BloombergQuote()
 
-    def search(self, query):
-        if query not in self.search_cache:
+    def search_flow(self, query):
+        search_result = self.search_cache.get(query)
+        if search_result is None:
             LOGGER.info("Response from query {q} not in cache, will query bloombergs search api".format(q=query))
+            url = self.__search_url(query)
             try:
-                self.search_cache[query] = self.__search_query(query)
+                search_result = self.__search_result((yield HttpRequest.get(url)))
             except Exception as e:
+                LOGGER.exception("Failed to search for {q}, search url: {u}".format(q=query, u=url))
                 return None
-        return self.search_cache[query]
+            self.search_cache.set(query, search_result)
+        return search_result
 
-    def __search_query(self, query):
-        url = self.__search_url(query)
-        try:
-            req = requests.get(url)
-            if req.ok:
-                j = json.loads(req.text)
-                return BloombergSearchResult(result=j)
-            else:
-                raise Exception("Failed to query bloomberg search api. Code: {c}, Text: {t}".format(c=req.status_code,
-                                                                                                    t=req.text))
-        except Exception as e:
-            LOGGER.exception("Failed to search for {q}, search url: {u}".format(q=query, u=url))
-            raise
+    @staticmethod
+    def __search_result(req):
+        if req.ok:
+            j = json.loads(req.text)
+            return BloombergSearchResult(result=j)
+        else:
+            raise Exception("Failed to query bloomberg search api. Code: {c}, Text: {t}".format(c=req.status_code,
+                                                                                                t=req.text))
 
     @staticmethod
     def __quote_url(ticker):
@@ -1,13 +1,15 @@
 import json
-import requests
 import logging
 import re
 
 from urllib.parse import urlencode
 from stockbot.db import Base
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, Table
 
-from stockbot.provider.base import BaseQuoteService
+from stockbot.cache import TTLCache
+from stockbot.provider.base import BaseQuoteService, BaseQuote
+from stockbot.render import Field
+from stockbot.transport import HttpRequest
 
 LOGGER = logging.getLogger(__name__)
 
@@ -102,6 +104,15 @@ class StockDomain(Base):
         return rv
 
 
+
+# a refresh is bulk loaded here first and then merged into stocks in a single transaction, rows are tagged with the
+# run that loaded them and the nasdaq ticker they were fetched for
+stocks_staging = Table("stocks_staging", Base.metadata,
+                       Column("run", String, index=True),
+                       Column("source", String),
+                       *[Column(c.name, c.type) for c in StockDomain.__table__.columns if c.name != "id"])
+
+
 class GoogleFinanceQuote(object):
 
     def __init__(self, *args, **kwargs):
@@ -122,9 +133,20 @@ class GoogleFinanceQuote(object):
                     continue
             setattr(self, k, v)
 
+        self.fields = [
+            Field("Name", self.name, Field.TITLE),
+            Field("Price", self.l, Field.NUMBER),
+            Field("Open Price", self.op, Field.NUMBER),
+            Field("Low Price", self.lo, Field.NUMBER),
+            Field("High Price", self.hi, Field.NUMBER),
+            Field("Percent Change", self.cp, Field.IMPORTANT_CHANGE)
+        ]
+
     def __str__(self):
-        return "Name: {n}, Price: {p}, Open Price: {op}, Low Price: {lp}, High Price: {hp}, Percent Change: {p1d}"\
-            .format(n=self.name, p=self.l, op=self.op, lp=self.lo, hp=self.hi, p1d=self.cp)
+        return BaseQuote.fields_to_str(self.fields)
+
+    def get_fields(self):
+        return self.fields
 
     def __getattribute__(self, item):
         try:
@@ -183,12 +205,11 @@ class GoogleFinanceSearchResult(object):
 class GoogleFinanceQueryService(BaseQuoteService):
 
     # search results probably don't change that much so cache them
-    search_cache = {}
+    search_cache = TTLCache(name="google-search", max_entries=512, ttl=24 * 3600)
 
-    def get_quote(self, ticker):
+    def quote_flow(self, ticker):
         try:
-            url = self.__quote_url(ticker)
-            req = requests.get(url)
+            req = yield HttpRequest.get(self.__quote_url(ticker))
             if req.ok:
                 j = json.loads(req.content[6:-2].decode('unicode_escape'))
                 return GoogleFinanceQuote(message=j)
@@ -196,28 +217,27 @@ class GoogleFinanceQueryService(BaseQuoteService):
             LOGGER.exception("Failed to get quote for '{ticker}'".format(ticker=ticker))
             return GoogleFinanceQuote()
 
-    def search(self, query):
-        if query not in self.search_cache:
+    def search_flow(self, query):
+        search_result = self.search_cache.get(query)
+        if search_result is None:
             LOGGER.info("Response from query {q} not in cache, will query google finance search api".format(q=query))
+            url = self.__search_url(query)
             try:
-                self.search_cache[query] = self.__search_query(query)
+                search_result = self.__search_result((yield HttpRequest.get(url)))
             except Exception as e:
+                LOGGER.exception("Failed to search for {q}, search url: {u}".format(q=query, u=url))
                 return None
-        return self.search_cache[query]
+            self.search_cache.set(query, search_result)
+        return search_result
 
-    def __search_query(self, query):
-        url = self.__search_url(query)
-        try:
-            req = requests.get(url)
-            if req.ok:
-                j = json.loads(req.text)
-                return GoogleFinanceSearchResult(result=j)
-            else:
-                raise Exception("Failed to query google finance search api. Code: {c}, Text: {t}".format(
-                    c=req.status_code, t=req.text))
-        except Exception as e:
-            LOGGER.exception("Failed to search for {q}, search url: {u}".format(q=query, u=url))
-            raise
+    @staticmethod
+    def __search_result(req):
+        if req.ok:
+            j = json.loads(req.text)
+            return GoogleFinanceSearchResult(result=j)
+        else:
+            raise Exception("Failed to query google finance search api. Code: {c}, Text: {t}".format(
+                c=req.status_code, t=req.text))
 
     @staticmethod
     def __quote_url(ticker):
@@ -1,8 +1,11 @@
-import requests
 import datetime
-from functools import lru_cache
+import re
 
-from stockbot.provider.base import BaseQuoteService
+from stockbot.cache import TTLCache
+from stockbot.concurrency import SingleFlight
+from stockbot.provider.base import BaseQuoteService, BaseQuote
+from stockbot.render import Field
+from stockbot.transport import HttpRequest
 
 
 class IbIndexNonExistingQuote(object):
@@ -22,15 +25,74 @@ class IbIndexQuote(object):
         self.nav_rebate_reported = "{:.3f}".format(message["netAssetValueRebatePremium"])
         self.nav_rebate_calculated = "{:.3f}".format(message["netAssetValueCalculatedRebatePremium"])
         self.nav_datechange = datetime.datetime.utcfromtimestamp(self.message["netAssetValueChangeDate"] / 1000)
+        self.fields = [
+            Field("Name", self.name, Field.TITLE),
+            Field("NAV rebate percentage (reported)", self.nav_rebate_reported, Field.IMPORTANT_CHANGE),
+            Field("NAV rebate percentage (calculated)", self.nav_rebate_calculated, Field.IMPORTANT_CHANGE),
+            Field("NAV datechange", self.nav_datechange)
+        ]
 
     def __str__(self):
-        return "Name: {name}, NAV rebate percentage (reported): {nav_rebate_reported}, NAV rebate percentage " \
-               "(calculated): {nav_rebate_calculated}, NAV datechange: {nav_datechange}".format(
-                name=self.name,
-                nav_rebate_reported=self.nav_rebate_reported,
-                nav_rebate_calculated=self.nav_rebate_calculated,
-                nav_datechange=self.nav_datechange
-                )
+        return BaseQuote.fields_to_str(self.fields)
+
+    def get_fields(self):
+        return self.fields
+
+
+class IbIndexSnapshot(object):
+
+    """
+    Indexed copy of the complete product list, products are keyed by their lowercased ticker and every word of
+    the product name points back to the products that carry it. So does every part of a word, the product list
+    is small and only rebuilt when it expires so partial words are a lookup as well instead of a scan.
+    """
+
+    token_pattern = re.compile(r"\w+")
+
+    def __init__(self, data):
+        self.products = {}
+        self.names = {}
+        self.order = {}
+        self.tokens = {}
+        for item in data:
+            key = item["product"].lower()
+            self.products[key] = item
+            self.names[key] = item["productName"].lower()
+            self.order[key] = len(self.order)
+            for token in self.tokenize(item["productName"]):
+                self.tokens.setdefault(token, set()).add(key)
+        self.fragments = {}
+        for token, keys in self.tokens.items():
+            for start in range(len(token)):
+                for end in range(start + 1, len(token) + 1):
+                    self.fragments.setdefault(token[start:end], set()).update(keys)
+
+    def __len__(self):
+        return len(self.products)
+
+    @classmethod
+    def tokenize(cls, text):
+        return cls.token_pattern.findall(text.lower())
+
+    def get(self, ticker):
+        return self.products.get(ticker.lower(), None)
+
+    def search(self, query):
+        query_lower = query.lower()
+        candidates = set()
+        if query_lower in self.products:
+            candidates.add(query_lower)
+        words = self.tokenize(query_lower)
+        if len(words) > 0:
+            keys = None
+            for word in words:
+                matches = self.fragments.get(word, set())
+                keys = matches if keys is None else keys & matches
+            # the candidates only share the words, the query still has to be part of the name as a whole
+            candidates.update(k for k in keys if query_lower in self.names[k])
+        else:
+            candidates.update(k for k, name in self.names.items() if query_lower in name)
+        return [self.products[k] for k in sorted(candidates, key=self.order.get)]
 
 
 class IbIndexSearchResult(object):
@@ -49,20 +111,21 @@ class IbIndexSearchResult(object):
         return result
 
     def get_ranked_ticker(self):
-        ranked = []
-        for item in self.result:
-            if self.query == item["product"].lower():
-                rank = 1.0
-            else:
-                rank = len(self.query) / len(item["productName"])
-            ranked.append((rank, item["product"]))
-        ranked.sort(key=lambda x: x[0], reverse=True)
-        return ranked[0][1]
+        by_product = {item["product"].lower(): item for item in self.result}
+        if self.query in by_product:
+            return by_product[self.query]["product"]
+        # otherwise the rank is len(query) / len(productName) so the shortest name that matched wins
+        return sorted(self.result, key=lambda item: len(item["productName"]))[0]["product"]
 
 
 class IbIndexQueryService(BaseQuoteService):
 
+    # net asset values are updated during the day so don't hold on to the product list for too long
+    snapshot_cache = TTLCache(name="ibindex-products", max_entries=1, ttl=10 * 60)
+    snapshot_flight = SingleFlight()
+
     def __init__(self, *args, **kwargs):
+        super(IbIndexQueryService, self).__init__(*args, **kwargs)
         self.url = "http://ibindex.se/ibi//index/getProducts.req"
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_6) AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -70,23 +133,54 @@ class IbIndexQueryService(BaseQuoteService):
         }
 
     def get_quote(self, ticker):
-        response = requests.post(self.url, headers=self.headers)
-        response.raise_for_status()
-        data = response.json()
-        try:
-            message = [x for x in data if x["product"].lower() == ticker.lower()][0]
-            return IbIndexQuote(message=message)
-        except IndexError:
-            return IbIndexNonExistingQuote(ticker=ticker)
+        return self.__quote(self.get_snapshot(), ticker)
+
+    async def aget_quote(self, ticker):
+        return self.__quote(await self.aget_snapshot(), ticker)
 
-    @lru_cache(maxsize=10)
     def search(self, query):
-        query_lower = query.lower()
-        response = requests.post(self.url, headers=self.headers)
+        return self.__search_result(self.get_snapshot(), query)
+
+    async def asearch(self, query):
+        return self.__search_result(await self.aget_snapshot(), query)
+
+    def get_snapshot(self):
+        """
+        product list shared by every query until it expires, concurrent callers share a single download
+        :return:
+        :rtype: IbIndexSnapshot
+        """
+        snapshot = self.snapshot_cache.get(self.url)
+        if snapshot is None:
+            snapshot = self.snapshot_flight.do(self.url, self.__download)
+        return snapshot
+
+    async def aget_snapshot(self):
+        snapshot = self.snapshot_cache.get(self.url)
+        if snapshot is None:
+            snapshot = await self.snapshot_flight.ado(self.url, self.__adownload)
+        return snapshot
+
+    def __download(self):
+        return self.transport.drive(self.__download_flow())
+
+    async def __adownload(self):
+        return await self.async_transport.drive(self.__download_flow())
+
+    def __download_flow(self):
+        response = yield HttpRequest.post(self.url, headers=self.headers)
         response.raise_for_status()
-        data = response.json()
-        matches = []
-        for item in data:
-            if query_lower == item["product"].lower() or query_lower in item["productName"].lower():
-                matches.append(item)
-        return IbIndexSearchResult(result=matches, query=query_lower)
+        snapshot = IbIndexSnapshot(response.json())
+        self.snapshot_cache.set(self.url, snapshot)
+        return snapshot
+
+    @staticmethod
+    def __quote(snapshot, ticker):
+        message = snapshot.get(ticker)
+        if message is None:
+            return IbIndexNonExistingQuote(ticker=ticker)
+        return IbIndexQuote(message=message)
+
+    @staticmethod
+    def __search_result(snapshot, query):
+        return IbIndexSearchResult(result=snapshot.search(query), query=query.lower())
@@ -1,17 +1,18 @@
 import logging
-import requests
 import re
 
 from datetime import datetime, time
-from lxml.html.soupparser import fromstring
 
-from stockbot.provider.base import BaseQuoteService
+from stockbot.provider.base import BaseQuoteService, BaseQuote
+from stockbot.render import Field
+from stockbot.transport import HttpRequest
+from stockbot.provider.parser import fromstring
 
 LOGGER = logging.getLogger(__name__)
 
 
 def ig_quote_factory(html_data):
-    tree = fromstring(html_data)
+    tree = fromstring(html_data, anchor="//div[@class='ma-box']")
     return IGQuote(tree=tree)
 
 
@@ -46,10 +47,19 @@ class IGQuote(object):
             self.price_change_points = float(tree.xpath("//div[@class='price-ticket__fluctuations']//span[@data-field='CPT']")[0].text)
             self.price_change_percent = float(tree.xpath("//div[@class='price-ticket__fluctuations']//span[@data-field='CPC']")[0].text)
 
+        self.fields = [
+            Field("Name", self.ticker, Field.TITLE),
+            Field("Buy Price", self.buy_price, Field.NUMBER),
+            Field("Sell Price", self.sell_price, Field.NUMBER),
+            Field("Percent Change", self.price_change_percent, Field.IMPORTANT_CHANGE),
+            Field("Points Change", self.price_change_points, Field.IMPORTANT_CHANGE)
+        ]
+
     def __str__(self):
-        return "Name: {n}, Buy Price: {bp}, Sell Price: {sp}, Percent Change: {pc}, Points Change: {ppc}" \
-            .format(n=self.ticker, bp=self.buy_price, sp=self.sell_price, pc=self.price_change_percent,
-                    ppc=self.price_change_points)
+        return BaseQuote.fields_to_str(self.fields)
+
+    def get_fields(self):
+        return self.fields
 
     def __getattribute__(self, item):
         try:
@@ -76,11 +86,11 @@ class IGQuote(object):
 class IGQueryService(BaseQuoteService):
 
     def __init__(self, *args, **kwargs):
-        pass
+        super(IGQueryService, self).__init__(*args, **kwargs)
 
-    def get_quote(self, ticker):
+    def quote_flow(self, ticker):
         try:
-            response = requests.get(self.__query_url(ticker))
+            response = yield HttpRequest.get(self.__query_url(ticker))
             return ig_quote_factory(response.text)
         except Exception as e:
             LOGGER.exception("Failed to retrieve quote for {}".format(ticker))
@@ -90,6 +100,9 @@ class IGQueryService(BaseQuoteService):
         # doesnt have search
         return []
 
+    async def asearch(self, query):
+        return []
+
     @staticmethod
     def __query_url(index):
         url = "https://www.ig.com/en-ch/indices/markets-indices/{index}".format(index=index)
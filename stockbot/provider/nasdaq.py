@@ -1,8 +1,19 @@
-import requests
-from lxml.html.soupparser import fromstring
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+from lxml import etree
 from sqlalchemy import Column, Integer, String
 
+from stockbot.configuration import configuration
 from stockbot.db import Base
+from stockbot.provider.parser import fromstring
+from stockbot.transport import get_default_transport
+
+LOGGER = logging.getLogger(__name__)
+
+# marks the end of a scraped index in the queue of rows
+DONE = object()
 
 
 class NasdaqCompany(Base):
@@ -32,6 +43,114 @@ class NasdaqCompany(Base):
         return self.name == other
 
 
+class NasdaqListingChanges(object):
+
+    """
+    What a sync of the listed companies changed, by ticker
+    """
+
+    # list the tickers when there are only a few of them
+    max_details = 10
+
+    def __init__(self, *args, **kwargs):
+        self.total = 0
+        self.added = []
+        self.updated = []
+        self.removed = []
+        self.failed = []
+
+    def __str__(self):
+        def describe(tickers):
+            if 0 < len(tickers) <= self.max_details:
+                return "{} ({})".format(len(tickers), ", ".join(sorted(tickers)))
+            return str(len(tickers))
+
+        rv = "Synced {total} companies from Nasdaq - Added: {added}, Updated: {updated}, Removed: {removed}".format(
+            total=self.total, added=describe(self.added), updated=describe(self.updated),
+            removed=describe(self.removed))
+        if len(self.failed) > 0:
+            rv += ", Failed: {}".format(", ".join(self.failed))
+        return rv
+
+
+class NasdaqListingSync(object):
+
+    """
+    Diffs the scraped companies against the stored ones by ticker one company at a time, so a listing can be
+    synced while it is still being downloaded. Companies are only removed from the segments that were read
+    completely, a page that failed to load or came back empty doesn't delist anything. Nothing is committed, the
+    caller does that in one go.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.changes = NasdaqListingChanges()
+        self.existing = dict([(c.ticker, c) for c in session.query(NasdaqCompany).all()])
+        self.listed = set()
+        self.counts = {}
+        self.segments = set()
+
+    def add(self, company):
+        """
+        :type company: NasdaqCompany
+        """
+        self.counts[company.segment] = self.counts.get(company.segment, 0) + 1
+        # a company listed in more than one segment keeps the first one
+        if company.ticker in self.listed:
+            return
+        self.listed.add(company.ticker)
+        current = self.existing.get(company.ticker, None)
+        if current is None:
+            self.session.add(company)
+            self.changes.added.append(company.ticker)
+            return
+        changed = False
+        for attribute in ("name", "currency", "category", "segment"):
+            if getattr(current, attribute) != getattr(company, attribute):
+                setattr(current, attribute, getattr(company, attribute))
+                changed = True
+        if changed:
+            self.changes.updated.append(company.ticker)
+
+    def complete(self, segment):
+        """
+        every company of the segment has been added
+        """
+        # an empty listing is more likely a changed page than an empty index
+        if self.counts.get(segment.lower(), 0) == 0:
+            self.changes.failed.append(segment)
+        else:
+            self.segments.add(segment.lower())
+
+    def finish(self, failed=()):
+        """
+        :param failed: segments that couldn't be scraped
+        :rtype: NasdaqListingChanges
+        """
+        self.changes.failed.extend(failed)
+        self.changes.total = len(self.listed)
+        for ticker, current in self.existing.items():
+            if ticker not in self.listed and current.segment in self.segments:
+                self.session.delete(current)
+                self.changes.removed.append(ticker)
+        return self.changes
+
+
+def sync_companies(session, scraped, failed=()):
+    """
+    :param session: sqlalchemy session
+    :param scraped: dict of segment to the companies listed in it
+    :param failed: segments that couldn't be scraped
+    :rtype: NasdaqListingChanges
+    """
+    sync = NasdaqListingSync(session)
+    for segment, companies in scraped.items():
+        for company in companies:
+            sync.add(company)
+        sync.complete(segment)
+    return sync.finish(failed)
+
+
 class NasdaqIndexScraper(object):
 
     indexes = {
@@ -40,19 +159,114 @@ class NasdaqIndexScraper(object):
         "Nordic Small Cap": "http://www.nasdaqomxnordic.com/shares/listed-companies/nordic-small-cap"
     }
 
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36"
+    }
+
+    def __init__(self, *args, **kwargs):
+        self.transport = kwargs.get('transport', None) or get_default_transport()
+        # "stream" parses the listing while it downloads, "tree" reads the whole page before parsing it
+        self.mode = kwargs.get('mode', configuration.nasdaq_parser)
+        self.chunk_size = int(kwargs.get('chunk_size', 16384))
+
     def scrape(self, i):
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36"
-        }
-        res = requests.get(self.indexes[i], headers=headers)
-        tree = fromstring(res.text)
+        if self.mode == "stream":
+            return list(self.iter_companies(i))
+        res = self.transport.get(self.indexes[i], headers=self.headers)
+        tree = fromstring(res.text, anchor="//article[@class='nordic-our-listed-companies']//tbody")
         companies = tree.xpath("//article[@class='nordic-our-listed-companies']//tbody/tr")
-        rv = []
-        for company in companies:
-            fields = company.findall("td")
-            name = fields[0].find("a").text
-            ticker = fields[1].text
-            currency = fields[2].text
-            category = fields[4].text
-            rv.append(NasdaqCompany(name=name, ticker=ticker, currency=currency, category=category, segment=i))
-        return rv
+        return [self.__company(company, i) for company in companies]
+
+    def iter_companies(self, i):
+        """
+        stream the listing through an event driven parser and yield every company as soon as its row is complete,
+        rows are dropped from the tree once they have been read so memory doesn't grow with the page
+        :rtype: collections.Iterable[NasdaqCompany]
+        """
+        res = self.transport.get(self.indexes[i], headers=self.headers, stream=True)
+        try:
+            parser = etree.HTMLPullParser(events=("end",))
+            for chunk in res.iter_content(chunk_size=self.chunk_size, decode_unicode=res.encoding is not None):
+                parser.feed(chunk)
+                yield from self.__read_events(parser, i)
+            parser.close()
+            yield from self.__read_events(parser, i)
+        finally:
+            res.close()
+
+    def __read_events(self, parser, i):
+        for _, element in parser.read_events():
+            if element.tag == "tr" and self.__in_listing(element):
+                yield self.__company(element, i)
+                # forget the rows that have been read
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif not any(self.__in_listing(a) for a in element.iterancestors("tr")):
+                # only the cells of the row being read are needed, everything else can go once it's parsed
+                element.clear(keep_tail=True)
+
+    @staticmethod
+    def __in_listing(row):
+        parent = row.getparent()
+        if parent is None or parent.tag != "tbody":
+            return False
+        return any(a.get("class") == "nordic-our-listed-companies" for a in parent.iterancestors("article"))
+
+    @staticmethod
+    def __company(row, i):
+        fields = row.findall("td")
+        name = fields[0].find("a").text
+        ticker = fields[1].text
+        currency = fields[2].text
+        category = fields[4].text
+        return NasdaqCompany(name=name, ticker=ticker, currency=currency, category=category, segment=i)
+
+    def iter_all(self, max_workers=3):
+        """
+        scrape every index concurrently and yield (segment, company) as soon as a row is read, whatever index it's
+        from. (segment, None) follows the last company of a segment that was read completely, a segment that fails
+        never gets one.
+        """
+        rows = Queue()
+
+        def scrape(index):
+            try:
+                companies = self.iter_companies(index) if self.mode == "stream" else self.scrape(index)
+                for company in companies:
+                    rows.put((index, company))
+                rows.put((index, None))
+            except Exception as e:
+                LOGGER.exception("Failed to scrape '{}'".format(index))
+            finally:
+                rows.put(DONE)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nasdaq") as executor:
+            for index in self.indexes.keys():
+                executor.submit(scrape, index)
+            remaining = len(self.indexes)
+            while remaining > 0:
+                row = rows.get()
+                if row is DONE:
+                    remaining -= 1
+                else:
+                    yield row
+
+    def scrape_all(self, max_workers=3):
+        """
+        scrape every index concurrently
+        :return: dict of segment to companies and the list of segments that failed
+        """
+        def scrape(index):
+            try:
+                return self.scrape(index)
+            except Exception as e:
+                LOGGER.exception("Failed to scrape '{}'".format(index))
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nasdaq") as executor:
+            results = dict(zip(self.indexes.keys(), executor.map(scrape, self.indexes.keys())))
+        # an empty listing is more likely a changed page than an empty index, don't let it delist everything
+        scraped = dict([(k, v) for k, v in results.items() if v is not None and len(v) > 0])
+        failed = [k for k in results.keys() if k not in scraped]
+        return scraped, failed
@@ -0,0 +1,59 @@
+import logging
+
+import lxml.html
+from lxml.html import soupparser
+
+from stockbot.configuration import configuration
+
+LOGGER = logging.getLogger(__name__)
+
+
+def lxml_fromstring(text):
+    return lxml.html.fromstring(text)
+
+
+def soup_fromstring(text):
+    return soupparser.fromstring(text)
+
+
+class HtmlParser(object):
+
+    """
+    Parses scraped pages with a fast parser first and only falls back to the (much slower) BeautifulSoup based
+    parser when the fast one fails or when the resulting tree lacks the nodes that the caller is going to look for
+    """
+
+    parsers = {
+        "lxml": lxml_fromstring,
+        "soup": soup_fromstring
+    }
+
+    def __init__(self, *args, **kwargs):
+        self.parser = kwargs.get('parser', configuration.html_parser)
+        self.fallback = kwargs.get('fallback', "soup")
+        self.fallbacks = 0
+
+    def fromstring(self, text, anchor=None):
+        """
+        :param text: html document
+        :param anchor: xpath expression that must match in the parsed tree for the fast parse to be accepted
+        :return: root element of the parsed tree
+        """
+        if self.fallback is None or self.fallback == self.parser:
+            return self.parsers[self.parser](text)
+        try:
+            tree = self.parsers[self.parser](text)
+            if anchor is None or len(tree.xpath(anchor)) > 0:
+                return tree
+            LOGGER.debug("No match for '{a}' using the '{p}' parser".format(a=anchor, p=self.parser))
+        except Exception as e:
+            LOGGER.debug("Failed to parse using the '{p}' parser: {e}".format(p=self.parser, e=e))
+        self.fallbacks += 1
+        return self.parsers[self.fallback](text)
+
+
+html_parser = HtmlParser()
+
+
+def fromstring(text, anchor=None):
+    return html_parser.fromstring(text, anchor=anchor)
@@ -1,9 +1,11 @@
 import logging
-import requests
 import urllib.parse
 from datetime import datetime
 
-from stockbot.provider.base import BaseQuoteService, BaseQuote
+from stockbot.cache import TTLCache
+from stockbot.provider.base import BaseQuoteService, BaseQuote, normalize_ticker
+from stockbot.render import Field
+from stockbot.transport import HttpRequest
 
 LOGGER = logging.getLogger(__name__)
 
@@ -37,20 +39,20 @@ class YahooQuote(BaseQuote):
         self.is_pre_market = self.marketState == "PRE"
 
         self.fields = [
-            ["Name", self.shortName],
-            ["Price", self.regularMarketPrice],
-            ["Low Price", self.regularMarketDayLow],
-            ["High Price", self.regularMarketDayHigh],
-            ["Percent Change 1 Day", self.regularMarketChangePercent]
+            Field("Name", self.shortName, Field.TITLE),
+            Field("Price", self.regularMarketPrice, Field.NUMBER),
+            Field("Low Price", self.regularMarketDayLow, Field.NUMBER),
+            Field("High Price", self.regularMarketDayHigh, Field.NUMBER),
+            Field("Percent Change 1 Day", self.regularMarketChangePercent, Field.IMPORTANT_CHANGE)
         ]
         if self.is_pre_market:
             self.fields.extend([
-                ["Price Pre Market", self.preMarketPrice],
-                ["Percent Change Pre Market", self.preMarketChangePercent]
+                Field("Price Pre Market", self.preMarketPrice, Field.NUMBER),
+                Field("Percent Change Pre Market", self.preMarketChangePercent, Field.IMPORTANT_CHANGE)
             ])
         self.fields.extend([
-            ["Market", self.market],
-            ["Update Time", self.timestamp_str]
+            Field("Market", self.market),
+            Field("Update Time", self.timestamp_str)
         ])
 
     def is_fresh(self):
@@ -58,6 +60,12 @@ class YahooQuote(BaseQuote):
             return False
         return (datetime.now() - self.timestamp).total_seconds() < 16 * 60
 
+    def get_timestamp(self):
+        return self.timestamp
+
+    def get_tick(self):
+        return self.to_tick(self.regularMarketPrice, self.regularMarketChangePercent)
+
 
 class YahooSearchResult(object):
 
@@ -77,27 +85,44 @@ class YahooSearchResult(object):
 
 class YahooQueryService(BaseQuoteService):
     # search results probably don't change that much so cache them
-    search_cache = {}
+    search_cache = TTLCache(name="yahoo-search", max_entries=512, ttl=6 * 3600)
 
     def __init__(self, *args, **kwargs):
-        pass
+        super(YahooQueryService, self).__init__(*args, **kwargs)
 
-    def get_quote(self, ticker):
-        search_result = self.search(ticker)
+    def quote_flow(self, ticker):
+        search_result = yield from self.search_flow(ticker)
         if not search_result.is_empty():
             t = search_result.get_tickers()[0]
-            response = requests.get("https://query1.finance.yahoo.com/v7/finance/options/{t}".format(t=t))
+            response = yield HttpRequest.get(self.__quote_url(t))
             response.raise_for_status()
             return YahooQuote(response.json())
         else:
             return YahooFallbackQuote()
 
-    def search(self, query):
+    def resolve_flow(self, ticker):
+        search_result = yield from self.search_flow(ticker)
+        if not search_result.is_empty():
+            return search_result.get_tickers()[0]
+        return normalize_ticker(ticker)
+
+    def search_flow(self, query):
+        search_result = self.search_cache.get(query)
+        if search_result is None:
+            response = yield HttpRequest.get(self.__search_url(query))
+            response.raise_for_status()
+            search_result = YahooSearchResult(response.json())
+            self.search_cache.set(query, search_result)
+        return search_result
+
+    @staticmethod
+    def __quote_url(ticker):
+        return "https://query1.finance.yahoo.com/v7/finance/options/{t}".format(t=ticker)
+
+    @staticmethod
+    def __search_url(query):
         query_encoded = urllib.parse.quote(query)
-        response = requests.get(
-            'https://query2.finance.yahoo.com/v1/finance/search?q='
-            '{query}&lang=en-US&region=US&quotesCount=1&newsCount=0&enableFuzzyQuery=false&quotesQueryId'
-            '=tss_match_phrase_query&multiQuoteQueryId=multi_quote_single_token_query&newsQueryId=news_cie_vespa'
-            '&enableCb=true&enableNavLinks=true&enableEnhancedTrivialQuery=true'.format(query=query_encoded))
-        response.raise_for_status()
-        return YahooSearchResult(response.json())
+        return 'https://query2.finance.yahoo.com/v1/finance/search?q=' \
+               '{query}&lang=en-US&region=US&quotesCount=1&newsCount=0&enableFuzzyQuery=false&quotesQueryId' \
+               '=tss_match_phrase_query&multiQuoteQueryId=multi_quote_single_token_query&newsQueryId=news_cie_vespa' \
+               '&enableCb=true&enableNavLinks=true&enableEnhancedTrivialQuery=true'.format(query=query_encoded)
@@ -0,0 +1,130 @@
+import json
+
+from stockbot.util import ColorHelper, colorify
+
+
+class Field(object):
+
+    """
+    A single name/value pair of a result, the result that builds it states the kind which decides how the value gets
+    presented. The names are never looked at, that kind of guessing is left to colorify for legacy string results.
+    """
+
+    TITLE = "title"
+    NUMBER = "number"
+    CHANGE = "change"
+    IMPORTANT_CHANGE = "important_change"
+    RECOMMENDATION = "recommendation"
+    TEXT = "text"
+
+    numeric_kinds = (NUMBER, CHANGE, IMPORTANT_CHANGE)
+
+    def __init__(self, name, value, kind=TEXT):
+        self.name = name
+        self.value = value
+        self.number = self.__to_number(value)
+        # a value the provider didn't have ("N/A") is shown as it is whatever kind it was meant to be
+        if kind in self.numeric_kinds and self.number is None:
+            kind = self.TEXT
+        elif kind == self.RECOMMENDATION and len(str(value).split("/")) != 3:
+            kind = self.TEXT
+        self.kind = kind
+
+    def __repr__(self):
+        return "<Field(name='{n}', value='{v}', kind='{k}')>".format(n=self.name, v=self.value, k=self.kind)
+
+    @staticmethod
+    def __to_number(value):
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, str):
+            try:
+                return float(value)
+            except ValueError:
+                return None
+        return None
+
+
+def structured_fields(result):
+    """
+    :return: the fields of results that carry them or None for legacy results that only render to a string
+    :rtype: list[Field]
+    """
+    get_fields = getattr(result, "get_fields", None)
+    if not callable(get_fields):
+        return None
+    return get_fields()
+
+
+class PlainRenderer(object):
+
+    @staticmethod
+    def render(result):
+        fields = structured_fields(result)
+        if fields is None:
+            return str(result)
+        return ", ".join(["{k}: {v}".format(k=f.name, v=f.value) for f in fields])
+
+
+class IrcRenderer(object):
+
+    """
+    Same look as colorify but rendered straight from the fields, colorify is only used for legacy string results
+    """
+
+    separator = ColorHelper.white(",")
+
+    @classmethod
+    def render(cls, result):
+        return cls.separator.join(cls.render_segments(result))
+
+    @classmethod
+    def render_segments(cls, result):
+        """
+        :return: the rendered fields, a long result can be split into several messages between any two of them
+        :rtype: list[str]
+        """
+        fields = structured_fields(result)
+        if fields is None:
+            return colorify(str(result)).split(cls.separator)
+        return [cls.render_field(f, index) for index, f in enumerate(fields)]
+
+    @staticmethod
+    def render_field(field, index=0):
+        if field.kind == Field.CHANGE:
+            v = "{:.3f}".format(field.number)
+            value = ColorHelper.red(v) if field.number < 0 else ColorHelper.green(v)
+        elif field.kind == Field.IMPORTANT_CHANGE:
+            v = "{:.3f}".format(field.number)
+            value = ColorHelper.bold(ColorHelper.red(v) if field.number < 0 else ColorHelper.green(v))
+        elif field.kind == Field.NUMBER:
+            value = ColorHelper.grey("{:.3f}".format(field.number))
+        elif field.kind == Field.TITLE:
+            value = ColorHelper.bold(ColorHelper.white(field.value))
+        elif field.kind == Field.RECOMMENDATION:
+            buy, hold, sell = str(field.value).split("/")
+            value = "{}/{}/{}".format(ColorHelper.green(buy), ColorHelper.yellow(hold), ColorHelper.red(sell))
+        else:
+            value = ColorHelper.grey(field.value)
+        # fields are separated by ", " so everything but the first one is indented by a space
+        name = field.name if index == 0 else " {}".format(field.name)
+        return "{k}: {v}".format(k=ColorHelper.purple(name), v=value)
+
+
+class JsonRenderer(object):
+
+    @staticmethod
+    def render(result):
+        fields = structured_fields(result)
+        if fields is None:
+            return json.dumps(str(result), ensure_ascii=False)
+        return json.dumps(dict([(f.name, f.value) for f in fields]), ensure_ascii=False, default=str)
+
+
+renderers = {
+    "irc": IrcRenderer,
+    "plain": PlainRenderer,
+    "json": JsonRenderer
+}
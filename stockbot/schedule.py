@@ -0,0 +1,312 @@
+import heapq
+import itertools
+import re
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+
+def parse_range(expression, low, high):
+    """
+    parse a cron style field, "*", "1-5", "9,12,15", "*/15" or "0-30/10"
+    :return: sorted list of the matching values
+    """
+    values = set()
+    for part in expression.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError("step must be at least 1: '{}'".format(expression))
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = [int(x) for x in part.split("-", 1)]
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end:
+            raise ValueError("'{e}' is out of range {l}-{h}".format(e=expression, l=low, h=high))
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+def format_range(values):
+    """
+    inverse of parse_range, consecutive values are collapsed into ranges
+    """
+    parts = []
+    for _, group in itertools.groupby(enumerate(values), lambda x: x[1] - x[0]):
+        group = [v for _, v in group]
+        parts.append(str(group[0]) if len(group) == 1 else "{}-{}".format(group[0], group[-1]))
+    return ",".join(parts)
+
+
+class TimeWindow(object):
+
+    """
+    Hours of the day and days of the week (1 is monday, 7 is sunday) when a schedule is allowed to run
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.hours = kwargs.get('hours', None)
+        self.days = kwargs.get('days', None)
+
+    def contains(self, dt):
+        return (self.days is None or dt.isoweekday() in self.days) and (self.hours is None or dt.hour in self.hours)
+
+    def next_open(self, dt):
+        """
+        :return: dt if the window is open then, otherwise the start of the next hour when it is
+        """
+        if self.contains(dt):
+            return dt
+        dt = dt.replace(minute=0, second=0, microsecond=0)
+        # a week of hours is enough to hit every combination of hour and day
+        for _ in range(24 * 8):
+            dt += timedelta(hours=1)
+            if self.contains(dt):
+                return dt
+        raise ValueError("time window is never open")
+
+    def __str__(self):
+        parts = []
+        if self.hours is not None:
+            parts.append("hours {}".format(format_range(self.hours)))
+        if self.days is not None:
+            parts.append("days {}".format(format_range(self.days)))
+        return " ".join(parts)
+
+
+class IntervalSchedule(object):
+
+    """
+    Runs every `interval` seconds. Every job gets its own fixed offset into the interval, derived from its key,
+    so that jobs with the same interval are spread out instead of all firing at the same time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.interval = int(kwargs.get('interval'))
+        self.window = kwargs.get('window', TimeWindow())
+        if self.interval < 1:
+            raise ValueError("interval must be at least 1 second")
+
+    def next_run(self, after, key=""):
+        phase = zlib.crc32(key.encode("utf-8")) % self.interval
+        candidate = self.__align(after, phase)
+        for _ in range(10000):
+            if self.window.contains(candidate):
+                return candidate
+            candidate = self.__align(self.window.next_open(candidate) - timedelta(microseconds=1), phase)
+        raise ValueError("'{}' never runs within its time window".format(self))
+
+    def __align(self, after, phase):
+        # first point in time after `after` that is `phase` seconds into an interval counted from the epoch
+        timestamp = int(after.timestamp())
+        candidate = timestamp - (timestamp - phase) % self.interval
+        while candidate <= after.timestamp():
+            candidate += self.interval
+        return datetime.fromtimestamp(candidate)
+
+    def __str__(self):
+        return " ".join(filter(None, ["every {}".format(format_duration(self.interval)), str(self.window)]))
+
+
+class CronSchedule(object):
+
+    """
+    Cron style schedule with minute, hour, day of month, month and day of week fields (0 or 7 is sunday)
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.fields = kwargs.get('fields')
+        self.window = kwargs.get('window', TimeWindow())
+        minute, hour, day, month, weekday = self.fields
+        self.minutes = parse_range(minute, 0, 59)
+        self.hours = parse_range(hour, 0, 23)
+        self.days = parse_range(day, 1, 31)
+        self.months = parse_range(month, 1, 12)
+        self.weekdays = set([d % 7 for d in parse_range(weekday, 0, 7)])
+        # like cron, when both day fields are restricted either one of them matching is enough
+        self.any_day = day != "*" and weekday != "*"
+
+    def __day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = dt.isoweekday() % 7 in self.weekdays
+        return (day or weekday) if self.any_day else (day and weekday)
+
+    def next_run(self, after, key=""):
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # five years covers every valid combination, including the 29th of february on a given weekday
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.__day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            elif not self.window.contains(dt):
+                dt = self.window.next_open(dt)
+            else:
+                return dt
+        raise ValueError("cron expression '{}' never matches".format(" ".join(self.fields)))
+
+    def __str__(self):
+        return " ".join(filter(None, ["cron {}".format(" ".join(self.fields)), str(self.window)]))
+
+
+duration_regex = re.compile(r"^(\d+)([smhd]?)$")
+duration_units = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(expression):
+    match = duration_regex.match(expression)
+    if match is None:
+        raise ValueError("invalid duration '{}', expected something like 90s, 15m, 1h or 1d".format(expression))
+    return int(match.group(1)) * duration_units[match.group(2)]
+
+
+def format_duration(seconds):
+    for unit in ["d", "h", "m"]:
+        if seconds % duration_units[unit] == 0:
+            return "{}{}".format(seconds // duration_units[unit], unit)
+    return "{}s".format(seconds)
+
+
+def parse_schedule(tokens):
+    """
+    parse a schedule from the start of tokens
+
+        every <duration> [hours <range>] [days <range>]
+        cron <minute> <hour> <day> <month> <weekday> [hours <range>] [days <range>]
+
+    :return: the schedule and the number of tokens it took up
+    """
+    tokens = list(tokens)
+    if len(tokens) >= 2 and tokens[0] == "every":
+        interval = parse_duration(tokens[1])
+        consumed = 2
+    elif len(tokens) >= 6 and tokens[0] == "cron":
+        fields = tokens[1:6]
+        consumed = 6
+    else:
+        raise ValueError("schedule must be 'every <duration>' or 'cron <minute> <hour> <day> <month> <weekday>'")
+
+    window = {}
+    while consumed + 1 < len(tokens) and tokens[consumed] in ("hours", "days") and tokens[consumed] not in window:
+        if tokens[consumed] == "hours":
+            window["hours"] = parse_range(tokens[consumed + 1], 0, 23)
+        else:
+            window["days"] = parse_range(tokens[consumed + 1], 1, 7)
+        consumed += 2
+
+    if tokens[0] == "every":
+        return IntervalSchedule(interval=interval, window=TimeWindow(**window)), consumed
+    return CronSchedule(fields=fields, window=TimeWindow(**window)), consumed
+
+
+def schedule_from_string(expression):
+    schedule, consumed = parse_schedule(expression.split())
+    if consumed != len(expression.split()):
+        raise ValueError("trailing garbage in schedule '{}'".format(expression))
+    return schedule
+
+
+class CommandTimer(object):
+
+    """
+    Min-heap of the next run time of every job. Removed or rescheduled jobs are left in the heap and skipped when
+    they surface, which keeps every operation O(log n).
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.clock = kwargs.get('clock', datetime.now)
+        self.heap = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __push(self, key, schedule, after):
+        entry = [schedule.next_run(after, key), next(self.counter), key, schedule]
+        self.jobs[key] = entry
+        heapq.heappush(self.heap, entry)
+
+    def __discard(self, key):
+        entry = self.jobs.pop(key, None)
+        if entry is not None:
+            entry[2] = None
+
+    def add(self, key, schedule):
+        with self.lock:
+            self.__discard(key)
+            self.__push(key, schedule, self.clock())
+
+    def remove(self, key):
+        with self.lock:
+            self.__discard(key)
+
+    def sync(self, schedules):
+        """
+        make the jobs match `schedules`, a dict of key to schedule. Jobs whose schedule didn't change keep their
+        next run time.
+        """
+        with self.lock:
+            now = self.clock()
+            for key in [k for k in self.jobs.keys() if k not in schedules]:
+                self.__discard(key)
+            for key, schedule in schedules.items():
+                entry = self.jobs.get(key, None)
+                if entry is None or str(entry[3]) != str(schedule):
+                    self.__discard(key)
+                    self.__push(key, schedule, now)
+
+    def next_run(self):
+        """
+        :return: when the first job is due or None if there are no jobs
+        """
+        with self.lock:
+            self.__prune()
+            return self.heap[0][0] if len(self.heap) > 0 else None
+
+    def next_run_of(self, key):
+        with self.lock:
+            entry = self.jobs.get(key, None)
+            return entry[0] if entry is not None else None
+
+    def pop_due(self):
+        """
+        :return: keys of the jobs that are due, in the order they were due. They are rescheduled to their next run.
+        """
+        due = []
+        with self.lock:
+            now = self.clock()
+            self.__prune()
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                when, _, key, schedule = heapq.heappop(self.heap)
+                due.append(key)
+                self.__push(key, schedule, max(now, when))
+                self.__prune()
+        return due
+
+    def __prune(self):
+        while len(self.heap) > 0 and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.jobs)
+
+
+def command_schedules(commands, schedules, default_interval):
+    """
+    :param commands: the scheduled commands
+    :param schedules: CommandSchedule rows of the commands that have a schedule of their own
+    :param default_interval: seconds between the runs of the other commands
+    :return: dict of command to schedule
+    """
+    own = dict([(s.command, s.schedule) for s in schedules])
+    default = IntervalSchedule(interval=default_interval)
+    return dict([(c, schedule_from_string(own[c]) if c in own else default) for c in commands])
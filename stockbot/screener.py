@@ -0,0 +1,180 @@
+import logging
+import operator
+import re
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import Float
+
+from stockbot.db import Session
+from stockbot.provider.google import StockDomain
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ScreenFilter(object):
+
+    operators = {
+        "<": operator.lt,
+        "<=": operator.le,
+        ">": operator.gt,
+        ">=": operator.ge,
+        "=": operator.eq,
+        "!=": operator.ne
+    }
+    regex = re.compile(r"^([a-z_]+)(<=|>=|!=|<|>|=)(-?\d+(?:\.\d+)?)$")
+
+    def __init__(self, *args, **kwargs):
+        self.field = kwargs.get('field')
+        self.op = kwargs.get('op')
+        self.value = float(kwargs.get('value'))
+
+    def mask(self, column):
+        return self.operators[self.op](column, self.value)
+
+    @classmethod
+    def parse(cls, expression):
+        match = cls.regex.match(expression)
+        if match is None:
+            raise ValueError("'{}' is not a filter like price_to_earnings<15".format(expression))
+        return cls(field=match.group(1), op=match.group(2), value=match.group(3))
+
+    def __str__(self):
+        return "{}{}{:g}".format(self.field, self.op, self.value)
+
+
+class Screen(object):
+
+    """
+    Filters that all have to match, the order to sort the matches in and how many of them to show
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.filters = kwargs.get('filters', [])
+        self.sort = kwargs.get('sort', None)
+        self.descending = kwargs.get('descending', False)
+        self.limit = int(kwargs.get('limit', 5))
+
+    def fields(self):
+        fields = [f.field for f in self.filters]
+        if self.sort is not None:
+            fields.append(self.sort)
+        return list(dict.fromkeys(fields))
+
+    @classmethod
+    def parse(cls, tokens, max_limit=20):
+        """
+        <filter> [<filter> ...] [sort <field> [desc]] [limit <n>]
+        """
+        tokens = list(tokens)
+        screen = cls()
+        while len(tokens) > 0:
+            token = tokens.pop(0)
+            if token == "sort":
+                if len(tokens) == 0:
+                    raise ValueError("sort needs a field")
+                screen.sort = tokens.pop(0)
+                if len(tokens) > 0 and tokens[0] in ("asc", "desc"):
+                    screen.descending = tokens.pop(0) == "desc"
+            elif token == "limit":
+                try:
+                    screen.limit = int(tokens.pop(0))
+                except (IndexError, ValueError):
+                    raise ValueError("limit needs a number")
+                if not 1 <= screen.limit <= max_limit:
+                    raise ValueError("limit must be between 1 and {}".format(max_limit))
+            else:
+                screen.filters.append(ScreenFilter.parse(token))
+        if len(screen.filters) == 0 and screen.sort is None:
+            raise ValueError("need at least one filter or a sort")
+        return screen
+
+
+class ScreenResult(object):
+
+    def __init__(self, *args, **kwargs):
+        self.screen = kwargs.get('screen')
+        self.rows = kwargs.get('rows')
+        self.matched = kwargs.get('matched')
+        self.total = kwargs.get('total')
+
+    def as_list(self):
+        fields = self.screen.fields()
+        header = "Matched {m} of {t} stocks".format(m=self.matched, t=self.total)
+        return [header] + ["{i}: Ticker: {t}, Name: {n}{v}".format(
+            i=index + 1, t=row["ticker"], n=row["name"],
+            v="".join([", {}: {:g}".format(f, row[f]) for f in fields])) for index, row in enumerate(self.rows)]
+
+
+class StockScreener(object):
+
+    """
+    Columnar snapshot of the stocks table in a numpy structured array. A screen is a handful of vectorized
+    comparisons over whole columns, so any combination of filters over every stock is answered without going to
+    the database. The snapshot is replaced as a whole when it's refreshed, screens that are running keep using
+    the one they started with.
+    """
+
+    fields = [c.name for c in StockDomain.__table__.columns if isinstance(c.type, Float)]
+    dtype = np.dtype([("ticker", object), ("name", object)] + [(f, np.float64) for f in fields])
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.refreshed = None
+
+    def refresh(self):
+        """
+        reload the snapshot from the stocks table, missing values become NaN which never match a filter
+        :return: number of stocks in the snapshot
+        """
+        session = Session()
+        try:
+            columns = [StockDomain.ticker, StockDomain.name] + [getattr(StockDomain, f) for f in self.fields]
+            rows = [tuple(r[:2]) + tuple([np.nan if v is None else v for v in r[2:]])
+                    for r in session.query(*columns)]
+        finally:
+            session.close()
+        snapshot = np.array(rows, dtype=self.dtype)
+        with self.lock:
+            self.snapshot = snapshot
+            self.refreshed = time.time()
+        LOGGER.info("Loaded {} stocks into the screener".format(len(snapshot)))
+        return len(snapshot)
+
+    def __get_snapshot(self):
+        with self.lock:
+            snapshot = self.snapshot
+        if snapshot is None:
+            self.refresh()
+            with self.lock:
+                snapshot = self.snapshot
+        return snapshot
+
+    def screen(self, screen):
+        """
+        :type screen: Screen
+        :rtype: ScreenResult
+        """
+        for field in screen.fields():
+            if field not in self.fields:
+                raise ValueError("'{}' is not a valid field".format(field))
+        snapshot = self.__get_snapshot()
+        started = time.perf_counter()
+        mask = np.ones(len(snapshot), dtype=bool)
+        for f in screen.filters:
+            mask &= f.mask(snapshot[f.field])
+        matches = snapshot[mask]
+        if screen.sort is not None:
+            values = matches[screen.sort]
+            # NaN sorts last either way
+            order = np.argsort(-values if screen.descending else values, kind="stable")
+            matches = matches[order]
+        rows = matches[:screen.limit]
+        LOGGER.debug("Screened {} stocks in {:.0f}us".format(len(snapshot), (time.perf_counter() - started) * 1e6))
+        return ScreenResult(screen=screen, rows=rows, matched=len(matches), total=len(snapshot))
+
+    def __len__(self):
+        snapshot = self.snapshot
+        return len(snapshot) if snapshot is not None else 0
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import threading
+import weakref
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from stockbot.configuration import configuration
+
+LOGGER = logging.getLogger(__name__)
+
+
+class HttpRequest(object):
+
+    """
+    Request yielded by a provider flow. A flow is a generator that yields the requests it needs, gets their
+    responses sent back and returns its result, so the same flow runs on the blocking and the async transport.
+    """
+
+    def __init__(self, method, url, **kwargs):
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+
+    @classmethod
+    def get(cls, url, **kwargs):
+        return cls("GET", url, **kwargs)
+
+    @classmethod
+    def post(cls, url, **kwargs):
+        return cls("POST", url, **kwargs)
+
+
+class HttpTransport(object):
+
+    """
+    Shared HTTP transport, keeps a pool of keep-alive connections per host so that
+    consecutive requests against the same provider don't pay for a new TCP+TLS handshake
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.connect_timeout = float(kwargs.get('connect_timeout', configuration.http_connect_timeout))
+        self.read_timeout = float(kwargs.get('read_timeout', configuration.http_read_timeout))
+        self.pool_connections = int(kwargs.get('pool_connections', configuration.http_pool_connections))
+        self.pool_maxsize = int(kwargs.get('pool_maxsize', configuration.http_pool_maxsize))
+        self.headers = dict(kwargs.get('headers', {}))
+        self.session = self.__create_session()
+
+    def __create_session(self):
+        session = requests.Session()
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def timeout(self):
+        return self.connect_timeout, self.read_timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        LOGGER.debug("{method} {url}".format(method=method, url=url))
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def drive(self, flow):
+        """
+        run a flow to completion, a failed request is raised inside the flow where it yielded the request
+        :return: what the flow returns
+        """
+        try:
+            request = next(flow)
+            while True:
+                try:
+                    response = self.request(request.method, request.url, **request.kwargs)
+                except Exception as e:
+                    request = flow.throw(e)
+                else:
+                    request = flow.send(response)
+        except StopIteration as e:
+            return e.value
+
+    def close(self):
+        self.session.close()
+
+
+class HttpResponse(object):
+
+    """
+    Fully read response from the async transport, quacks like the parts of requests.Response that
+    the providers rely on so that parsing can be shared between the blocking and async code paths
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.url = kwargs.get('url')
+        self.status_code = kwargs.get('status_code')
+        self.reason = kwargs.get('reason', None)
+        self.headers = kwargs.get('headers', {})
+        self.content = kwargs.get('content', b"")
+        self.encoding = kwargs.get('encoding', None) or "utf-8"
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError("{code} {reason} for url: {url}".format(
+                code=self.status_code, reason=self.reason, url=self.url), response=self)
+
+
+class AsyncHttpTransport(object):
+
+    """
+    Non-blocking counterpart of HttpTransport, one aiohttp session with keep-alive pools per event loop
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.connect_timeout = float(kwargs.get('connect_timeout', configuration.http_connect_timeout))
+        self.read_timeout = float(kwargs.get('read_timeout', configuration.http_read_timeout))
+        self.pool_maxsize = int(kwargs.get('pool_maxsize', configuration.http_pool_maxsize))
+        self.headers = dict(kwargs.get('headers', {}))
+        self.sessions = weakref.WeakKeyDictionary()
+
+    def __session(self):
+        loop = asyncio.get_event_loop()
+        session = self.sessions.get(loop, None)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.pool_maxsize),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+                headers=self.headers)
+            self.sessions[loop] = session
+        return session
+
+    async def request(self, method, url, **kwargs):
+        LOGGER.debug("{method} {url}".format(method=method, url=url))
+        async with self.__session().request(method, url, **kwargs) as response:
+            content = await response.read()
+            return HttpResponse(url=str(response.url), status_code=response.status, reason=response.reason,
+                                headers=response.headers, content=content, encoding=response.charset)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def drive(self, flow):
+        """
+        same as HttpTransport.drive but the requests don't block the event loop
+        """
+        try:
+            request = next(flow)
+            while True:
+                try:
+                    response = await self.request(request.method, request.url, **request.kwargs)
+                except Exception as e:
+                    request = flow.throw(e)
+                else:
+                    request = flow.send(response)
+        except StopIteration as e:
+            return e.value
+
+    async def close(self):
+        session = self.sessions.pop(asyncio.get_event_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def run(self, coro):
+        """
+        drive a coroutine to completion from blocking code, the session bound to the temporary event loop
+        is closed before returning
+        :param coro:
+        :return:
+        """
+        async def runner():
+            try:
+                return await coro
+            finally:
+                await self.close()
+        return asyncio.run(runner())
+
+
+_default_transport = None
+_default_async_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport():
+    """
+    transport used by everything that isn't handed one explicitly, e.g. a provider that was
+    instantiated outside of a QuoteServiceFactory
+    :return:
+    :rtype: HttpTransport
+    """
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HttpTransport()
+        return _default_transport
+
+
+def get_default_async_transport():
+    """
+    :return:
+    :rtype: AsyncHttpTransport
+    """
+    global _default_async_transport
+    with _default_transport_lock:
+        if _default_async_transport is None:
+            _default_async_transport = AsyncHttpTransport()
+        return _default_async_transport
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of command dispatch and help against the real root_command tree
+
+    $ cd tests && python benchmark_command.py [rounds]
+"""
+import sys
+import timeit
+
+from stockbot.command import root_command
+
+
+def leaf_paths(command, prefix=()):
+    if len(command.subcommands) == 0:
+        yield prefix
+    for subcommand in command.subcommands:
+        for name in (subcommand.name, subcommand.short_name):
+            if name is not None:
+                yield from leaf_paths(subcommand, prefix + (name,))
+
+
+def resolve_scan(path):
+    # how dispatch used to find each child, a list comprehension over the subcommands on every level
+    command = root_command
+    for e in path:
+        c = [x for x in command.subcommands if x.name == e or x.short_name == e]
+        command = c[0]
+    return command
+
+
+def resolve_indexed(path):
+    command = root_command
+    for e in path:
+        command = command.lookup(e)
+    return command
+
+
+def cold_help():
+    root_command.invalidate_help()
+    return root_command.show_help()
+
+
+def main(rounds):
+    paths = list(leaf_paths(root_command))
+    number = 1000
+
+    def per_call(func, *args):
+        return min(timeit.repeat(lambda: func(*args), number=number, repeat=rounds)) / number * 1e6
+
+    scan = sum(per_call(resolve_scan, p) for p in paths) / len(paths)
+    indexed = sum(per_call(resolve_indexed, p) for p in paths) / len(paths)
+    print("dispatch over {} command paths".format(len(paths)))
+    print("  subcommand scan  {:8.2f} us/command".format(scan))
+    print("  indexed lookup   {:8.2f} us/command ({:.1f}x)".format(indexed, scan / indexed))
+
+    cold = per_call(cold_help)
+    root_command.show_help()
+    warm = per_call(root_command.show_help)
+    print("help with {} entries".format(len(root_command.show_help())))
+    print("  rebuilt          {:8.2f} us/call".format(cold))
+    print("  memoized         {:8.2f} us/call ({:.1f}x)".format(warm, cold / warm))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,79 @@
+"""
+Compares the per-page parse time of the lxml and soupparser html parsers over the recorded cassette pages
+
+    $ cd tests && python benchmark_parser.py [rounds]
+"""
+import gzip
+import os
+import sys
+import timeit
+
+from vcr.serializers import yamlserializer
+
+from stockbot.provider.parser import HtmlParser
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+CASSETTES = os.path.join(CWD, "mock", "vcr_cassettes")
+
+# the nodes each scraper is looking for, a page only counts as parsed if these are found
+ANCHORS = {
+    "https://www.avanza.se/ab/sok/": "//ul[contains(@class,'globalSrchRes')]",
+    "https://www.avanza.se/": "//div[@id='surface']",
+    "https://www.ig.com/": "//div[@class='ma-box']",
+    "http://www.nasdaqomxnordic.com/": "//article[@class='nordic-our-listed-companies']//tbody"
+}
+
+
+def anchor_for(uri):
+    for prefix in sorted(ANCHORS, key=len, reverse=True):
+        if uri.startswith(prefix):
+            return ANCHORS[prefix]
+    return None
+
+
+def header(headers, name):
+    for k, v in headers.items():
+        if k.lower() == name.lower():
+            return " ".join(v)
+    return ""
+
+
+def html_pages():
+    for root, _, files in os.walk(CASSETTES):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            with open(path, "r") as f:
+                cassette = yamlserializer.deserialize(f.read())
+            for interaction in cassette["interactions"]:
+                uri = interaction["request"]["uri"]
+                response = interaction["response"]
+                anchor = anchor_for(uri)
+                if anchor is None or "text/html" not in header(response["headers"], "Content-Type"):
+                    continue
+                body = response["body"]["string"]
+                if "gzip" in header(response["headers"], "Content-Encoding"):
+                    body = gzip.decompress(body)
+                if isinstance(body, bytes):
+                    body = body.decode("utf-8", errors="replace")
+                yield os.path.relpath(path, CASSETTES), uri, anchor, body
+
+
+def main(rounds):
+    parsers = {name: HtmlParser(parser=name, fallback=None) for name in HtmlParser.parsers}
+    totals = {name: 0.0 for name in parsers}
+    print("{:<32} {:>8} {:>10} {:>10} {:>8}  {}".format("cassette", "kB", "lxml ms", "soup ms", "speedup", "anchor"))
+    for cassette, uri, anchor, body in html_pages():
+        timings = {}
+        for name, parser in parsers.items():
+            timings[name] = min(timeit.repeat(lambda: parser.fromstring(body), number=1, repeat=rounds)) * 1000
+            totals[name] += timings[name]
+        found = len(parsers["lxml"].fromstring(body).xpath(anchor)) > 0
+        print("{:<32} {:>8.1f} {:>10.2f} {:>10.2f} {:>7.1f}x  {}".format(
+            cassette, len(body) / 1024, timings["lxml"], timings["soup"], timings["soup"] / timings["lxml"],
+            "found" if found else "missing, falls back to soup"))
+    print("{:<32} {:>8} {:>10.2f} {:>10.2f} {:>7.1f}x".format(
+        "total", "", totals["lxml"], totals["soup"], totals["soup"] / totals["lxml"]))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,12 @@
+class FakeClock(object):
+
+    """
+    Clock that only moves when a test moves it, `now` can be a number or a datetime depending on what the code
+    under test expects
+    """
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
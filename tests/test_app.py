@@ -1,32 +1,148 @@
+import threading
 import unittest
-import datetime
+from datetime import datetime, timedelta
 
-from app import ScheduleHandler
+from app import IRCBot
+from stockbot.concurrency import TaskPool
+from stockbot.schedule import CommandTimer, IntervalSchedule
+from tests.fakes import FakeClock
 
 
-class TestScheduleHandler(unittest.TestCase):
+class FakeScheduler(object):
 
-    def test_timer(self):
+    def __init__(self):
+        self.wake_ups = []
 
-        class PartialIrcBot(ScheduleHandler):
-            pass
+    def execute_after(self, delay, func):
+        self.wake_ups.append((delay, func))
 
-        t = PartialIrcBot()
-        df = "%d/%m/%Y %H:%M:%S"
 
-        for d in [9, 10, 11, 12, 13]:
-            d_str = "{}/10/2017".format(d)
-            for h in range(24):
-                h_str = "{}:00:00".format(str(h).zfill(2))
-                dt = datetime.datetime.strptime("{d} {h}".format(d=d_str, h=h_str), df)
-                if h < 9 or h >= 18:
-                    self.assertFalse(t.timer_should_execute(dt))
-                else:
-                    self.assertTrue(t.timer_should_execute(dt))
+class FakeReactor(object):
 
-        for d in [14, 15]:
-            d_str = "{}/10/2017".format(d)
-            for h in range(24):
-                h_str = "{}:00:00".format(str(h).zfill(2))
-                dt = datetime.datetime.strptime("{d} {h}".format(d=d_str, h=h_str), df)
-                self.assertFalse(t.timer_should_execute(dt))
+    def __init__(self):
+        self.mutex = threading.RLock()
+        self.scheduler = FakeScheduler()
+
+
+class FakeConnection(object):
+
+    def __init__(self, connected=True):
+        self.connected = connected
+
+    def is_connected(self):
+        return self.connected
+
+
+class TestCommandTimerWiring(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(datetime(2017, 10, 9, 12, 0, 0))
+        # only the parts of the bot the timer is wired through, no connection to a server
+        self.bot = IRCBot.__new__(IRCBot)
+        self.bot.reactor = FakeReactor()
+        self.bot.connection = FakeConnection()
+        self.bot.schedule_pool = TaskPool(name="test-schedule", max_workers=2, max_pending=4)
+        self.bot.schedule_summary = None
+        self.executed = []
+        self.bot.execute_scheduled_command = self.executed.append
+        self.bot.command_timer = CommandTimer(clock=self.clock)
+        self.bot.scheduler = True
+        self.bot.timer_armed = None
+        self.bot.timer_generation = 0
+
+    def tearDown(self):
+        self.bot.schedule_pool.shutdown()
+
+    def wake_ups(self):
+        # the timer's own, the deadlines of the scheduled runs are armed on the same scheduler
+        return [w for w in self.bot.reactor.scheduler.wake_ups
+                if getattr(w[1], "func", None) == self.bot.run_due_commands]
+
+    def deadlines(self):
+        return [w for w in self.bot.reactor.scheduler.wake_ups if w not in self.wake_ups()]
+
+    def fire(self, index):
+        self.clock.now = self.bot.command_timer.clock() + timedelta(seconds=self.wake_ups()[index][0])
+        self.wake_ups()[index][1]()
+        self.bot.schedule_pool.join(5)
+
+    def test_wake_up_is_armed_for_the_first_job(self):
+        self.bot.command_timer.add("quote get foo", IntervalSchedule(interval=3600))
+        self.bot.arm_timer()
+        next_run = self.bot.command_timer.next_run()
+        self.assertEquals(1, len(self.wake_ups()))
+        self.assertEquals((next_run - self.clock.now).total_seconds(), self.wake_ups()[0][0])
+        self.assertEquals(next_run, self.bot.timer_armed)
+
+        # nothing changed, the wake up that is armed already covers it
+        self.bot.arm_timer()
+        self.assertEquals(1, len(self.wake_ups()))
+
+    def test_earlier_schedule_supersedes_armed_wake_up(self):
+        self.bot.command_timer.add("quote get foo", IntervalSchedule(interval=86400))
+        self.bot.arm_timer()
+        later = self.bot.timer_armed
+
+        self.bot.command_timer.add("quote get bar", IntervalSchedule(interval=60))
+        self.bot.arm_timer()
+        self.assertEquals(2, len(self.wake_ups()))
+        self.assertTrue(self.bot.timer_armed < later)
+        self.assertTrue(self.wake_ups()[1][0] < self.wake_ups()[0][0])
+        self.assertEquals(2, self.bot.timer_generation)
+
+    def test_stale_generation_is_ignored(self):
+        self.bot.command_timer.add("quote get foo", IntervalSchedule(interval=86400))
+        self.bot.arm_timer()
+        self.bot.command_timer.add("quote get bar", IntervalSchedule(interval=60))
+        self.bot.arm_timer()
+        armed = self.bot.timer_armed
+
+        # the superseded wake up fires after everything is due and does nothing at all
+        self.fire(0)
+        self.assertEquals([], self.executed)
+        self.assertEquals(armed, self.bot.timer_armed)
+        self.assertEquals(2, len(self.wake_ups()))
+
+    def test_due_jobs_are_handed_to_the_executor_once(self):
+        self.bot.command_timer.add("quote get foo", IntervalSchedule(interval=60))
+        self.bot.arm_timer()
+        self.fire(0)
+        self.assertEquals(["quote get foo"], self.executed)
+        # the timer is re-armed for the next run
+        self.assertEquals(2, len(self.wake_ups()))
+        self.assertEquals(self.bot.command_timer.next_run(), self.bot.timer_armed)
+
+        # the same wake up firing twice doesn't run anything again
+        self.wake_ups()[0][1]()
+        self.assertEquals(1, len(self.executed))
+
+        self.fire(1)
+        self.assertEquals(["quote get foo", "quote get foo"], self.executed)
+
+    def test_due_jobs_are_skipped_when_they_cannot_run(self):
+        self.bot.command_timer.add("quote get foo", IntervalSchedule(interval=60))
+        self.bot.scheduler = False
+        self.bot.arm_timer()
+        self.fire(0)
+        self.bot.scheduler = True
+        self.bot.connection.connected = False
+        self.fire(1)
+        self.assertEquals([], self.executed)
+        # skipped runs are not made up for, the timer just moves on to the next one
+        self.assertEquals(3, len(self.wake_ups()))
+
+    def test_scheduled_run_does_not_hold_a_command_worker(self):
+        self.bot.command_executor = None
+        self.bot.command_timer.add("quote get foo", IntervalSchedule(interval=60))
+        self.bot.command_timer.add("quote get bar", IntervalSchedule(interval=60))
+        self.bot.arm_timer()
+        self.clock.now += timedelta(seconds=60)
+        self.wake_ups()[-1][1]()
+        self.bot.schedule_pool.join(5)
+        self.assertEquals(["quote get bar", "quote get foo"], sorted(self.executed))
+        # the deadline is armed on the reactor, by then both are done and the run is summarized only once
+        self.assertEquals(1, len(self.deadlines()))
+        summary = self.deadlines()[0][1]()
+        self.assertEquals(2, len(summary.finished))
+        self.assertIs(summary, self.bot.schedule_summary)
+        self.assertIs(summary, self.deadlines()[0][1]())
@@ -0,0 +1,76 @@
+import threading
+import unittest
+
+from stockbot.cache import TTLCache
+from tests.fakes import FakeClock
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(name="test", max_entries=3, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get("foo"))
+        self.assertEquals("default", self.cache.get("foo", "default"))
+
+        self.cache.set("foo", "bar")
+        self.assertEquals("bar", self.cache.get("foo"))
+        self.assertIn("foo", self.cache)
+        self.assertEquals(1, len(self.cache))
+
+        self.cache.delete("foo")
+        self.assertNotIn("foo", self.cache)
+
+    def test_expiry(self):
+        self.cache.set("foo", "bar")
+        self.cache.set("short", "lived", ttl=1)
+
+        self.clock.now = 5
+        self.assertEquals("bar", self.cache.get("foo"))
+        self.assertIsNone(self.cache.get("short"))
+
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get("foo"))
+        self.assertEquals(0, len(self.cache))
+
+    def test_least_recently_used_is_evicted(self):
+        for k in ["a", "b", "c"]:
+            self.cache.set(k, k)
+
+        # touch a so that b is the least recently used one
+        self.cache.get("a")
+        self.cache.set("d", "d")
+
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+        self.assertIn("c", self.cache)
+        self.assertIn("d", self.cache)
+        self.assertEquals(1, self.cache.stats()["evictions"])
+
+    def test_stats(self):
+        self.cache.set("foo", "bar")
+        self.cache.get("foo")
+        self.cache.get("foo")
+        self.cache.get("baz")
+        self.assertEquals({"name": "test", "entries": 1, "hits": 2, "misses": 1, "evictions": 0},
+                          self.cache.stats())
+        self.assertEquals("Cache: test, Entries: 1, Hits: 2, Misses: 1, Evictions: 0", str(self.cache))
+
+    def test_concurrent_access_stays_bounded(self):
+        cache = TTLCache(max_entries=50, ttl=60)
+
+        def worker(offset):
+            for i in range(1000):
+                cache.set(offset + i, i)
+                cache.get(offset + i - 1)
+
+        threads = [threading.Thread(target=worker, args=(n * 1000,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEquals(50, len(cache))
+        self.assertEquals(8000, cache.hits + cache.misses)
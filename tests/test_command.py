@@ -1,14 +1,22 @@
+import os
+import shutil
+import tempfile
 import threading
 import unittest
 import vcr
 
 from unittest.mock import patch
 
-from stockbot.command import root_command
+from stockbot.command import root_command, task_pool, BlockingExecuteCommand, Command, NonBlockingExecuteCommand
+from stockbot.concurrency import TaskPool, fan_out
 from stockbot.db import Session, create_tables, drop_tables
-from stockbot.persistence import DatabaseCollection, ScheduledCommand
-from stockbot.provider import QuoteServiceFactory, NasdaqCompany
+from stockbot.command.fundamental import screener
+from stockbot.history import TickHistory
+from stockbot.output import OutputQueue
+from stockbot.persistence import CommandSchedule, DatabaseCollection, ScheduledCommand
+from stockbot.provider import QuoteServiceFactory, NasdaqCompany, BaseQuoteService
 from stockbot.provider.google import GoogleFinanceSearchResult, GoogleFinanceQueryService, StockDomain
+from stockbot.schedule import CommandTimer, command_schedules
 
 
 class FakeQuoteService(object):
@@ -29,10 +37,15 @@ class FakeQuoteService(object):
 class FakeIrcBot(object):
 
     commands = DatabaseCollection(type=ScheduledCommand, attribute="command")
+    schedules = DatabaseCollection(type=CommandSchedule)
+    command_timer = CommandTimer()
     scheduler_interval = 3600
     scheduler = False
     callback_args = None
 
+    def reschedule(self):
+        self.command_timer.sync(command_schedules(self.commands, self.schedules, self.scheduler_interval))
+
     def callback(self, *args):
         self.callback_args = args
 
@@ -132,6 +145,37 @@ class TestCommand(unittest.TestCase):
         res = root_command.execute(*command, command_args={"service_factory": factory, "instance": self.ircbot})
         self.assertEquals("Ticker: AWESOMO", str(res))
 
+    def test_quote_batch_command(self):
+
+        class FakeAsyncQuoteService(BaseQuoteService):
+
+            async def aget_quote(self, ticker):
+                if ticker == "broken":
+                    raise RuntimeError("provider is down")
+                return "Here's your fake quote for {}".format(ticker)
+
+        factory = QuoteServiceFactory()
+        factory.providers = {"fakeprovider": FakeAsyncQuoteService}
+
+        command = ["quote", "hint", "add", "fakeprovider", "AWESOMO", "awesome"]
+        root_command.execute(*command, command_args={"service_factory": factory, "instance": self.ircbot})
+
+        command = ["quote", "batch", "fakeprovider", "aapl", "broken", "awesome", "msft"]
+        res = root_command.execute(*command, command_args={"service_factory": factory, "instance": self.ircbot})
+        self.assertEquals(["Here's your fake quote for aapl",
+                           "Ticker: broken, Error: provider is down",
+                           "Here's your fake quote for AWESOMO",
+                           "Here's your fake quote for msft"], res)
+
+        # providers without the async api are fetched one by one
+        command = ["quote", "batch", "fakeprovider", "aapl", "msft"]
+        res = self.__cmd_wrap(*command)
+        self.assertEquals(["Here's your fake quote for aapl", "Here's your fake quote for msft"], res)
+
+        command = ["quote", "batch", "invalid-provider", "aapl"]
+        res = self.__cmd_wrap(*command)
+        self.assertEquals("No such provider 'invalid-provider'", res)
+
     def test_quote_get_command_invalid_input(self):
 
         command = ["quote", "get", "invalid-provider", "aapl"]
@@ -163,6 +207,90 @@ class TestCommand(unittest.TestCase):
         self.assertIn("quote (q) get <provider> <ticker>", res)
         self.assertIn("quote (q) search <provider> <ticker>", res)
 
+    def test_stats_output_command(self):
+
+        command = ["stats", "output"]
+        res = self.__cmd_wrap(*command)
+        self.assertEquals("No output queue", res)
+
+        self.ircbot.output_queue = OutputQueue(send=lambda *args: None, rate=1, burst=1)
+        self.ircbot.output_queue.put("#channel", "foo")
+        res = self.__cmd_wrap(*command)
+        self.assertEquals("Queue depth: 1, Targets: 1, Sent: 0, Failed: 0, Send lag (last/avg/max): "
+                          "0.00s/0.00s/0.00s", res)
+
+    def test_stats_schedule_command(self):
+
+        command = ["stats", "schedule"]
+        self.assertEquals("No scheduled run yet", self.__cmd_wrap(*command))
+
+        self.ircbot.schedule_pool = TaskPool(name="schedule", max_workers=1, max_pending=0)
+        self.ircbot.schedule_summary = fan_out(self.ircbot.schedule_pool, [("foo", lambda: None, ())], 5)
+        res = self.__cmd_wrap(*command)
+        self.assertRegex(res, "^Last run: Finished: 1, Failed: 0, Timed out: 0, Rejected: 0, Took: ")
+        self.assertTrue(res.endswith("Pool: Executor: schedule, Workers: 1, In flight: 0, Submitted: 1, Rejected: 0, "
+                                     "Failed: 0, Running: -"))
+        self.ircbot.schedule_pool.shutdown()
+
+    def test_quote_history_command(self):
+        path = tempfile.mkdtemp()
+        try:
+            history = TickHistory(path=path, clock=lambda: 7200.0)
+            # a tick a minute for the last two hours
+            for i in range(120):
+                history.record("fakeprovider:AAPL", 60.0 * i, 100.0 + (i % 60), 0.0)
+            factory = QuoteServiceFactory(history=history)
+
+            def cmd(*args):
+                return root_command.execute(*args, command_args={"service_factory": factory})
+
+            res = cmd("quote", "history", "aapl", "2h", "30m")
+            self.assertEquals(u"Name: fakeprovider:AAPL, Period: 2h/30m, History: ▁█▁█, First: 100.0, Last: 159.0, "
+                              u"Min: 100.0, Max: 159.0, %Change: 59.0, Bars: 4, Ticks: 120", str(res))
+            self.assertEquals("Bars: 2", str(cmd("quote", "history", "fakeprovider:aapl", "1h", "30m")).split(", ")[-2])
+            self.assertEquals("No history of msft in the last 1d", cmd("quote", "history", "msft", "1d", "1h"))
+            self.assertEquals("1d of 1m bars is more than the 80 that fit on a line",
+                              cmd("quote", "history", "aapl", "1d", "1m"))
+            self.assertRegex(cmd("quote", "history", "aapl", "1d", "soon"), "^invalid duration 'soon'")
+            self.assertEquals("Quote history is disabled", self.__cmd_wrap("quote", "history", "aapl", "1d", "1h"))
+
+            # instruments that are stored under a url are still shown by the ticker that was asked for
+            class UrlService(object):
+                def get_quote(self, ticker):
+                    return None
+
+                def resolve(self, ticker):
+                    return "https://www.avanza.se/aktier/om-aktien.html/5247/investor-b"
+
+            factory.providers = dict(factory.providers, urlprovider=UrlService)
+            history.record("urlprovider:https://www.avanza.se/aktier/om-aktien.html/5247/investor-b", 7000.0,
+                           300.0, 0.0)
+            res = cmd("quote", "history", "investor  b", "1h", "30m")
+            self.assertEquals("Name: urlprovider:INVESTOR B", str(res).split(", ")[0])
+            res = cmd("quote", "history", "urlprovider:investor b", "1h", "30m")
+            self.assertEquals("Name: urlprovider:INVESTOR B", str(res).split(", ")[0])
+        finally:
+            shutil.rmtree(path)
+
+    def test_stats_history_command(self):
+        self.assertEquals("Quote history is disabled", self.__cmd_wrap("stats", "history"))
+
+    def test_command_index_and_help_table(self):
+
+        root = Command(name="root")
+        parent = Command(name="parent", short_name="p")
+        parent.register(BlockingExecuteCommand(name="child", execute_command=lambda *args, **kwargs: "first"))
+        parent.register(BlockingExecuteCommand(name="child", execute_command=lambda *args, **kwargs: "second"))
+        root.register(parent)
+
+        self.assertEquals("first", root.execute("p", "child", command_args={}))
+        self.assertIsNone(root.execute("parent", "nope", command_args={}))
+        self.assertEquals(["parent (p) child", "parent (p) child"], root.show_help())
+
+        # registering anywhere in the tree invalidates the help of every ancestor
+        parent.register(BlockingExecuteCommand(name="another", help="<arg>"))
+        self.assertEquals(["parent (p) another <arg>", "parent (p) child", "parent (p) child"], root.show_help())
+
     def test_execute_scheduler_ticker_commands(self):
 
         # blank state
@@ -200,6 +328,47 @@ class TestCommand(unittest.TestCase):
         res = self.__cmd_wrap(*command)
         self.assertEquals("Command not in list", res)
 
+        # reload from the database
+        command = ["scheduler", "command", "reload"]
+        res = self.__cmd_wrap(*command)
+        self.assertEquals("Reloaded 0 commands", res)
+
+    def test_execute_scheduler_schedule_commands(self):
+
+        self.assertEquals("No commands added", self.__cmd_wrap("scheduler", "schedule", "get"))
+        self.__cmd_wrap("scheduler", "command", "add", "quote", "get", "google", "foobar")
+        self.__cmd_wrap("scheduler", "command", "add", "quote", "get", "google", "barfoo")
+
+        res = self.__cmd_wrap("scheduler", "schedule", "set", "every", "15m", "hours", "9-17", "days", "1-5",
+                              "quote", "get", "google", "foobar")
+        self.assertRegex(res, "^Command: quote get google foobar, Schedule: every 15m hours 9-17 days 1-5, Next run: ")
+
+        res = self.__cmd_wrap("scheduler", "schedule", "get")
+        self.assertRegex(res[0], "Schedule: every 15m hours 9-17 days 1-5, Next run: \\d{4}")
+        self.assertRegex(res[1], "^Command: quote get google barfoo, Schedule: default, Next run: \\d{4}")
+        self.assertEquals("every 15m hours 9-17 days 1-5",
+                          str(command_schedules(self.ircbot.commands, self.ircbot.schedules, 3600)[
+                              "quote get google foobar"]))
+
+        res = self.__cmd_wrap("scheduler", "schedule", "set", "cron", "0", "25", "*", "*", "*", "quote", "get",
+                              "google", "foobar")
+        self.assertEquals("Invalid schedule: '25' is out of range 0-23", res)
+        res = self.__cmd_wrap("scheduler", "schedule", "set", "every", "1h", "quote", "get", "google", "nope")
+        self.assertEquals("Command not in list", res)
+
+        res = self.__cmd_wrap("scheduler", "schedule", "clear", "quote", "get", "google", "foobar")
+        self.assertEquals("Cleared schedule of: quote get google foobar", res)
+        res = self.__cmd_wrap("scheduler", "schedule", "clear", "quote", "get", "google", "foobar")
+        self.assertEquals("Command has no schedule", res)
+
+        # removing a command removes its schedule as well
+        self.__cmd_wrap("scheduler", "schedule", "set", "cron", "*/5", "*", "*", "*", "*", "quote", "get", "google",
+                        "barfoo")
+        self.__cmd_wrap("scheduler", "command", "remove", "quote", "get", "google", "barfoo")
+        self.__cmd_wrap("scheduler", "command", "remove", "quote", "get", "google", "foobar")
+        self.assertEquals(0, len(self.ircbot.schedules))
+        self.assertEquals(0, len(self.ircbot.command_timer))
+
     def test_execute_scheduler_interval_command(self):
 
         # default state
@@ -240,17 +409,25 @@ class TestCommand(unittest.TestCase):
         res = self.__cmd_wrap(*command)
         self.assertEquals(None, res)
 
-    @vcr.use_cassette('mock/vcr_cassettes/nasdaq/scraper.yaml')
+    # the cassette isn't safe to play back from several threads at once
+    @patch.dict(os.environ, {"NASDAQ_WORKERS": "1"})
+    @vcr.use_cassette('mock/vcr_cassettes/nasdaq/scraper.yaml', allow_playback_repeats=True)
     def test_execute_scrape_nasdaq(self):
 
         command = ["scrape", "nasdaq"]
         res = self.__cmd_wrap(*command)
-        self.assertEquals("Scraped 657 companies from Nasdaq", res)
+        self.assertEquals("Synced 657 companies from Nasdaq - Added: 657, Updated: 0, Removed: 0", res)
+
+        # nothing changed since the last sync
+        res = self.__cmd_wrap(*command)
+        self.assertEquals("Synced 657 companies from Nasdaq - Added: 0, Updated: 0, Removed: 0", res)
 
         command = ["scrape", "stats"]
         res = self.__cmd_wrap(*command)
         self.assertEquals("Scraped: nordic large cap=201, nordic mid cap=219, nordic small cap=237", res)
 
+    # the cassette isn't safe to play back from several threads at once
+    @patch.dict(os.environ, {"SCRAPE_WORKERS": "1", "SCRAPE_RATE": "100"})
     @patch('time.sleep')
     @vcr.use_cassette('mock/vcr_cassettes/google/quote/scrape_large_cap.yaml')
     def test_execute_nonblocking_scrape_stocks(self, sleep_mock):
@@ -271,17 +448,37 @@ class TestCommand(unittest.TestCase):
 
         self.assertEquals("Task started", self.ircbot.callback_args[0])
 
-        for t in threading.enumerate():
-            if t.name == "thread-sek_nordic_large_cap":
-                t.join()
+        task_pool.join(timeout=30)
 
         self.assertEquals("Done scraping segment 'nordic large cap' currency 'SEK' - scraped 2 companies",
                           self.ircbot.callback_args[0])
 
+        res = self.__cmd_wrap("scrape", "progress")
+        self.assertRegex(res[0], "^Segment: nordic large cap, Currency: SEK, State: done, Queued: 2, Fetched: 2, "
+                                 "Parsed: 2, Staged: 2, Written: 2, Failed: 0, Took: ")
+
         for c in companies:
             row = self.session.query(StockDomain).filter(StockDomain.ticker == c.ticker).first()
             self.assertNotEquals(None, row)
 
+    def test_execute_nonblocking_exclusive(self):
+
+        release = threading.Event()
+        pool = TaskPool(name="test", max_workers=1, max_pending=0)
+        command = NonBlockingExecuteCommand(name="slow", task_pool=pool,
+                                            execute_command=lambda *args, **kwargs: release.wait(5) and "done")
+
+        self.assertEquals("Task started", command.execute("foo", command_args={}))
+        self.assertEquals("Task is currently running, hold your horses", command.execute("foo", command_args={}))
+        self.assertEquals("Too many tasks running, try again later", command.execute("bar", command_args={}))
+
+        release.set()
+        pool.join(5)
+        command.execute("foo", command_args={}, callback=self.ircbot.callback)
+        pool.join(5)
+        self.assertEquals("done", self.ircbot.callback_args[0])
+        pool.shutdown()
+
     def test_execute_analytics_fields(self):
 
         command = ["fundamental", "fields"]
@@ -303,6 +500,19 @@ class TestCommand(unittest.TestCase):
         res = self.__cmd_wrap(*command)
         self.assertEquals(["Error: 'this_field_doesnt_exist' is not a valid field"], res)
 
+    def test_execute_analytics_screen(self):
+        session = Session()
+        session.add_all([StockDomain(ticker="AAA", name="Cheap", price_to_earnings=8.0, dividend_yield=5.0),
+                         StockDomain(ticker="BBB", name="Pricey", price_to_earnings=40.0, dividend_yield=0.5)])
+        session.commit()
+        session.close()
+        screener.refresh()
+
+        res = self.__cmd_wrap("fundamental", "screen", "price_to_earnings<15", "sort", "dividend_yield", "desc")
+        self.assertEquals("Matched 1 of 2 stocks", res[0])
+        self.assertEquals(["1: Ticker: AAA, Name: Cheap, price_to_earnings: 8, dividend_yield: 5"], res[1:])
+        self.assertEquals(["Error: 'foo' is not a valid field"], self.__cmd_wrap("fundamental", "screen", "foo>1"))
+
     def test_quote_hints(self):
         command = ["quote", "hint", "list", "yahoo"]
         res = self.__cmd_wrap(*command)
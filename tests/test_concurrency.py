@@ -0,0 +1,254 @@
+import asyncio
+import threading
+import unittest
+
+from stockbot.concurrency import BoundedExecutor, FanOut, SingleFlight, TaskPool, TaskRejected, fan_out
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+
+    def test_sequential_calls_are_not_coalesced(self):
+        self.assertEquals(2, self.single_flight.do("key", lambda x: x * 2, 1))
+        self.assertEquals(4, self.single_flight.do("key", lambda x: x * 2, 2))
+        self.assertEquals({"calls": 2, "coalesced": 0, "in_flight": 0}, self.single_flight.stats())
+
+    def test_concurrent_calls_share_one_result(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch(ticker):
+            calls.append(ticker)
+            started.set()
+            release.wait(5)
+            return "quote for {}".format(ticker)
+
+        fetch_once = self.single_flight.wrap("provider", "get_quote", fetch)
+        results = []
+
+        def worker():
+            results.append(fetch_once("FOO"))
+
+        leader = threading.Thread(target=worker)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=worker) for _ in range(4)]
+        for t in followers:
+            t.start()
+        # wait for every follower to join the call that is in flight before letting it finish
+        while self.single_flight.stats()["coalesced"] < 4:
+            threading.Event().wait(0.01)
+        release.set()
+        for t in [leader] + followers:
+            t.join()
+
+        self.assertEquals(["FOO"], calls)
+        self.assertEquals(["quote for FOO"] * 5, results)
+        self.assertEquals({"calls": 5, "coalesced": 4, "in_flight": 0}, self.single_flight.stats())
+        self.assertEquals("Calls: 5, Coalesced: 4, In flight: 0", str(self.single_flight))
+
+    def test_exception_is_shared_and_not_cached(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            started.set()
+            release.wait(5)
+            raise ValueError("boom")
+
+        errors = []
+
+        def worker():
+            try:
+                self.single_flight.do("key", fetch)
+            except ValueError as e:
+                errors.append(str(e))
+
+        leader = threading.Thread(target=worker)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=worker)
+        follower.start()
+        while self.single_flight.stats()["coalesced"] < 1:
+            threading.Event().wait(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEquals(["boom", "boom"], errors)
+        self.assertEquals("ok", self.single_flight.do("key", lambda: "ok"))
+
+    def test_async_calls_share_one_result(self):
+        calls = []
+
+        async def fetch(ticker):
+            calls.append(ticker)
+            await asyncio.sleep(0.01)
+            return "quote for {}".format(ticker)
+
+        fetch_once = self.single_flight.wrap_async("provider", "aget_quote", fetch)
+
+        async def main():
+            return await asyncio.gather(fetch_once("FOO"), fetch_once("FOO"), fetch_once("BAR"))
+
+        results = asyncio.run(main())
+        self.assertEquals(["quote for FOO", "quote for FOO", "quote for BAR"], results)
+        self.assertEquals(["FOO", "BAR"], calls)
+        self.assertEquals({"calls": 3, "coalesced": 1, "in_flight": 0}, self.single_flight.stats())
+
+    def test_async_exception_is_shared(self):
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def main():
+            return await asyncio.gather(self.single_flight.ado("key", fetch), self.single_flight.ado("key", fetch),
+                                        return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertEquals(["boom", "boom"], [str(e) for e in results])
+        self.assertEquals(1, self.single_flight.stats()["coalesced"])
+
+
+class TestBoundedExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = BoundedExecutor(name="test", max_workers=2, max_pending=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_submit(self):
+        future = self.executor.submit(lambda x: x * 2, 21)
+        self.assertEquals(42, future.result(5))
+
+    def test_rejects_work_over_capacity(self):
+        release = threading.Event()
+        futures = [self.executor.submit(release.wait, 5) for _ in range(3)]
+        self.assertTrue(all(f is not None for f in futures))
+        self.assertIsNone(self.executor.submit(release.wait, 5))
+        self.assertEquals(1, self.executor.stats()["rejected"])
+
+        release.set()
+        for f in futures:
+            f.result(5)
+        self.assertEquals(0, self.executor.stats()["in_flight"])
+        self.assertIsNotNone(self.executor.submit(lambda: None))
+
+    def test_failures_are_counted(self):
+        def broken():
+            raise ValueError("boom")
+
+        future = self.executor.submit(broken)
+        self.assertRaises(ValueError, future.result, 5)
+        self.executor.submit(lambda: None).result(5)
+        self.assertEquals("Executor: test, Workers: 2, In flight: 0, Submitted: 2, Rejected: 0, Failed: 1",
+                          str(self.executor))
+
+
+class TestTaskPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = TaskPool(name="test", max_workers=1, max_pending=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def test_exclusive_task_is_refused_while_running(self):
+        future = self.pool.submit_task(("scrape", "sek"), self.release.wait, 5)
+        self.assertTrue(self.pool.is_running(("scrape", "sek")))
+        with self.assertRaises(TaskRejected) as cm:
+            self.pool.submit_task(("scrape", "sek"), self.release.wait, 5)
+        self.assertEquals("Task is currently running, hold your horses", str(cm.exception))
+        self.assertEquals("Executor: test, Workers: 1, In flight: 1, Submitted: 1, Rejected: 0, Failed: 0, "
+                          "Running: scrape sek", str(self.pool))
+
+        self.release.set()
+        future.result(5)
+        self.assertFalse(self.pool.is_running(("scrape", "sek")))
+        self.pool.submit_task(("scrape", "sek"), lambda: None).result(5)
+
+    def test_non_exclusive_tasks_can_run_concurrently(self):
+        self.pool.submit_task("foo", self.release.wait, 5, exclusive=False)
+        self.pool.submit_task("foo", self.release.wait, 5, exclusive=False)
+        self.release.set()
+        self.pool.join(5)
+        self.assertFalse(self.pool.is_running("foo"))
+
+    def test_rejected_over_capacity(self):
+        self.pool.submit_task("a", self.release.wait, 5)
+        self.pool.submit_task("b", self.release.wait, 5)
+        with self.assertRaises(TaskRejected) as cm:
+            self.pool.submit_task("c", self.release.wait, 5)
+        self.assertEquals("Too many tasks running, try again later", str(cm.exception))
+        self.assertFalse(self.pool.is_running("c"))
+
+
+class TestFanOut(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = TaskPool(name="test", max_workers=4, max_pending=0)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def test_jobs_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+        jobs = [(k, barrier.wait, ()) for k in ["a", "b", "c"]]
+        summary = fan_out(self.pool, jobs, 5)
+        # the barrier only lets the jobs through when all of them are running at the same time
+        self.assertEquals(["a", "b", "c"], summary.finished)
+        self.assertEquals({"finished": 3, "failed": 0, "timed_out": 0, "rejected": 0}, dict(
+            (k, v) for k, v in summary.stats().items() if k != "elapsed"))
+
+    def test_summary(self):
+        def broken():
+            raise ValueError("boom")
+
+        self.pool.submit_task("busy", self.release.wait, 5)
+        jobs = [("ok", lambda: None, ()), ("broken", broken, ()), ("slow", self.release.wait, (5,)),
+                ("busy", lambda: None, ())]
+        summary = fan_out(self.pool, jobs, 0.1)
+        self.assertEquals(["ok"], summary.finished)
+        self.assertEquals(["broken"], summary.failed)
+        self.assertEquals(["slow"], summary.timed_out)
+        self.assertEquals(["busy"], summary.rejected)
+        self.assertTrue(summary.elapsed < 5)
+        self.assertRegex(str(summary), "^Finished: 1, Failed: 1, Timed out: 1, Rejected: 1, Took: \\d+\\.\\d\\ds")
+        self.assertTrue(str(summary).endswith(" | Failed: broken | Timed out: slow | Rejected: busy"))
+
+        # the job that timed out is still running and won't be started twice
+        summary = fan_out(self.pool, [("slow", lambda: None, ())], 0.1)
+        self.assertEquals(["slow"], summary.rejected)
+
+    def test_summary_is_handed_over_once_without_waiting(self):
+        summaries = []
+        done = threading.Event()
+
+        def callback(summary):
+            summaries.append(summary)
+            done.set()
+
+        run = FanOut(pool=self.pool, jobs=[("a", self.release.wait, (5,)), ("b", lambda: None, ())],
+                     callback=callback).start()
+        # start doesn't wait for the jobs
+        self.assertEquals([], summaries)
+        self.release.set()
+        self.assertTrue(done.wait(5))
+        self.assertEquals(["a", "b"], summaries[0].finished)
+        # the deadline passing later changes nothing
+        self.assertIs(summaries[0], run.expire())
+        self.assertEquals(1, len(summaries))
+
+    def test_nothing_started_is_summarized_right_away(self):
+        summaries = []
+        self.pool.submit_task("busy", self.release.wait, 5)
+        FanOut(pool=self.pool, jobs=[("busy", lambda: None, ())], callback=summaries.append).start()
+        self.assertEquals(["busy"], summaries[0].rejected)
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from stockbot.history import HistorySummary, TickHistory, TickSeries, sparkline
+from stockbot.provider import QuoteServiceFactory
+from tests.fakes import FakeClock
+
+
+class FakeQuote(object):
+
+    def __init__(self, timestamp, price, change):
+        self.timestamp = timestamp
+        self.tick = (price, change)
+
+    def get_timestamp(self):
+        return self.timestamp
+
+    def get_tick(self):
+        return self.tick
+
+
+class FakeQuoteService(object):
+
+    calls = 0
+
+    def get_quote(self, ticker):
+        self.calls += 1
+        return FakeQuote(datetime.fromtimestamp(1000 + self.calls), 10.0 + self.calls, 0.5)
+
+
+class TestTickHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.clock = FakeClock(1000.0)
+        self.history = TickHistory(path=self.path, flush_size=4, flush_interval=60, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_record_and_read(self):
+        for i in range(10):
+            self.assertTrue(self.history.record("bloomberg:FOO", 100.0 + i, 10.0 + i, float(i)))
+
+        # two full chunks written, the rest still buffered
+        self.assertEquals(2, len(os.listdir(os.path.join(self.path, "bloomberg%3AFOO"))))
+        self.assertEquals({"instruments": 1, "recorded": 10, "skipped": 0, "buffered": 2, "chunks": 2},
+                          self.history.stats())
+
+        series = self.history.read("bloomberg:FOO")
+        self.assertEquals([100.0 + i for i in range(10)], list(series.timestamps))
+        self.assertEquals([10.0 + i for i in range(10)], list(series.prices))
+        self.assertEquals([float(i) for i in range(10)], list(series.changes))
+
+        # start is inclusive, end exclusive, across chunks and the buffer
+        series = self.history.read("bloomberg:FOO", start=102.5, end=109.0)
+        self.assertEquals([103.0, 104.0, 105.0, 106.0, 107.0, 108.0], list(series.timestamps))
+        self.assertEquals(0, len(self.history.read("bloomberg:FOO", start=200.0)))
+        self.assertEquals(0, len(self.history.read("bloomberg:BAR")))
+
+    def test_stale_ticks_are_skipped(self):
+        self.assertTrue(self.history.record("yahoo:FOO", 100.0, 1.0, 0.0))
+        self.assertFalse(self.history.record("yahoo:FOO", 100.0, 1.0, 0.0))
+        self.assertFalse(self.history.record("yahoo:FOO", 99.0, 1.0, 0.0))
+        self.assertTrue(self.history.record("yahoo:FOO", 101.0, 1.1, 0.1))
+        self.assertEquals(1, len(self.history.read("yahoo:FOO", end=101.0)))
+        self.assertEquals(2, self.history.stats()["skipped"])
+        self.assertEquals("Instruments: 1, Recorded: 2, Skipped: 2, Buffered: 2, Chunks written: 0",
+                          str(self.history))
+
+    def test_flush_by_age_and_reopen(self):
+        self.history.record("avanza:FOO", 100.0, 1.0, 0.0)
+        self.assertEquals(0, self.history.flush())
+        self.clock.now += 60
+        self.history.record("avanza:BAR", 100.0, 2.0, 0.0)
+        self.assertEquals(1, self.history.flush())
+        self.assertEquals(1, self.history.flush(force=True))
+
+        # a new store picks up where the old one stopped
+        history = TickHistory(path=self.path, flush_size=4, flush_interval=60, clock=self.clock)
+        self.assertEquals(["avanza:BAR", "avanza:FOO"], history.instruments())
+        self.assertFalse(history.record("avanza:FOO", 100.0, 1.0, 0.0))
+        self.assertTrue(history.record("avanza:FOO", 101.0, 1.5, 0.5))
+        self.assertEquals([1.0, 1.5], list(history.read("avanza:FOO").prices))
+
+    def test_factory_records_fetched_quotes(self):
+        factory = QuoteServiceFactory(history=self.history)
+        factory.providers = {"fakeprovider": FakeQuoteService}
+        service = factory.get_service("fakeprovider")
+        service.get_quote("foo")
+        service.get_quote("bar")
+        # served from the quote cache, nothing new to record
+        service.get_quote("foo")
+        self.assertEquals(2, service.calls)
+        self.assertEquals([1001.0], list(self.history.read("fakeprovider:FOO").timestamps))
+        self.assertEquals([12.0], list(self.history.read("fakeprovider:BAR").prices))
+
+        # quotes without a tick are passed through
+        self.assertFalse(self.history.record_quote("fakeprovider", "bar", "Here's your fake quote"))
+
+    def test_quotes_without_update_time_are_recorded_when_they_move(self):
+        self.assertTrue(self.history.record_quote("google", "FOO", FakeQuote(None, 10.0, 0.5)))
+        self.clock.now += 60
+        # fetched again, nothing changed
+        self.assertFalse(self.history.record_quote("google", "FOO", FakeQuote(None, 10.0, 0.5)))
+        self.clock.now += 60
+        self.assertTrue(self.history.record_quote("google", "FOO", FakeQuote(None, 10.5, 1.0)))
+        self.assertEquals([1000.0, 1120.0], list(self.history.read("google:FOO").timestamps))
+
+        # the last tick is known after a restart as well
+        self.history.flush(force=True)
+        history = TickHistory(path=self.path, flush_size=4, flush_interval=60, clock=self.clock)
+        self.clock.now += 60
+        self.assertFalse(history.record_quote("google", "FOO", FakeQuote(None, 10.5, 1.0)))
+
+    def test_lookup(self):
+        for instrument in ["bloomberg:FOO", "yahoo:FOO", "google:STO:VOLV"]:
+            self.history.record(instrument, 100.0, 1.0, 0.0)
+        self.assertEquals(["bloomberg:FOO", "yahoo:FOO"], self.history.lookup("foo"))
+        self.assertEquals(["yahoo:FOO"], self.history.lookup("yahoo:foo"))
+        self.assertEquals(["google:STO:VOLV"], self.history.lookup("STO:VOLV"))
+        self.assertEquals([], self.history.lookup("bar"))
+
+
+class TestOhlc(unittest.TestCase):
+
+    def test_downsample(self):
+        series = TickSeries()
+        # two ticks in the first minute, none in the second and three in the third
+        series.extend([60.0, 90.0, 185.0, 200.0, 239.0], [10.0, 12.0, 11.0, 9.0, 10.5], [0.0] * 5)
+        bars = series.ohlc(60)
+        self.assertEquals([60.0, 180.0], list(bars.times))
+        self.assertEquals([10.0, 11.0], list(bars.opens))
+        self.assertEquals([12.0, 11.0], list(bars.highs))
+        self.assertEquals([10.0, 9.0], list(bars.lows))
+        self.assertEquals([12.0, 10.5], list(bars.closes))
+        self.assertEquals([2, 3], list(bars.counts))
+        self.assertEquals(5, bars.ticks())
+        self.assertAlmostEqual(5.0, bars.change())
+
+        self.assertEquals(0, len(TickSeries().ohlc(60)))
+        self.assertRaises(ValueError, series.ohlc, 0)
+
+    def test_sparkline(self):
+        self.assertEquals(u"▁▂▃▄▅▆▇█", sparkline(range(8)))
+        self.assertEquals(u"▁█▁", sparkline([1.0, 3.0, 1.0]))
+        self.assertEquals(u"▄▄", sparkline([2.0, 2.0]))
+        self.assertEquals("", sparkline([]))
+
+    def test_summary(self):
+        series = TickSeries()
+        series.extend([0.0, 30.0, 60.0, 120.0], [10.0, 11.0, 12.5, 8.0], [0.0] * 4)
+        summary = HistorySummary(instrument="bloomberg:FOO", bars=series.ohlc(60), period="1d/1m")
+        self.assertEquals(u"Name: bloomberg:FOO, Period: 1d/1m, History: ▆█▁, First: 10.0, Last: 8.0, Min: 8.0, "
+                          u"Max: 12.5, %Change: -20.0, Bars: 3, Ticks: 4", str(summary))
@@ -0,0 +1,128 @@
+import unittest
+
+from stockbot.output import MessagePacker, OutputQueue, TokenBucket
+from stockbot.render import Field, IrcRenderer
+from stockbot.util import ColorHelper
+from tests.fakes import FakeClock
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=0.5, burst=2, clock=self.clock)
+
+    def test_burst_then_refill(self):
+        self.assertTrue(self.bucket.consume())
+        self.assertTrue(self.bucket.consume())
+        self.assertFalse(self.bucket.consume())
+        self.assertEquals(2.0, self.bucket.delay())
+
+        self.clock.now = 1
+        self.assertFalse(self.bucket.consume())
+        self.clock.now = 2
+        self.assertTrue(self.bucket.consume())
+
+    def test_never_exceeds_burst(self):
+        self.clock.now = 3600
+        self.assertTrue(self.bucket.is_full())
+        self.assertTrue(self.bucket.consume())
+        self.assertTrue(self.bucket.consume())
+        self.assertFalse(self.bucket.consume())
+
+
+class TestOutputQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sent = []
+        self.queue = OutputQueue(send=lambda *args: self.sent.append(args), rate=1, burst=2, clock=self.clock)
+
+    def test_put_does_not_send(self):
+        for i in range(20):
+            self.queue.put("#channel", "row {}".format(i))
+        self.assertEquals([], self.sent)
+        self.assertEquals(20, self.queue.stats()["depth"])
+
+    def test_drain_is_rate_limited_per_target(self):
+        for i in range(5):
+            self.queue.put("#channel", "row {}".format(i))
+
+        # burst
+        self.assertEquals(2, self.queue.drain())
+        self.assertEquals(0, self.queue.drain())
+
+        # refill rate
+        self.clock.now = 1
+        self.assertEquals(1, self.queue.drain())
+        self.clock.now = 3
+        self.assertEquals(2, self.queue.drain())
+
+        self.assertEquals([("privmsg", "#channel", "row {}".format(i)) for i in range(5)], self.sent)
+        stats = self.queue.stats()
+        self.assertEquals(0, stats["depth"])
+        self.assertEquals(5, stats["sent"])
+        self.assertEquals(3, stats["max_lag"])
+        self.assertEquals(1.4, stats["avg_lag"])
+
+    def test_targets_take_turns(self):
+        for i in range(10):
+            self.queue.put("#channel", "row {}".format(i))
+        self.queue.put("someone", "hello", method="notice")
+
+        self.queue.drain()
+        self.assertIn(("notice", "someone", "hello"), self.sent)
+        self.assertEquals(3, len(self.sent))
+
+    def test_failed_send_is_counted(self):
+        def broken(*args):
+            raise RuntimeError("Not connected.")
+
+        queue = OutputQueue(send=broken, rate=1, burst=2, clock=self.clock)
+        queue.put("#channel", "foo")
+        queue.drain()
+        self.assertEquals(1, queue.stats()["failed"])
+        self.assertEquals(0, queue.stats()["depth"])
+
+
+class TestMessagePacker(unittest.TestCase):
+
+    def setUp(self):
+        self.packer = MessagePacker(reserve=64)
+
+    def test_budget_counts_the_whole_protocol_line(self):
+        # "PRIVMSG #channel :" + CR/LF
+        self.assertEquals(512 - 20 - 64, self.packer.budget("#channel"))
+        self.assertEquals(512 - 19 - 64, self.packer.budget("#channel", method="notice"))
+
+    def test_multibyte_text_is_counted_in_bytes(self):
+        segments = ["Name: Östgöta Ålandsbanken {}".format(i) for i in range(40)]
+        messages = self.packer.split(segments, ", ", 100)
+        self.assertTrue(len(messages) > 1)
+        for message in messages:
+            self.assertTrue(self.packer.size(message) <= 100)
+        self.assertEquals(", ".join(segments), ", ".join(messages))
+
+    def test_color_codes_are_never_cut(self):
+        fields = [Field("Name", "Ericsson", Field.TITLE)] + [Field("Field {}".format(i), "värde") for i in range(30)]
+        segments = [IrcRenderer.render_field(f, index) for index, f in enumerate(fields)]
+        messages = self.packer.split(segments, IrcRenderer.separator, 120)
+        self.assertTrue(len(messages) > 1)
+        for message in messages:
+            self.assertTrue(self.packer.size(message) <= 120)
+            # every message is made up of whole fields
+            for segment in message.split(IrcRenderer.separator):
+                self.assertIn(segment, segments)
+
+    def test_short_rows_are_packed(self):
+        rows = ["row {}".format(i) for i in range(10)]
+        self.assertEquals([" | ".join(rows)], self.packer.pack(rows, 400))
+        self.assertEquals(["row 0 | row 1", "row 2 | row 3", "row 4"], self.packer.pack(rows[:5], 13))
+
+    def test_oversized_field_is_hard_split(self):
+        segment = ColorHelper.grey("å" * 30)
+        messages = self.packer.split(["Name: foo", segment, "Bar: baz"], ", ", 20)
+        self.assertEquals(["Name: foo", "å" * 10, "å" * 10, "å" * 10, "Bar: baz"], messages)
+
+    def test_newlines_are_replaced(self):
+        self.assertEquals(["foo bar"], self.packer.split(["foo\r\nbar"], ", ", 100))
@@ -1,6 +1,8 @@
 import unittest
 
-from stockbot.db import create_tables
+from sqlalchemy import event
+
+from stockbot.db import Session, create_tables, engine
 from stockbot.persistence import DatabaseCollection, ScheduledTicker
 
 
@@ -41,3 +43,38 @@ class TestDatabaseCollection(unittest.TestCase):
 
         stl.remove("FOOBAR")
         self.assertEquals(0, len(stl))
+
+    def test_reads_are_served_from_memory(self):
+        stl = DatabaseCollection(type=ScheduledTicker, attribute="ticker")
+        stl.append("APPL")
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            self.assertEquals("APPL", stl[0])
+            self.assertEquals(1, len(stl))
+            self.assertIn("APPL", stl)
+            self.assertEquals(["APPL"], list(stl))
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        self.assertEquals([], statements)
+        stl.remove("APPL")
+
+    def test_reload(self):
+        stl = DatabaseCollection(type=ScheduledTicker, attribute="ticker")
+        self.assertEquals(0, len(stl))
+
+        # changed behind the back of the collection
+        session = Session()
+        session.add(ScheduledTicker(ticker="FOOBAR"))
+        session.commit()
+        session.close()
+        self.assertNotIn("FOOBAR", stl)
+
+        stl.reload()
+        self.assertEquals(["FOOBAR"], list(stl))
+        stl.remove("FOOBAR")
+        self.assertEquals(0, len(DatabaseCollection(type=ScheduledTicker, attribute="ticker")))
@@ -0,0 +1,113 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import func, select
+
+from stockbot.db import Session, create_tables, drop_tables
+from stockbot.pipeline import StockScrapePipeline
+from stockbot.provider.google import StockDomain, stocks_staging
+from stockbot.provider.nasdaq import NasdaqCompany
+
+
+class FakeQuote(object):
+
+    def __init__(self, symbol):
+        self.name = "{} AB".format(symbol)
+        self.symbol = symbol
+        self.keyratios = []
+        self.mc = "1B"
+
+
+class FakeQuoteService(object):
+
+    def __init__(self, barrier=None, on_fetch=None):
+        self.barrier = barrier
+        self.on_fetch = on_fetch
+        self.tickers = []
+        self.lock = threading.Lock()
+
+    def get_quote(self, ticker):
+        with self.lock:
+            self.tickers.append(ticker)
+        if self.barrier is not None:
+            self.barrier.wait()
+        if self.on_fetch is not None:
+            self.on_fetch(ticker)
+        if ticker.endswith("BROKEN"):
+            raise RuntimeError("provider said no")
+        return FakeQuote(ticker.split(":")[-1])
+
+
+class TestStockScrapePipeline(unittest.TestCase):
+
+    def setUp(self):
+        create_tables()
+        self.session = Session()
+        self.session.add_all([NasdaqCompany(name=t, ticker=t, currency="SEK", category="bla",
+                                            segment="nordic large cap") for t in ["AAK", "ABB", "BROKEN", "VOLV"]])
+        self.session.add(NasdaqCompany(name="Other", ticker="OTHER", currency="EUR", category="bla",
+                                       segment="nordic large cap"))
+        # stale row that gets replaced
+        self.session.add(StockDomain(name="Old AAK", ticker="AAK"))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        drop_tables()
+
+    def test_pipeline(self):
+        service = FakeQuoteService()
+        pipeline = StockScrapePipeline(service=service, segment="nordic large cap", currency="SEK", workers=2,
+                                       queue_size=2, batch_size=2, rate=1000)
+        self.assertEquals(3, pipeline.run())
+
+        self.assertEquals(["STO:AAK", "STO:ABB", "STO:BROKEN", "STO:VOLV"], sorted(service.tickers))
+        stats = pipeline.stats()
+        self.assertEquals("done", stats["state"])
+        self.assertEquals(4, stats["queued"])
+        self.assertEquals(3, stats["fetched"])
+        self.assertEquals(3, stats["parsed"])
+        self.assertEquals(3, stats["written"])
+        self.assertEquals(1, stats["failed"])
+        self.assertTrue(stats["batches"] >= 2)
+        self.assertRegex(str(pipeline), "^Segment: nordic large cap, Currency: SEK, State: done, Queued: 4, "
+                                        "Fetched: 3, Parsed: 3, Staged: 3, Written: 3, Failed: 1, Took: ")
+
+        self.assertEquals(["AAK AB", "ABB AB", "VOLV AB"],
+                          sorted([s.name for s in self.session.query(StockDomain).all()]))
+        self.assertEquals(0, self.session.execute(select(func.count()).select_from(stocks_staging)).scalar())
+
+    def test_readers_see_the_old_stocks_until_the_merge(self):
+        seen = []
+
+        def on_fetch(ticker):
+            # the batches before this one are staged but not visible
+            session = Session()
+            seen.append(sorted([s.name for s in session.query(StockDomain).all()]))
+            session.close()
+
+        service = FakeQuoteService(on_fetch=on_fetch)
+        pipeline = StockScrapePipeline(service=service, segment="nordic large cap", currency="SEK", workers=1,
+                                       queue_size=1, batch_size=1, rate=1000)
+        self.assertEquals(3, pipeline.run())
+        self.assertEquals([["Old AAK"]] * 4, seen)
+        self.assertEquals(3, self.session.query(StockDomain).count())
+
+    def test_nothing_is_merged_when_reading_the_companies_fails(self):
+        pipeline = StockScrapePipeline(service=FakeQuoteService(), segment="nordic large cap", currency="SEK",
+                                       workers=1, rate=1000)
+        with patch("stockbot.pipeline.Session") as session_mock:
+            session_mock.return_value.query.side_effect = RuntimeError("database is gone")
+            self.assertEquals(0, pipeline.run())
+        self.assertEquals("failed", pipeline.state)
+        self.assertEquals(["Old AAK"], [s.name for s in self.session.query(StockDomain).all()])
+
+    def test_fetches_run_concurrently(self):
+        # every worker has to be fetching at the same time for the barrier to let them through
+        service = FakeQuoteService(barrier=threading.Barrier(4, timeout=5))
+        pipeline = StockScrapePipeline(service=service, segment="nordic large cap", currency="SEK", workers=4,
+                                       queue_size=4, batch_size=10, rate=1000)
+        self.assertEquals(3, pipeline.run())
+        self.assertEquals(0, service.barrier.n_waiting)
+        self.assertFalse(service.barrier.broken)
@@ -1,5 +1,9 @@
+import asyncio
 import json
 import os
+import shutil
+import tempfile
+import threading
 import unittest
 
 from datetime import datetime
@@ -7,16 +11,23 @@ from unittest.mock import patch
 
 import vcr
 
+from stockbot.db import Session, create_tables, drop_tables
 from stockbot.persistence import DatabaseCollection, ScheduledCommand
 from stockbot.provider import Analytics, QuoteServiceFactory
 from stockbot.provider.bloomberg import BloombergQuote, BloombergQueryService, BloombergSearchResult
 from stockbot.provider.google import GoogleFinanceQueryService, GoogleFinanceQuote, GoogleFinanceSearchResult,\
     StockDomain
-from stockbot.provider.nasdaq import NasdaqIndexScraper
-from stockbot.provider.avanza import AvanzaQuote, AvanzaQueryService, AvanzaSearchResult
+from stockbot.provider.nasdaq import NasdaqCompany, NasdaqIndexScraper, NasdaqListingSync, sync_companies
+from stockbot.provider.parser import HtmlParser, fromstring
+from stockbot.provider.avanza import AvanzaQuote, AvanzaQueryService, AvanzaQuoteExtractor, AvanzaSearchResult
 from stockbot.provider.ig import IGQueryService
-from stockbot.provider.ibindex import IbIndexQueryService
+from stockbot.provider.ibindex import IbIndexQueryService, IbIndexSnapshot
 from stockbot.provider.yahoo import YahooQueryService
+from stockbot.provider.base import BaseQuoteService
+from stockbot.transport import AsyncHttpTransport, HttpRequest, HttpTransport, get_default_transport
+from stockbot.cache import QuoteCache
+from stockbot.history import TickHistory
+from tests.fakes import FakeClock
 
 CWD = os.path.dirname(os.path.realpath(__file__))
 
@@ -297,6 +308,149 @@ class TestNasdaqIndexScraper(unittest.TestCase):
         res = scraper.scrape("Nordic Small Cap")
         self.assertIn("Aspocomp Group Oyj", res)
 
+    @vcr.use_cassette('mock/vcr_cassettes/nasdaq/large_cap.yaml', allow_playback_repeats=True)
+    def test_stream_and_tree_agree(self):
+        streamed = NasdaqIndexScraper(mode="stream", chunk_size=512).scrape("Nordic Large Cap")
+        parsed = NasdaqIndexScraper(mode="tree").scrape("Nordic Large Cap")
+        self.assertEquals(201, len(streamed))
+        self.assertEquals([repr(c) for c in parsed], [repr(c) for c in streamed])
+
+    def test_companies_are_yielded_while_downloading(self):
+        row = "<tr><td><a href='#'>{n}</a></td><td>{n}</td><td>SEK</td><td>SE0</td><td>Industrials</td></tr>"
+        chunks = ["<html><body><article class='nordic-our-listed-companies'><table><thead>",
+                  "<tr><th>Name</th></tr></thead><tbody>", row.format(n="AAA"), row.format(n="BBB"),
+                  "</tbody></table></article></body></html>"]
+        fed = []
+
+        class FakeResponse(object):
+            encoding = "utf-8"
+
+            def iter_content(self, chunk_size=None, decode_unicode=False):
+                for chunk in chunks:
+                    fed.append(chunk)
+                    yield chunk
+
+            def close(self):
+                pass
+
+        class FakeTransport(object):
+            def get(self, url, **kwargs):
+                return FakeResponse()
+
+        companies = NasdaqIndexScraper(transport=FakeTransport(), mode="stream").iter_companies("Nordic Mid Cap")
+        first = next(companies)
+        self.assertEquals("AAA", first.ticker)
+        self.assertEquals("nordic mid cap", first.segment)
+        # the first company shows up before the rest of the page has been read
+        self.assertTrue(len(fed) < len(chunks))
+        self.assertEquals(["BBB"], [c.ticker for c in companies])
+
+    def test_scrape_all_reports_failed_indexes(self):
+        scraper = NasdaqIndexScraper()
+
+        def scrape(index):
+            if index == "Nordic Mid Cap":
+                raise RuntimeError("page is down")
+            if index == "Nordic Small Cap":
+                return []
+            return [NasdaqCompany(name="Foo", ticker="FOO", currency="SEK", category="bla", segment=index)]
+
+        with patch.object(scraper, "scrape", side_effect=scrape):
+            scraped, failed = scraper.scrape_all(max_workers=3)
+        self.assertEquals(["Nordic Large Cap"], list(scraped.keys()))
+        self.assertEquals(["Nordic Mid Cap", "Nordic Small Cap"], sorted(failed))
+
+    def test_iter_all_yields_rows_while_other_indexes_download(self):
+        scraper = NasdaqIndexScraper(mode="stream")
+        release = threading.Event()
+
+        def iter_companies(index):
+            if index == "Nordic Mid Cap":
+                raise RuntimeError("page is down")
+            if index == "Nordic Small Cap":
+                # still downloading until the large cap row has been consumed
+                self.assertTrue(release.wait(5))
+            yield NasdaqCompany(name="Foo", ticker=index[7:10].upper(), currency="SEK", category="bla",
+                                segment=index)
+
+        with patch.object(scraper, "iter_companies", side_effect=iter_companies):
+            rows = scraper.iter_all(max_workers=3)
+            segment, company = next(rows)
+            self.assertEquals(("Nordic Large Cap", "LAR"), (segment, company.ticker))
+            self.assertEquals(("Nordic Large Cap", None), next(rows))
+            release.set()
+            self.assertEquals([("Nordic Small Cap", "SMA"), ("Nordic Small Cap", None)],
+                              [(k, c.ticker if c is not None else None) for k, c in rows])
+
+
+class TestNasdaqSync(unittest.TestCase):
+
+    def setUp(self):
+        create_tables()
+        self.session = Session()
+        self.session.add_all([
+            NasdaqCompany(name="Foo", ticker="FOO", currency="SEK", category="bla", segment="Nordic Large Cap"),
+            NasdaqCompany(name="Bar", ticker="BAR", currency="SEK", category="bla", segment="Nordic Large Cap"),
+            NasdaqCompany(name="Baz", ticker="BAZ", currency="SEK", category="bla", segment="Nordic Large Cap"),
+            NasdaqCompany(name="Qux", ticker="QUX", currency="SEK", category="bla", segment="Nordic Small Cap")
+        ])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        drop_tables()
+
+    def test_sync(self):
+        scraped = {
+            "Nordic Large Cap": [
+                NasdaqCompany(name="Foo", ticker="FOO", currency="SEK", category="bla", segment="Nordic Large Cap"),
+                NasdaqCompany(name="Bar Renamed", ticker="BAR", currency="SEK", category="bla",
+                              segment="Nordic Large Cap"),
+                NasdaqCompany(name="New", ticker="NEW", currency="SEK", category="bla", segment="Nordic Large Cap")
+            ],
+            "Nordic Mid Cap": [
+                NasdaqCompany(name="Baz", ticker="BAZ", currency="SEK", category="bla", segment="Nordic Mid Cap")
+            ]
+        }
+        changes = sync_companies(self.session, scraped, failed=["Nordic Small Cap"])
+        self.session.commit()
+
+        self.assertEquals(["NEW"], changes.added)
+        self.assertEquals(["BAR", "BAZ"], sorted(changes.updated))
+        self.assertEquals([], changes.removed)
+        self.assertEquals("Synced 4 companies from Nasdaq - Added: 1 (NEW), Updated: 2 (BAR, BAZ), Removed: 0, "
+                          "Failed: Nordic Small Cap", str(changes))
+        rows = dict([(c.ticker, c) for c in self.session.query(NasdaqCompany).all()])
+        self.assertEquals("Bar Renamed", rows["BAR"].name)
+        self.assertEquals("nordic mid cap", rows["BAZ"].segment)
+        # the small cap page failed so its companies are kept
+        self.assertIn("QUX", rows)
+
+        scraped["Nordic Small Cap"] = [
+            NasdaqCompany(name="Other", ticker="OTHER", currency="SEK", category="bla", segment="Nordic Small Cap")
+        ]
+        del scraped["Nordic Large Cap"][0]
+        changes = sync_companies(self.session, scraped)
+        self.session.commit()
+        self.assertEquals("Synced 4 companies from Nasdaq - Added: 1 (OTHER), Updated: 0, Removed: 2 (FOO, QUX)",
+                          str(changes))
+        self.assertEquals(["BAR", "BAZ", "NEW", "OTHER"],
+                          sorted([c.ticker for c in self.session.query(NasdaqCompany).all()]))
+
+    def test_sync_one_company_at_a_time(self):
+        sync = NasdaqListingSync(self.session)
+        sync.add(NasdaqCompany(name="Foo", ticker="FOO", currency="SEK", category="bla", segment="Nordic Large Cap"))
+        sync.add(NasdaqCompany(name="New", ticker="NEW", currency="SEK", category="bla", segment="Nordic Large Cap"))
+        self.assertEquals(["NEW"], sync.changes.added)
+        sync.complete("Nordic Large Cap")
+        # an empty listing doesn't delist anything
+        sync.complete("Nordic Small Cap")
+        changes = sync.finish(failed=["Nordic Mid Cap"])
+        self.session.commit()
+        self.assertEquals("Synced 2 companies from Nasdaq - Added: 1 (NEW), Updated: 0, Removed: 2 (BAR, BAZ), "
+                          "Failed: Nordic Small Cap, Nordic Mid Cap", str(changes))
+        self.assertEquals(["FOO", "NEW", "QUX"], sorted([c.ticker for c in self.session.query(NasdaqCompany).all()]))
+
 
 class TestQuoteServiceFactory(unittest.TestCase):
 
@@ -312,6 +466,253 @@ class TestQuoteServiceFactory(unittest.TestCase):
         self.assertEquals(factory.get_service("google"), factory.get_service("google"))
         self.assertEquals(factory.get_service("bloomberg"), factory.get_service("bloomberg"))
 
+    def test_services_share_transport(self):
+
+        factory = QuoteServiceFactory()
+        self.assertIs(factory.transport, factory.get_service("google").transport)
+        self.assertIs(factory.transport, factory.get_service("avanza").transport)
+
+        # fake providers that aren't a BaseQuoteService get instantiated as is
+        factory.providers = {"fakeprovider": FakeQuoteService}
+        self.assertEquals(FakeQuoteService, type(factory.get_service("fakeprovider")))
+
+    def test_service_calls_go_through_single_flight(self):
+
+        factory = QuoteServiceFactory()
+        factory.providers = {"fakeprovider": FakeQuoteService}
+        service = factory.get_service("fakeprovider")
+
+        self.assertEquals("Here's your fake quote for FOO", service.get_quote("FOO"))
+        self.assertEquals("FOO", service.search("foo").get_tickers()[0])
+        self.assertEquals({"calls": 2, "coalesced": 0, "in_flight": 0}, factory.single_flight.stats())
+
+
+class TestQuoteCache(unittest.TestCase):
+
+    class FakeQuote(object):
+
+        def __init__(self, timestamp):
+            self.timestamp = timestamp
+
+        def get_timestamp(self):
+            return self.timestamp
+
+        def get_tick(self):
+            return 10.0, 0.5
+
+    class CountingQuoteService(object):
+
+        calls = 0
+        timestamp = None
+
+        def get_quote(self, ticker):
+            self.calls += 1
+            return TestQuoteCache.FakeQuote(self.timestamp)
+
+    def setUp(self):
+        self.cache = QuoteCache(min_ttl=60, max_ttl=900)
+
+    def test_ttl_from_quote_timestamp(self):
+        now = datetime(2020, 8, 14, 12, 0, 0)
+
+        # live quote, 15 minutes delayed, keep it until the next print can show up
+        quote = self.FakeQuote(datetime(2020, 8, 14, 11, 45, 0))
+        self.assertEquals(60, self.cache.ttl(quote, now=now))
+
+        # hasn't moved in a while
+        quote = self.FakeQuote(datetime(2020, 8, 14, 11, 40, 0))
+        self.assertEquals(240, self.cache.ttl(quote, now=now))
+
+        # closed market
+        quote = self.FakeQuote(datetime(2020, 8, 13, 17, 30, 0))
+        self.assertEquals(900, self.cache.ttl(quote, now=now))
+
+        # no timestamp means no caching
+        self.assertIsNone(self.cache.ttl(self.FakeQuote(None), now=now))
+        self.assertIsNone(self.cache.ttl("Here's your fake quote", now=now))
+
+    def test_spellings_of_one_instrument_share_an_entry(self):
+
+        class SearchTransport(HttpTransport):
+
+            searches = []
+
+            def request(self, method, url, **kwargs):
+                self.searches.append(url)
+                return "/aktier/volvo-b" if "volv" in url.lower() else "/aktier/saab-b"
+
+        class SearchingQuoteService(BaseQuoteService):
+
+            quotes = 0
+
+            def resolve_flow(self, ticker):
+                link = yield HttpRequest.get("https://example.com/search?q={}".format(ticker))
+                return link
+
+            def quote_flow(self, ticker):
+                link = yield from self.resolve_flow(ticker)
+                self.quotes += 1
+                return TestQuoteCache.FakeQuote(datetime.now())
+
+        path = tempfile.mkdtemp()
+        try:
+            history = TickHistory(path=path)
+            factory = QuoteServiceFactory(quote_cache=self.cache, history=history, transport=SearchTransport())
+            factory.providers = {"searching": SearchingQuoteService}
+            service = factory.get_service("searching")
+            first = service.get_quote("volvo")
+            self.assertIs(first, service.get_quote("Volvo B"))
+            self.assertIs(first, service.get_quote("volv-b"))
+            self.assertEquals(1, service.quotes)
+            self.assertEquals(1, self.cache.stats()["entries"])
+
+            service.get_quote("saab")
+            self.assertEquals(2, service.quotes)
+            self.assertEquals(2, self.cache.stats()["entries"])
+            self.assertEquals(["searching:/aktier/saab-b", "searching:/aktier/volvo-b"], history.instruments())
+        finally:
+            shutil.rmtree(path)
+
+    def test_factory_serves_quotes_from_cache(self):
+        factory = QuoteServiceFactory(quote_cache=self.cache)
+        factory.providers = {"fakeprovider": self.CountingQuoteService}
+        service = factory.get_service("fakeprovider")
+        self.assertEquals(self.CountingQuoteService, type(service))
+
+        # quotes without a timestamp always go to the provider
+        service.get_quote("aapl")
+        service.get_quote("aapl")
+        self.assertEquals(2, service.calls)
+
+        service.timestamp = datetime.now()
+        first = service.get_quote("aapl")
+        self.assertIs(first, service.get_quote("aapl"))
+        self.assertEquals(3, service.calls)
+
+        # keyed by ticker
+        service.get_quote("msft")
+        self.assertEquals(4, service.calls)
+        self.assertEquals(2, self.cache.stats()["entries"])
+
+    def test_avanza_timestamp(self):
+        clock = FakeClock(datetime(2017, 10, 10, 12, 0, 0))
+        quote = AvanzaQuote(clock=clock)
+        self.assertIsNone(quote.get_timestamp())
+        quote.lastUpdateTime = "11:15:48"
+        self.assertEquals(datetime(2017, 10, 10, 11, 15, 48), quote.get_timestamp())
+
+        # before the open the page still shows yesterday's close, which must not end up in the future
+        clock.now = datetime(2017, 10, 10, 8, 30, 0)
+        quote.lastUpdateTime = "17:29:59"
+        self.assertEquals(datetime(2017, 10, 9, 17, 29, 59), quote.get_timestamp())
+        path = tempfile.mkdtemp()
+        try:
+            history = TickHistory(path=path)
+            quote.lastPrice, quote.percentChange = 101.0, 0.5
+            self.assertTrue(history.record_quote("avanza", "FOO", quote))
+            # so the ticks of the day that follows are still recorded
+            clock.now = datetime(2017, 10, 10, 9, 5, 0)
+            quote.lastUpdateTime = "09:04:12"
+            quote.lastPrice = 102.0
+            self.assertTrue(history.record_quote("avanza", "FOO", quote))
+        finally:
+            shutil.rmtree(path)
+
+    def test_bloomberg_timestamp(self):
+        quote = BloombergQuote(message={"basicQuote": {"name": "foobar", "lastUpdateEpoch": "1507645468"}})
+        self.assertEquals(datetime.fromtimestamp(1507645468), quote.get_timestamp())
+        self.assertIsNone(BloombergQuote().get_timestamp())
+
+    def test_quote_ticks(self):
+        quote = BloombergQuote(message={"basicQuote": {"name": "foobar", "price": 12.5, "percentChange1Day": -1.25}})
+        self.assertEquals((12.5, -1.25), quote.get_tick())
+        self.assertIsNone(BloombergQuote().get_tick())
+
+        quote = AvanzaQuote()
+        self.assertIsNone(quote.get_tick())
+        quote.lastPrice = 101.0
+        quote.percentChange = 0.5
+        self.assertEquals((101.0, 0.5), quote.get_tick())
+
+
+class TestHtmlParser(unittest.TestCase):
+
+    def test_fast_parser_is_used_when_anchor_is_found(self):
+        parser = HtmlParser(parser="lxml", fallback="soup")
+        tree = parser.fromstring("<html><body><div id='surface'>foo</div></body></html>", anchor="//div[@id='surface']")
+        self.assertEquals("foo", tree.xpath("//div[@id='surface']")[0].text)
+        self.assertEquals(0, parser.fallbacks)
+
+    def test_fallback_when_anchor_is_missing(self):
+        calls = []
+        parser = HtmlParser(parser="lxml", fallback="fake")
+        parser.parsers = dict(HtmlParser.parsers, fake=lambda text: calls.append(text) or HtmlParser.parsers["lxml"](text))
+        parser.fromstring("<html><body><p>foo</p></body></html>", anchor="//div[@id='surface']")
+        self.assertEquals(1, len(calls))
+        self.assertEquals(1, parser.fallbacks)
+
+    def test_fallback_when_fast_parser_fails(self):
+        def broken(text):
+            raise ValueError("broken")
+
+        parser = HtmlParser(parser="broken", fallback="soup")
+        parser.parsers = dict(HtmlParser.parsers, broken=broken)
+        tree = parser.fromstring("<html><body><p>foo</p></body></html>")
+        self.assertEquals("foo", tree.xpath("//p")[0].text)
+        self.assertEquals(1, parser.fallbacks)
+
+
+class TestHttpTransport(unittest.TestCase):
+
+    def test_timeout_from_configuration(self):
+        transport = HttpTransport()
+        self.assertEquals((5.0, 30.0), transport.timeout)
+
+        transport = HttpTransport(connect_timeout=1, read_timeout=2)
+        self.assertEquals((1.0, 2.0), transport.timeout)
+
+    def test_default_headers(self):
+        transport = HttpTransport(headers={"User-Agent": "stockbot"})
+        self.assertEquals("stockbot", transport.session.headers["User-Agent"])
+
+    @patch('requests.Session.request')
+    def test_request_sets_timeout(self, request_mock):
+        transport = HttpTransport(connect_timeout=1, read_timeout=2)
+        transport.get("https://example.com")
+        request_mock.assert_called_once_with("GET", "https://example.com", timeout=(1.0, 2.0))
+
+    def test_standalone_services_use_default_transport(self):
+        self.assertIs(get_default_transport(), GoogleFinanceQueryService().transport)
+
+
+class TestAvanzaQuote(unittest.TestCase):
+
+    def test_extract_without_quote_bar_attributes(self):
+        tree = fromstring("""<html><body>
+            <div class="controlPanel"><div class="displayName"> Foo Index </div></div>
+            <div class="quote"><ul class="quoteBar" data-currency=" SEK">
+                <li><span class="changePercent">-1,50 %</span></li>
+                <li><span class="lastPrice SText">1 234,50</span></li>
+                <li><span class="updated">17:35:28</span></li>
+            </ul></div>
+            <span class="volumeWeightedAveragePrice">1 000,00</span>
+            <div class="history"><div class="content"><table><tbody>
+                <tr><td>1 vecka</td><td>1 200,00</td><td>2,88</td></tr>
+                <tr><td>i år</td><td>1 100,00</td><td>12,23</td></tr>
+            </tbody></table></div></div>
+            </body></html>""")
+        fields = AvanzaQuoteExtractor.extract(tree)
+        self.assertEquals({
+            "currency": "SEK",
+            "name": "Foo Index",
+            "ticker": "Foo Index",
+            "percentChange": -1.5,
+            "lastPrice": 1234.5,
+            "lastUpdateTime": "17:35:28",
+            "totalReturnYtd": 12.23,
+            "recommendationString": ""
+        }, fields)
+
 
 class TestAvanzaQueryService(unittest.TestCase):
 
@@ -361,8 +762,62 @@ class TestAvanzaQueryService(unittest.TestCase):
 class TestIbIndexQueryService(unittest.TestCase):
 
     def setUp(self):
+        IbIndexQueryService.snapshot_cache.clear()
         self.service = IbIndexQueryService()
 
+    def test_snapshot_is_shared_until_it_expires(self):
+        with vcr.use_cassette('mock/vcr_cassettes/ibindex/quote/all.yaml', allow_playback_repeats=True) as cassette:
+            search_result = self.service.search("invest")
+            quote = self.service.get_quote(search_result.get_ranked_ticker())
+            self.assertEquals("Investor B", quote.name)
+            self.assertEquals(1, cassette.play_count)
+
+            IbIndexQueryService.snapshot_cache.clear()
+            self.service.search("invest")
+            self.assertEquals(2, cassette.play_count)
+
+    def test_snapshot_index(self):
+        snapshot = IbIndexSnapshot([
+            {"product": "INVE B", "productName": "Investor B"},
+            {"product": "HAV B", "productName": "Havsfrun Investment B"},
+            {"product": "LUND B", "productName": "Lundbergföretagen B"}
+        ])
+        self.assertEquals(3, len(snapshot))
+        self.assertEquals("Investor B", snapshot.get("inve b")["productName"])
+        self.assertIsNone(snapshot.get("foo"))
+        self.assertEquals({"inve b", "hav b", "lund b"}, snapshot.tokens["b"])
+        self.assertEquals(["INVE B", "HAV B"], [x["product"] for x in snapshot.search("INVEST")])
+        self.assertEquals(["HAV B"], [x["product"] for x in snapshot.search("frun investment")])
+        self.assertEquals([], [x["product"] for x in snapshot.search("investor investment")])
+        self.assertEquals(["LUND B"], [x["product"] for x in snapshot.search("lund b")])
+
+    def test_snapshot_search_never_scans_the_vocabulary(self):
+
+        class NoScan(dict):
+
+            def __iter__(self):
+                raise AssertionError("vocabulary scanned")
+
+            def items(self):
+                raise AssertionError("vocabulary scanned")
+
+            def keys(self):
+                raise AssertionError("vocabulary scanned")
+
+            def values(self):
+                raise AssertionError("vocabulary scanned")
+
+        snapshot = IbIndexSnapshot([
+            {"product": "INVE B", "productName": "Investor B"},
+            {"product": "HAV B", "productName": "Havsfrun Investment B"}
+        ])
+        snapshot.tokens = NoScan(snapshot.tokens)
+        snapshot.fragments = NoScan(snapshot.fragments)
+        # exact words and parts of words alike
+        self.assertEquals(["INVE B"], [x["product"] for x in snapshot.search("investor")])
+        self.assertEquals(["INVE B", "HAV B"], [x["product"] for x in snapshot.search("invest")])
+        self.assertEquals([], snapshot.search("lundberg"))
+
     @vcr.use_cassette('mock/vcr_cassettes/ibindex/quote/all.yaml')
     def test_search_for_existing_quote(self):
         text = "investor"
@@ -430,3 +885,111 @@ class TestYahooQueryService(unittest.TestCase):
         text = "bytedance"
         result = self.service.get_quote(text)
         self.assertEqual("Didn't find anything", str(result))
+
+
+class TestAsyncQueryServices(unittest.TestCase):
+
+    @staticmethod
+    def run_async(service, method, *args):
+        return service.async_transport.run(getattr(service, method)(*args))
+
+    @vcr.use_cassette('mock/vcr_cassettes/yahoo/quote/microsoft.yaml', decode_compressed_response=True)
+    def test_yahoo_get_quote(self):
+        result = self.run_async(YahooQueryService(), "aget_quote", "microsoft")
+        self.assertRegexpMatches(str(result), "^Name: Microsoft Corporation, Price: [0-9\.]+, Low Price: [0-9\.]+, High Price: [0-9\.]+, Percent Change 1 Day: [0-9\.\-]+, Market: us_market, Update Time: [0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}")
+
+    @vcr.use_cassette('mock/vcr_cassettes/yahoo/quote/none_found.yaml', decode_compressed_response=True)
+    def test_yahoo_get_no_such_instrument(self):
+        result = self.run_async(YahooQueryService(), "aget_quote", "foo bar baz")
+        self.assertEquals("Didn't find anything", str(result))
+
+    @vcr.use_cassette('mock/vcr_cassettes/avanza/quote/avanza.yaml', decode_compressed_response=True)
+    def test_avanza_get_quote(self):
+        quote = self.run_async(AvanzaQueryService(), "aget_quote", "avanza")
+        self.assertEqual(type(quote), AvanzaQuote)
+        self.assertEqual("Name: Avanza Bank Holding, Price: 389.0, Low Price: 385.0, High Price: 389.6, %1D: 0.41, %YTD: 13.05, Recommendations (B/H/S): 1/2/1, Update Time: 11:15:48", str(quote))
+
+    @vcr.use_cassette('mock/vcr_cassettes/avanza/quote/avanza_zero.yaml', decode_compressed_response=True)
+    def test_avanza_get_fund(self):
+        quote = self.run_async(AvanzaQueryService(), "aget_quote", "avanza zero")
+        self.assertEqual(str(quote), "Name: Avanza Zero, %1D: 1.75663, %1M: 2.08861, %1Y: 47.45233, %YTD: 21.5053, Fee: 0.0%, Rating: 3/5, Top 3 Holdings: Atlas Copco A:SE:7.91%|Ericsson B:SE:6.55%|Evolution:SE:6.5%")
+
+    @vcr.use_cassette('mock/vcr_cassettes/google/quote/aapl.yaml', decode_compressed_response=True)
+    def test_google_get_quote(self):
+        q = self.run_async(GoogleFinanceQueryService(), "aget_quote", 'AAPL')
+        self.assertEquals("Name: Apple Inc., Price: 157.03, Open Price: 156.73, Low Price: 156.41, High Price: 157.28, Percent Change: 0.66", str(q))
+
+    @vcr.use_cassette('mock/vcr_cassettes/bloomberg/search/dax.yaml', decode_compressed_response=True)
+    def test_bloomberg_search(self):
+        res = self.run_async(BloombergQueryService(), "asearch", "dax")
+        self.assertEquals(BloombergSearchResult, type(res))
+        self.assertIn("Ticker: DAX:IND, Country: DE, Name: Deutsche Boerse AG German Stock Index DAX, Type: Index", res.result_as_list())
+
+    @vcr.use_cassette('mock/vcr_cassettes/ig/quote/sweden-30.yaml', decode_compressed_response=True)
+    def test_ig_get_quote(self):
+        res = self.run_async(IGQueryService(), "aget_quote", "sweden-30")
+        self.assertEqual(res.name, "Sweden 30")
+        self.assertEqual(res.ticker, "OMXS30")
+
+    @vcr.use_cassette('mock/vcr_cassettes/ibindex/quote/all.yaml', allow_playback_repeats=True)
+    def test_concurrent_calls_on_one_loop(self):
+        service = IbIndexQueryService()
+
+        async def gather():
+            return await asyncio.gather(service.asearch("invest"), service.aget_quote("inve b"),
+                                        service.aget_quote("abcdefghijklmnop"))
+
+        search_result, quote, missing = service.async_transport.run(gather())
+        self.assertEquals("Result: Ticker: HAV B | Ticker: INVE B", str(search_result))
+        self.assertEquals("Name: Investor B, NAV rebate percentage (reported): 15.455, NAV rebate percentage ("
+                          "calculated): 21.330, NAV datechange: 2020-04-22 00:00:00", str(quote))
+        self.assertEquals("No such quote: abcdefghijklmnop", str(missing))
+
+    def test_one_flow_for_both_apis(self):
+        requests = []
+
+        class FlowQuoteService(BaseQuoteService):
+
+            def quote_flow(self, ticker):
+                try:
+                    response = yield HttpRequest.get("https://example.com/{}".format(ticker))
+                except IOError as e:
+                    return "No quote for {}: {}".format(ticker, e)
+                return "Quote: {}".format(response)
+
+        class FakeTransport(HttpTransport):
+
+            def request(self, method, url, **kwargs):
+                requests.append(url)
+                if url.endswith("broken"):
+                    raise IOError("connection reset")
+                return url.split("/")[-1].upper()
+
+        class FakeAsyncTransport(AsyncHttpTransport):
+
+            async def request(self, method, url, **kwargs):
+                return FakeTransport.request(None, method, url, **kwargs)
+
+        service = FlowQuoteService(transport=FakeTransport(), async_transport=FakeAsyncTransport())
+        self.assertEquals("Quote: FOO", service.get_quote("foo"))
+        self.assertEquals("Quote: BAR", service.async_transport.run(service.aget_quote("bar")))
+        # failed requests are raised in the flow where it made them, on either transport
+        self.assertEquals("No quote for broken: connection reset", service.get_quote("broken"))
+        self.assertEquals("No quote for broken: connection reset",
+                          service.async_transport.run(service.aget_quote("broken")))
+        self.assertEquals(["https://example.com/foo", "https://example.com/bar", "https://example.com/broken",
+                           "https://example.com/broken"], requests)
+
+    def test_blocking_shim(self):
+
+        class AsyncOnlyQuoteService(BaseQuoteService):
+
+            async def aget_quote(self, ticker):
+                return "Here's your async quote for {}".format(ticker)
+
+            async def asearch(self, query):
+                return [query]
+
+        service = AsyncOnlyQuoteService()
+        self.assertEquals("Here's your async quote for foo", service.get_quote("foo"))
+        self.assertEquals(["bar"], service.search("bar"))
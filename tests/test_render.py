@@ -0,0 +1,82 @@
+import json
+import os
+import unittest
+
+from stockbot.provider.bloomberg import BloombergQuote
+from stockbot.provider.base import BaseQuote
+from stockbot.render import Field, IrcRenderer, JsonRenderer, PlainRenderer
+from stockbot.util import colorify
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+
+
+class FakeQuote(BaseQuote):
+
+    def __init__(self):
+        self.fields = [
+            Field("Name", "Avanza Bank Holding", Field.TITLE),
+            Field("Price", 389.0, Field.NUMBER),
+            Field("%1D", -0.41, Field.CHANGE),
+            Field("Percent Change 1 Day", "1.5", Field.IMPORTANT_CHANGE),
+            Field("Recommendations (B/H/S)", "1/2/1", Field.RECOMMENDATION),
+            Field("Update Time", "11:15:48")
+        ]
+
+
+class TestField(unittest.TestCase):
+
+    def test_kinds(self):
+        fields = FakeQuote().get_fields()
+        self.assertEquals([Field.TITLE, Field.NUMBER, Field.CHANGE, Field.IMPORTANT_CHANGE, Field.RECOMMENDATION,
+                           Field.TEXT], [f.kind for f in fields])
+        self.assertEquals(1.5, fields[3].number)
+
+    def test_kind_is_never_guessed_from_the_name(self):
+        self.assertEquals(Field.TEXT, Field("Percent Change", 1.0).kind)
+        self.assertEquals(Field.NUMBER, Field("Name", 1.0, Field.NUMBER).kind)
+
+    def test_missing_values_are_text(self):
+        self.assertEquals(Field.TEXT, Field("Price", "N/A", Field.NUMBER).kind)
+        self.assertEquals(Field.TEXT, Field("Recommendations (B/H/S)", "N/A", Field.RECOMMENDATION).kind)
+
+    def test_fields_are_built_once(self):
+        with open(os.path.join(CWD, "mock", "omxs30.json"), 'r') as f:
+            quote = BloombergQuote(message=json.load(f))
+        self.assertIs(quote.get_fields(), quote.get_fields())
+
+
+class TestRenderers(unittest.TestCase):
+
+    def test_irc_renderer_looks_like_colorify(self):
+        quote = FakeQuote()
+        self.assertEquals(colorify(str(quote)), IrcRenderer.render(quote))
+
+        with open(os.path.join(CWD, "mock", "omxs30.json"), 'r') as f:
+            quote = BloombergQuote(message=json.load(f))
+        self.assertEquals(colorify(str(quote)), IrcRenderer.render(quote))
+
+    def test_legacy_results_fall_back(self):
+        self.assertEquals(colorify("Ticker: FOO, Error: boom"), IrcRenderer.render("Ticker: FOO, Error: boom"))
+        self.assertEquals("Ticker: FOO", PlainRenderer.render("Ticker: FOO"))
+        self.assertEquals('"Ticker: FOO"', JsonRenderer.render("Ticker: FOO"))
+
+    def test_plain_renderer(self):
+        quote = FakeQuote()
+        self.assertEquals(str(quote), PlainRenderer.render(quote))
+
+    def test_values_with_separators_are_kept_intact(self):
+        class HoldingsQuote(BaseQuote):
+            def __init__(self):
+                self.fields = [Field("Name", "Fund", Field.TITLE), Field("Top 3 Holdings", "Foo:SE:7.9%|Bar:SE:6.5%")]
+
+        self.assertIn("Foo:SE:7.9%|Bar:SE:6.5%", IrcRenderer.render(HoldingsQuote()))
+
+    def test_json_renderer(self):
+        self.assertEquals({
+            "Name": "Avanza Bank Holding",
+            "Price": 389.0,
+            "%1D": -0.41,
+            "Percent Change 1 Day": "1.5",
+            "Recommendations (B/H/S)": "1/2/1",
+            "Update Time": "11:15:48"
+        }, json.loads(JsonRenderer.render(FakeQuote())))
@@ -0,0 +1,109 @@
+import unittest
+from datetime import datetime, timedelta
+
+from stockbot.schedule import CommandTimer, CronSchedule, IntervalSchedule, TimeWindow, command_schedules, \
+    parse_range, parse_schedule, schedule_from_string
+from tests.fakes import FakeClock
+
+
+class TestTimeWindow(unittest.TestCase):
+
+    def test_office_hours(self):
+        window = TimeWindow(days=[1, 2, 3, 4, 5], hours=[9, 10, 11, 12, 13, 14, 15, 16, 17])
+        for d in [9, 10, 11, 12, 13]:
+            for h in range(24):
+                dt = datetime(2017, 10, d, h)
+                self.assertEquals(9 <= h < 18, window.contains(dt))
+        for d in [14, 15]:
+            for h in range(24):
+                self.assertFalse(window.contains(datetime(2017, 10, d, h)))
+
+        # friday evening opens again on monday morning
+        self.assertEquals(datetime(2017, 10, 16, 9), window.next_open(datetime(2017, 10, 13, 18, 30)))
+
+    def test_parse_range(self):
+        self.assertEquals([9, 10, 11], parse_range("9-11", 0, 23))
+        self.assertEquals([0, 15, 30, 45], parse_range("*/15", 0, 59))
+        self.assertEquals([1, 3, 5, 6], parse_range("1-5/2,6", 1, 7))
+        with self.assertRaises(ValueError):
+            parse_range("24", 0, 23)
+
+
+class TestSchedule(unittest.TestCase):
+
+    def test_interval_is_spread_by_key(self):
+        schedule = IntervalSchedule(interval=3600)
+        now = datetime(2017, 10, 9, 12, 0, 0)
+        runs = set([schedule.next_run(now, "quote get avanza {}".format(i)).minute for i in range(10)])
+        self.assertTrue(len(runs) > 5)
+
+        first = schedule.next_run(now, "foo")
+        self.assertTrue(now < first <= now + timedelta(hours=1))
+        self.assertEquals(first + timedelta(hours=1), schedule.next_run(first, "foo"))
+
+    def test_interval_within_window(self):
+        schedule = schedule_from_string("every 15m hours 9-17 days 1-5")
+        # friday night
+        first = schedule.next_run(datetime(2017, 10, 13, 20, 0), "foo")
+        self.assertEquals(datetime(2017, 10, 16), first.replace(hour=0, minute=0, second=0))
+        self.assertEquals(9, first.hour)
+
+    def test_cron(self):
+        schedule = schedule_from_string("cron 30 9 * * 1-5")
+        self.assertEquals(datetime(2017, 10, 13, 9, 30), schedule.next_run(datetime(2017, 10, 12, 9, 30)))
+        self.assertEquals(datetime(2017, 10, 16, 9, 30), schedule.next_run(datetime(2017, 10, 13, 9, 30)))
+
+        # either day field matches when both are restricted
+        schedule = CronSchedule(fields=["0", "0", "1", "*", "0"])
+        self.assertEquals(datetime(2017, 10, 15), schedule.next_run(datetime(2017, 10, 13)))
+        self.assertEquals(datetime(2017, 11, 1), schedule.next_run(datetime(2017, 10, 29)))
+
+    def test_parse(self):
+        schedule, consumed = parse_schedule(["every", "1h", "days", "1-5", "quote", "get", "avanza", "foo"])
+        self.assertEquals(4, consumed)
+        self.assertEquals("every 1h days 1-5", str(schedule))
+        self.assertEquals("cron */5 * * * *", str(schedule_from_string("cron */5 * * * *")))
+        self.assertRaises(ValueError, parse_schedule, ["every", "soon"])
+        self.assertRaises(ValueError, parse_schedule, ["cron", "*"])
+
+
+class TestCommandTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(datetime(2017, 10, 9, 12, 0, 0))
+        self.timer = CommandTimer(clock=self.clock)
+
+    def test_jobs_come_due_in_order(self):
+        self.timer.add("a", schedule_from_string("cron 10 * * * *"))
+        self.timer.add("b", schedule_from_string("cron 5 * * * *"))
+        self.assertEquals(datetime(2017, 10, 9, 12, 5), self.timer.next_run())
+        self.assertEquals([], self.timer.pop_due())
+
+        self.clock.now = datetime(2017, 10, 9, 12, 10)
+        self.assertEquals(["b", "a"], self.timer.pop_due())
+        self.assertEquals([], self.timer.pop_due())
+        self.assertEquals(datetime(2017, 10, 9, 13, 5), self.timer.next_run())
+        self.assertEquals(datetime(2017, 10, 9, 13, 10), self.timer.next_run_of("a"))
+
+    def test_remove_and_sync(self):
+        self.timer.add("a", schedule_from_string("cron 5 * * * *"))
+        self.timer.add("b", schedule_from_string("cron 10 * * * *"))
+        self.timer.remove("a")
+        self.assertEquals(datetime(2017, 10, 9, 12, 10), self.timer.next_run())
+
+        # unchanged jobs keep their next run, changed ones are rescheduled and missing ones dropped
+        self.timer.sync({"b": schedule_from_string("cron 10 * * * *"), "c": schedule_from_string("cron 1 * * * *")})
+        self.assertEquals(2, len(self.timer))
+        self.clock.now = datetime(2017, 10, 9, 13, 30)
+        self.assertEquals(["c", "b"], self.timer.pop_due())
+        self.timer.sync({})
+        self.assertIsNone(self.timer.next_run())
+
+    def test_command_schedules(self):
+        class Row(object):
+            command = "foo"
+            schedule = "cron 0 9 * * *"
+
+        schedules = command_schedules(["foo", "bar"], [Row()], 600)
+        self.assertEquals("cron 0 9 * * *", str(schedules["foo"]))
+        self.assertEquals("every 10m", str(schedules["bar"]))
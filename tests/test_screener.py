@@ -0,0 +1,72 @@
+import unittest
+
+from stockbot.db import Session, create_tables, drop_tables
+from stockbot.provider.google import StockDomain
+from stockbot.screener import Screen, ScreenFilter, StockScreener
+
+
+class TestScreen(unittest.TestCase):
+
+    def test_parse(self):
+        screen = Screen.parse(["price_to_earnings<15", "dividend_yield>=3.5", "sort", "roae_last_y", "desc",
+                               "limit", "10"])
+        self.assertEquals(["price_to_earnings<15", "dividend_yield>=3.5"], [str(f) for f in screen.filters])
+        self.assertEquals("roae_last_y", screen.sort)
+        self.assertTrue(screen.descending)
+        self.assertEquals(10, screen.limit)
+        self.assertEquals(["price_to_earnings", "dividend_yield", "roae_last_y"], screen.fields())
+
+        self.assertEquals("!=", ScreenFilter.parse("beta!=-1.5").op)
+        self.assertRaises(ValueError, Screen.parse, ["price_to_earnings<cheap"])
+        self.assertRaises(ValueError, Screen.parse, ["sort"])
+        self.assertRaises(ValueError, Screen.parse, ["beta>1", "limit", "100"])
+        self.assertRaises(ValueError, Screen.parse, [])
+
+
+class TestStockScreener(unittest.TestCase):
+
+    def setUp(self):
+        create_tables()
+        session = Session()
+        session.add_all([
+            StockDomain(ticker="AAA", name="Cheap", price_to_earnings=8.0, dividend_yield=5.0, roae_last_y=12.0),
+            StockDomain(ticker="BBB", name="Pricey", price_to_earnings=40.0, dividend_yield=0.5, roae_last_y=30.0),
+            StockDomain(ticker="CCC", name="Solid", price_to_earnings=14.0, dividend_yield=3.5, roae_last_y=18.0),
+            StockDomain(ticker="DDD", name="Unknown", price_to_earnings=None, dividend_yield=4.0, roae_last_y=None)
+        ])
+        session.commit()
+        session.close()
+        self.screener = StockScreener()
+
+    def tearDown(self):
+        drop_tables()
+
+    def test_screen(self):
+        result = self.screener.screen(Screen.parse(["price_to_earnings<15", "dividend_yield>3",
+                                                    "sort", "roae_last_y", "desc"]))
+        self.assertEquals(4, len(self.screener))
+        self.assertEquals(["CCC", "AAA"], list(result.rows["ticker"]))
+        lines = result.as_list()
+        self.assertEquals("Matched 2 of 4 stocks", lines[0])
+        self.assertEquals(["1: Ticker: CCC, Name: Solid, price_to_earnings: 14, dividend_yield: 3.5, roae_last_y: 18",
+                           "2: Ticker: AAA, Name: Cheap, price_to_earnings: 8, dividend_yield: 5, roae_last_y: 12"],
+                          lines[1:])
+
+        # missing values never match and sort last
+        result = self.screener.screen(Screen.parse(["dividend_yield>1", "sort", "roae_last_y"]))
+        self.assertEquals(["AAA", "CCC", "DDD"], list(result.rows["ticker"]))
+        result = self.screener.screen(Screen.parse(["sort", "price_to_earnings", "desc", "limit", "2"]))
+        self.assertEquals(4, result.matched)
+        self.assertEquals(["BBB", "CCC"], list(result.rows["ticker"]))
+
+        self.assertRaises(ValueError, self.screener.screen, Screen.parse(["market_cap>1"]))
+
+    def test_snapshot_is_only_replaced_on_refresh(self):
+        self.assertEquals(4, self.screener.refresh())
+        session = Session()
+        session.add(StockDomain(ticker="EEE", name="New", price_to_earnings=5.0))
+        session.commit()
+        session.close()
+        self.assertEquals(0, self.screener.screen(Screen.parse(["price_to_earnings<6"])).matched)
+        self.assertEquals(5, self.screener.refresh())
+        self.assertEquals(1, self.screener.screen(Screen.parse(["price_to_earnings<6"])).matched)